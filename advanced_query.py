@@ -1,24 +1,61 @@
-from nltk.corpus import stopwords
-from autocorrect import Speller
-
-def auto_correct(words):
-    spell = Speller()
-    corrected_words_list = [spell(word) for word in words.split()]
-    corrected_phrase = ' '.join(corrected_words_list)
-    return corrected_phrase
-
-
-def preprocess_query(word):
-    stop_words = set(stopwords.words('english'))
-    word = auto_correct(word)
-    word_list = word.split()
-    # Filter out stopwords and create tuples of words and their positions
-    processed_query = [(word, index) for index, word in enumerate(word_list) if word.lower() not in stop_words]
+from functools import partial, reduce
+import numpy as np
+from posting_list import PostingList
+from proximity import pair_bonus
+from query_cache import query_key
+from analyzer import get_analyzer
+from metrics import query_trace, stage, record_posting_size
+
+def auto_correct(words, corrector):
+    """
+    Correct every word against the index vocabulary; without a corrector the words are left as they are.
+    """
+    if corrector is None:
+        return words
+    with stage("auto_correct"):
+        corrected_words_list = [corrector.correct(word) for word in words]
+    return corrected_words_list
+
+
+def preprocess_query(word, corrector=None):
+    # Normalize the query exactly like indexed text, keeping the position of every word
+    with stage("preprocess_query"):
+        processed_query = get_analyzer().analyze_query(word)
+    corrected_words = auto_correct([term for term, _ in processed_query], corrector)
+    processed_query = [(term, index) for term, (_, index) in zip(corrected_words, processed_query)]
     return processed_query
 
 
-def advanced_query(word, index, bigram_index, bigram_positions, bookkeeping_input):
-    processed_query = preprocess_query(word)
+def advanced_query(word, index, bigram_index, bigram_positions, bookkeeping_input, cache=None, corrector=None):
+    with query_trace(word):
+        if is_boolean_query(word):
+            return boolean_results(word, index, bigram_index, bigram_positions, cache, corrector)
+        processed_query = preprocess_query(word, corrector)
+        if cache is not None:
+            return cache.get_or_compute(query_key("all", processed_query),
+                                        lambda: processed_query_results(processed_query, index, bigram_index,
+                                                                        bigram_positions, bookkeeping_input))
+        return processed_query_results(processed_query, index, bigram_index, bigram_positions, bookkeeping_input)
+
+
+def is_boolean_query(word):
+    # query_language builds on this module, so it is imported when it is used
+    from query_language import is_boolean_query
+    return is_boolean_query(word)
+
+
+def boolean_results(word, index, bigram_index, bigram_positions, cache=None, corrector=None):
+    """
+    Every document matching a query of the query language, ranked.
+    """
+    from query_language import boolean_query
+    if cache is not None:
+        return cache.get_or_compute(("boolean", word.strip()),
+                                    lambda: boolean_query(word, index, bigram_index, bigram_positions, corrector)[0])
+    return boolean_query(word, index, bigram_index, bigram_positions, corrector)[0]
+
+
+def processed_query_results(processed_query, index, bigram_index, bigram_positions, bookkeeping_input):
     query_length = len(processed_query)
     if query_length < 1:
         result_list = []
@@ -28,27 +65,37 @@ def advanced_query(word, index, bigram_index, bigram_positions, bookkeeping_inpu
     elif query_length == 2:
         result_list = two_word_query(processed_query, bigram_index, bookkeeping_input)
     else:
-        result_list = multi_word_query(processed_query, bigram_index, bigram_positions, bookkeeping_input)
+        result_list = multi_word_query(processed_query, index, bigram_index, bigram_positions, bookkeeping_input)
     return result_list
 
 
 def ranked_retrieval(word, index):
     ranked_list = []
     if word in index:
-        posting_list = index[word]
-        for posting in posting_list:
-            ranked_score = (0.5 * posting.tf_idf_score) + posting.html_tag_weight + posting.pagerank_weight
-            posting.final_weight = ranked_score
-            ranked_list.append(posting)
-
-    unique_results = {}
-    for item in ranked_list:
-        doc_id = item.doc_id
-        if doc_id not in unique_results:
-            unique_results[doc_id] = item
-    unique_results_list = list(unique_results.values())
-    
-    ranked_list = sorted(unique_results_list, key=lambda x: x.final_weight, reverse=True)
+        posting_list = lookup_postings(word, index)
+        scores = (0.5 * posting_list.tf_idf_score) + posting_list.html_tag_weight + posting_list.pagerank_weight
+        ranked_list = rank_unique_postings(posting_list, scores)
+    return ranked_list
+
+
+def lookup_postings(term, index):
+    with stage("posting_lookup"):
+        posting_list = index[term]
+    record_posting_size(term, posting_list)
+    return posting_list
+
+
+def rank_unique_postings(posting_list, scores):
+    """
+    Keep the first posting of every document and order them by score, highest first.
+    Ties keep their posting-list order, as a stable sort would.
+    """
+    with stage("sorting"):
+        _, first_positions = np.unique(posting_list.doc_ids, return_index=True)
+        first_positions.sort()
+        ranked_positions = first_positions[np.argsort(-scores[first_positions], kind="stable")]
+    ranked_list = posting_list.take(ranked_positions)
+    ranked_list.final_weight = scores[ranked_positions]
     return ranked_list
 
 
@@ -60,8 +107,7 @@ def get_results(ranked_list, bookkeeping_input):
     if not ranked_list:
         return result_list
     else:
-        for posting in ranked_list:
-            result_list.append(posting.doc_id)
+        result_list = ranked_list.doc_keys()
     return  result_list
 
 
@@ -85,49 +131,75 @@ def two_word_query(processed_query, bigram_index, bookkeeping_input):
     return result_list
 
 
-def multi_word_query(processed_query, bigram_index, bigram_positions, bookkeeping_input):
+def multi_word_query(processed_query, index, bigram_index, bigram_positions, bookkeeping_input):
     """
     Performs a query and displays the results.
     """
     results_list = []
     bigram_pairs = generate_bigram_pairs(processed_query, bigram_index, results_list)
-    ranked_list = multi_word_ranked_retrieval(bigram_pairs, results_list, bigram_index, bigram_positions)
+    if not results_list:
+        return word_results(processed_query, index, bigram_index, bigram_positions)
+    ranked_list = multi_word_ranked_retrieval(bigram_pairs, results_list, bigram_index)
     result_list = get_results(ranked_list, bookkeeping_input)
     return result_list
 
 
-def multi_word_ranked_retrieval(bigram_pairs, results_list, bigram_index, bigram_positions):
-    add_word_position_score(bigram_pairs, results_list, bigram_index, bigram_positions)
-    add_normalized_vector_weight(bigram_pairs, results_list, bigram_index)
-    for posting in results_list:
-        ranked_score = ((0.5 * posting.tf_idf_score) + posting.html_tag_weight + posting.pagerank_weight
-                        + (4 * posting.normalized_vector_weight))
-        posting.final_weight = ranked_score
+def word_results(processed_query, index, bigram_index, bigram_positions):
+    """
+    Every document matching the words of a query none of whose bigrams is in the bigram index, ranked: the
+    planner of the query language matches all the words or, if no document holds them all, any of them.
+    """
+    from query_language import word_query
+    return get_results(word_query([term for term, _ in processed_query], index, bigram_index, bigram_positions),
+                       None)
+
+
+def has_query_bigram(processed_query, bigram_index):
+    return any(first + " " + second in bigram_index for (first, _), (second, _) in zip(processed_query,
+                                                                                         processed_query[1:]))
+
+
+def multi_word_ranked_retrieval(bigram_pairs, results_list, bigram_index):
+    if not results_list:
+        return []
+    results = PostingList.concatenate(results_list)
+    add_normalized_vector_weight(bigram_pairs, results, bigram_index)
+    # The proximity bonus is not part of the score, as it never has been; counting it would change the ranking
+    results.final_weight = ((0.5 * results.tf_idf_score) + results.html_tag_weight + results.pagerank_weight
+                             + (4 * results.normalized_vector_weight))
 
-    unique_results = {}
-    for item in results_list:
-        doc_id = item.doc_id
-        if doc_id not in unique_results:
-            unique_results[doc_id] = item
-    unique_results_list = list(unique_results.values())
-    
-    ranked_list = sorted(unique_results_list, key=lambda x: x.final_weight, reverse=True)
+    ranked_list = rank_unique_postings(results, results.final_weight)
 
     return ranked_list
 
 
 def generate_bigram_pairs(processed_query, bigram_index, results_list):
-    bigram_pairs = []
-    for i in range(len(processed_query) - 1):
-        bigram = processed_query[i][0] + " " + processed_query[i + 1][0]
-        difference = processed_query[i + 1][1] - processed_query[i][1]
-        bigram_pairs.append((bigram, difference))
+    bigram_pairs = query_bigram_pairs(processed_query)
+    for bigram, _ in bigram_pairs:
         if bigram in bigram_index:
-            results_list.extend(bigram_index[bigram])
+            results_list.append(lookup_postings(bigram, bigram_index))
     return bigram_pairs
 
 
-def add_word_position_score(bigram_pairs, results_list, bigram_index, bigram_positions):
+def query_bigram_pairs(processed_query):
+    """
+    The (bigram, distance between its words) pairs of consecutive query words.
+    """
+    return [(first + " " + second, second_index - first_index)
+            for (first, first_index), (second, second_index) in zip(processed_query, processed_query[1:])]
+
+
+def proximity_bonus(bigram_pairs, bigram_index, bigram_positions):
+    """
+    Return the proximity bonus of every document that contains two consecutive query bigrams,
+    keyed by doc number.
+    """
+    with stage("word_position_score"):
+        return pair_proximity_bonus(bigram_pairs, bigram_index, bigram_positions)
+
+
+def pair_proximity_bonus(bigram_pairs, bigram_index, bigram_positions):
+    bonus_by_doc = {}
     for i in range(len(bigram_pairs) - 1):
         bigram1, bigram1_pos = bigram_pairs[i]
         bigram2, bigram2_pos = bigram_pairs[i + 1]
@@ -140,45 +212,228 @@ def add_word_position_score(bigram_pairs, results_list, bigram_index, bigram_pos
         postings1 = bigram_index[bigram1]
         postings2 = bigram_index[bigram2]
 
-        doc_id_set1 = set(posting.doc_id for posting in postings1)
-        doc_id_set2 = set(posting.doc_id for posting in postings2)
-        common_doc_ids = doc_id_set1.intersection(doc_id_set2)
-
-        for doc_id in common_doc_ids:
-            bigram_tup1 = (bigram1, doc_id)
-            bigram_tup2 = (bigram2, doc_id)
+        common_doc_ids = np.intersect1d(postings1.doc_ids, postings2.doc_ids, assume_unique=True)
 
-            if bigram_tup1 not in bigram_positions or bigram_tup2 not in bigram_positions:
+        for doc_number in common_doc_ids.tolist():
+            positions1 = bigram_positions.positions(bigram1, doc_number)
+            positions2 = bigram_positions.positions(bigram2, doc_number)
+            if positions1 is None or positions2 is None:
                 continue
 
-            positions1 = bigram_positions[bigram_tup1]
-            positions2 = bigram_positions[bigram_tup2]
+            bonus_by_doc[doc_number] = bonus_by_doc.get(doc_number, 0) + pair_bonus(positions1, positions2,
+                                                                                    proximity_range)
+    return bonus_by_doc
 
-            for pos1 in positions1:
-                for pos2 in positions2:
-                    distance = abs(pos1 - pos2)
 
-                    if distance <= proximity_range:
-                        for k in range(len(results_list)):
-                            if results_list[k].doc_id == doc_id:
-                                results_list[k].final_weight += 1
-                                round(results_list[k].final_weight, 2)
-                    elif distance > proximity_range:
-                        for k in range(len(results_list)):
-                            if results_list[k].doc_id == doc_id:
-                                results_list[k].final_weight += 0.1
-                                round(results_list[k].final_weight, 2)
+def add_normalized_vector_weight(bigram_pairs, results_list, bigram_index):
+    normalized_denominator = query_vector_length(bigram_pairs, bigram_index)
+    with stage("normalized_vector_weight"):
+        results_list.normalized_vector_weight = np.round(results_list.normalized_vector_weight
+                                                         / normalized_denominator, 3)
 
 
-def add_normalized_vector_weight(bigram_pairs, results_list, bigram_index):
+def query_vector_length(bigram_pairs, bigram_index):
     normalized_denominator = 0
-    for i, (bigram, value) in enumerate(bigram_pairs):
-        if bigram in bigram_index:
-            idf = bigram_index[bigram][0].idf
-            bigram_pairs[i] = (bigram, idf)
-    for bigram, idf in bigram_pairs:
-        normalized_denominator += idf ** 2
-    normalized_denominator = normalized_denominator ** 0.5
-    for posting in results_list:
-        normalized_vector_weight = round(posting.normalized_vector_weight / normalized_denominator, 3)
-        posting.normalized_vector_weight = normalized_vector_weight
\ No newline at end of file
+    with stage("normalized_vector_weight"):
+        for i, (bigram, value) in enumerate(bigram_pairs):
+            if bigram in bigram_index:
+                bigram_pairs[i] = (bigram, bigram_index.idf(bigram))
+        for bigram, idf in bigram_pairs:
+            normalized_denominator += idf ** 2
+    return normalized_denominator ** 0.5
+
+
+def top_k_query(word, index, bigram_index, bigram_positions, bookkeeping_input, k=20, cache=None,
+                corrector=None, champion_lists=True):
+    """
+    Same ranking as advanced_query, but only the k best results are selected and ordered.
+    Returns the results and an estimate of the total number of matching documents.
+    With champion_lists, indexes built with champion lists answer from them first.
+    Queries of the query language are answered by its planner, with the exact number of matching documents, and
+    so are queries of three or more words none of whose bigrams is in the bigram index.
+    """
+    with query_trace(word):
+        if is_boolean_query(word):
+            result_list = boolean_results(word, index, bigram_index, bigram_positions, cache, corrector)
+            return result_list[:k], len(result_list)
+        processed_query = preprocess_query(word, corrector)
+        if cache is not None:
+            return cache.get_or_compute(query_key("top_k", processed_query, k, champion_lists),
+                                        lambda: processed_top_k_results(processed_query, index, bigram_index,
+                                                                        bigram_positions, bookkeeping_input, k,
+                                                                        champion_lists))
+        return processed_top_k_results(processed_query, index, bigram_index, bigram_positions, bookkeeping_input, k,
+                                       champion_lists)
+
+
+def processed_top_k_results(processed_query, index, bigram_index, bigram_positions, bookkeeping_input, k,
+                            champion_lists=False):
+    query_length = len(processed_query)
+    if query_length < 1:
+        print("No Results Found! Try again.")
+        return [], 0
+    elif query_length == 1:
+        ranked_list, total_hits = top_k_ranked_retrieval(processed_query[0][0], index, k, champion_lists)
+    elif query_length == 2:
+        word = processed_query[0][0] + " " + processed_query[1][0]
+        ranked_list, total_hits = top_k_ranked_retrieval(word, bigram_index, k, champion_lists)
+    elif not has_query_bigram(processed_query, bigram_index):
+        result_list = word_results(processed_query, index, bigram_index, bigram_positions)
+        return result_list[:k], len(result_list)
+    else:
+        ranked_list = None
+        if champion_lists and bigram_index.champion_size:
+            ranked_list, total_hits = champion_multi_word_retrieval(processed_query, bigram_index, k)
+        if ranked_list is None:
+            ranked_list, total_hits = top_k_multi_word_ranked_retrieval(query_bigram_pairs(processed_query),
+                                                                        bigram_index, k)
+    return get_results(ranked_list, bookkeeping_input), total_hits
+
+
+class ChampionView:
+    """
+    Index whose posting lists are the champion lists of the wrapped index; the document frequencies and
+    score bounds, which stay those of the whole lists, and every other attribute come from the wrapped index.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def __contains__(self, term):
+        return term in self.index
+
+    def __getitem__(self, term):
+        return self.index.champions(term)
+
+    def intersect_doc_numbers(self, terms):
+        doc_numbers = [self.index.champions(term).doc_ids for term in terms]
+        return reduce(partial(np.intersect1d, assume_unique=True), doc_numbers)
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+
+def top_k_ranked_retrieval(word, index, k, champion_lists=False):
+    """
+    Top k of ranked_retrieval by partial selection: the index holds one posting per document, so every
+    posting of the list is scored and np.partition picks the k best instead of a deduplication and a full sort.
+    Nothing is skipped unless champion_lists is set: a champion list of at least k postings holds the k best
+    postings of the term by this same score, so it is read instead of the whole list whenever it is long enough.
+    """
+    if word not in index:
+        return [], 0
+    if champion_lists and index.champion_size >= k:
+        posting_list = lookup_postings(word, ChampionView(index))
+        total_hits = index.document_frequency(word)
+    else:
+        posting_list = lookup_postings(word, index)
+        total_hits = len(posting_list)
+    with stage("sorting"):
+        scores = (0.5 * posting_list.tf_idf_score) + posting_list.html_tag_weight + posting_list.pagerank_weight
+        positions = np.arange(len(posting_list))
+        if len(posting_list) > k:
+            threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+            above = np.flatnonzero(scores > threshold)
+            ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+            positions = np.sort(np.concatenate([above, ties]))
+        order = np.argsort(-scores[positions], kind="stable")
+    ranked_list = posting_list.take(positions[order])
+    ranked_list.final_weight = scores[positions[order]]
+    return ranked_list, total_hits
+
+
+def champion_multi_word_retrieval(processed_query, bigram_index, k):
+    """
+    top_k_multi_word_ranked_retrieval over the champion lists of the query bigrams. The champion lists rank by
+    the static score only, so a document outside all of them is missed, and a document is scored by the first
+    champion list holding it: a faster, approximate top k.
+    Returns None when the champion lists give fewer than k results and are not the whole lists.
+    """
+    bigram_pairs = query_bigram_pairs(processed_query)
+    list_lengths = [bigram_index.document_frequency(bigram) for bigram, _ in bigram_pairs if bigram in bigram_index]
+    ranked_list, _ = top_k_multi_word_ranked_retrieval(bigram_pairs, ChampionView(bigram_index), k)
+    if len(ranked_list) < k and any(length > bigram_index.champion_size for length in list_lengths):
+        return None, 0
+    return ranked_list, estimate_total_hits(list_lengths, bigram_index.doc_count)
+
+
+def top_k_multi_word_ranked_retrieval(bigram_pairs, bigram_index, k):
+    """
+    Top k of multi_word_ranked_retrieval, reading only the posting lists that can reach it.
+    Returns the results and an estimate of the total number of matching documents.
+    """
+    ranked_list, _, list_lengths = top_k_bigram_lists(bigram_pairs, bigram_index, k)
+    return ranked_list, estimate_total_hits(list_lengths, bigram_index.doc_count)
+
+
+def top_k_bigram_lists(bigram_pairs, bigram_index, k):
+    """
+    MaxScore-style top k over the posting lists of the query bigrams. Returns the ranked postings, the number of
+    the query bigram whose list scored each of them, and the length of every list found in the index.
+
+    A document is scored by the first query bigram list that contains it, so posting lists are
+    visited in query order with a bounded set of the k best (score, list, position) entries. A list
+    whose stored score bound cannot beat the current k-th score is skipped without being read. A list
+    that is read drops the documents an earlier list holds: those of a skipped list come from
+    intersecting it with the list, whose skip table limits the doc numbers decoded to the blocks that
+    may match. The proximity bonus does not count in the final score, so it is not computed.
+    """
+    found_pairs = [(bigram_number, bigram) for bigram_number, (bigram, _) in enumerate(bigram_pairs)
+                   if bigram in bigram_index]
+    list_lengths = [bigram_index.document_frequency(bigram) for _, bigram in found_pairs]
+    if not found_pairs:
+        return [], np.empty(0, dtype=np.int64), list_lengths
+    normalized_denominator = query_vector_length(bigram_pairs, bigram_index)
+
+    top_scores = np.empty(0)
+    top_lists = np.empty(0, dtype=np.int64)
+    top_positions = np.empty(0, dtype=np.int64)
+    read_lists = {}
+    with stage("top_k_scoring"):
+        for list_number, (bigram_number, bigram) in enumerate(found_pairs):
+            max_score, max_normalized_weight = bigram_index.score_bounds(bigram)
+            # round(x, 3) adds at most 0.0005 to the normalized weight; leave some slack for float error
+            upper_bound = max_score + 4 * (max_normalized_weight / normalized_denominator + 0.001)
+            # Earlier lists hold earlier positions, so a tie with the k-th score can never win here
+            if len(top_scores) >= k and upper_bound <= top_scores[-1]:
+                continue
+            posting_list = lookup_postings(bigram, bigram_index)
+            seen_doc_ids = [np.intersect1d(read_lists[earlier_number].doc_ids, posting_list.doc_ids,
+                                           assume_unique=True)
+                            if earlier_number in read_lists else
+                            bigram_index.intersect_doc_numbers([found_pairs[earlier_number][1], bigram])
+                            for earlier_number in range(list_number)]
+            candidates = np.flatnonzero(np.isin(posting_list.doc_ids, np.concatenate(seen_doc_ids), invert=True)) \
+                if seen_doc_ids else np.arange(len(posting_list))
+
+            normalized_vector_weight = np.round(posting_list.normalized_vector_weight[candidates]
+                                                / normalized_denominator, 3)
+            scores = ((0.5 * posting_list.tf_idf_score[candidates]) + posting_list.html_tag_weight[candidates]
+                      + posting_list.pagerank_weight[candidates] + (4 * normalized_vector_weight))
+
+            top_scores = np.concatenate([top_scores, scores])
+            top_lists = np.concatenate([top_lists, np.full(len(candidates), list_number)])
+            top_positions = np.concatenate([top_positions, candidates])
+            order = np.lexsort((top_positions, top_lists, -top_scores))[:k]
+            top_scores, top_lists, top_positions = top_scores[order], top_lists[order], top_positions[order]
+            read_lists[list_number] = posting_list
+
+    bigram_numbers = np.array([found_pairs[list_number][0] for list_number in top_lists.tolist()], dtype=np.int64)
+    if not len(top_scores):
+        return [], bigram_numbers, list_lengths
+    ranked_list = PostingList.concatenate([read_lists[list_number].take([position])
+                                           for list_number, position in zip(top_lists.tolist(),
+                                                                            top_positions.tolist())])
+    ranked_list.final_weight = top_scores
+    return ranked_list, bigram_numbers, list_lengths
+
+
+def estimate_total_hits(list_lengths, total_docs):
+    """
+    Estimate how many documents match any of the posting lists of these lengths, assuming terms occur
+    independently.
+    """
+    missing_probability = 1
+    for length in list_lengths:
+        missing_probability *= 1 - min(length / total_docs, 1)
+    return round(total_docs * (1 - missing_probability))
\ No newline at end of file
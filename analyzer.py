@@ -0,0 +1,106 @@
+import os
+import re
+from functools import lru_cache
+
+TOKEN_SEPARATOR = re.compile(r'[^a-zA-Z]')
+# Pre-provisioned NLTK data; the query path never downloads anything
+NLTK_DATA_DIR = os.environ.get("NLTK_DATA", os.path.join(os.path.dirname(os.path.abspath(__file__)), "nltk_data"))
+NLTK_RESOURCES = ('punkt', 'stopwords', 'wordnet', 'words')
+
+
+def use_local_nltk_data(data_dir=NLTK_DATA_DIR):
+    """
+    Make NLTK look in data_dir before its default locations.
+    """
+    import nltk
+    if data_dir not in nltk.data.path:
+        nltk.data.path.insert(0, data_dir)
+
+
+def download_nltk_data(data_dir=NLTK_DATA_DIR):
+    """
+    Provision the NLTK resources used by the Analyzer into data_dir. Needs network access,
+    so run it once when setting up a host, not at import time.
+    """
+    import nltk
+    for resource in NLTK_RESOURCES:
+        nltk.download(resource, download_dir=data_dir)
+
+
+class Analyzer:
+    """
+    Text normalization shared by the indexer and the query path.
+
+    The stopword list, the English word list and the lemmatizer are loaded once, and lemmatize
+    results are memoized in a bounded LRU cache, so every call only pays for tokenization.
+    """
+
+    def __init__(self, lemma_cache_size=200000):
+        # NLTK is imported here so that importing this module stays cheap
+        from nltk.corpus import stopwords, words
+        from nltk.stem import WordNetLemmatizer
+        use_local_nltk_data()
+        self.stop_words = set(stopwords.words('english'))
+        self.english_words = set(words.words())
+        self.lemmatizer = WordNetLemmatizer()
+        self.lemmatize = lru_cache(maxsize=lemma_cache_size)(self.lemmatizer.lemmatize)
+
+    def normalize(self, token):
+        """
+        Return the index term for a lowercase token, or None if the token is not indexed.
+        """
+        if token in self.stop_words or len(token) <= 1:
+            return None
+        # Lemmatize known words, otherwise keep them as they are
+        if token in self.english_words:
+            return self.lemmatize(token)
+        return token
+
+    def analyze(self, content):
+        """
+        Tokenize the content, remove stopwords, and lemmatize the terms found in NLTK's word corpus.
+        """
+        lemmatized_tokens = []
+        for token in TOKEN_SEPARATOR.split(content.lower()):
+            term = self.normalize(token)
+            if term is not None:
+                lemmatized_tokens.append(term)
+        return lemmatized_tokens
+
+    def analyze_many(self, contents):
+        """
+        Analyze several text fields at once; each distinct token is normalized only once per batch.
+        """
+        token_lists = [TOKEN_SEPARATOR.split(content.lower()) for content in contents]
+        terms = {}
+        for tokens in token_lists:
+            for token in tokens:
+                if token not in terms:
+                    terms[token] = self.normalize(token)
+        return [[terms[token] for token in tokens if terms[token] is not None] for tokens in token_lists]
+
+    def analyze_query(self, query):
+        """
+        Analyze a query like indexed text, returning (term, position) pairs where position counts
+        every word of the query, including the removed stopwords.
+        """
+        tokens = [token for token in TOKEN_SEPARATOR.split(query.lower()) if token]
+        processed_query = []
+        for position, token in enumerate(tokens):
+            term = self.normalize(token)
+            if term is not None:
+                processed_query.append((term, position))
+        return processed_query
+
+
+default_analyzer = None
+
+
+def get_analyzer():
+    """
+    Return the analyzer of this process, creating it on first use.
+    """
+    global default_analyzer
+    if default_analyzer is None:
+        default_analyzer = Analyzer()
+    return default_analyzer
@@ -0,0 +1,292 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+# webpages_raw stores the pages in numbered folders of up to 500 files, with doc ids "folder/file"
+DOCUMENTS_PER_FOLDER = 500
+QUERY_LENGTHS = {"one_word": 1, "two_word": 2, "multi_word": 4}
+PERCENTILES = (50, 95, 99)
+WARMUP_QUERIES = 10
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def make_vocabulary(size, rng):
+    vocabulary = set()
+    while len(vocabulary) < size:
+        vocabulary.add("".join(rng.choices(LETTERS, k=rng.randint(4, 10))))
+    return sorted(vocabulary)
+
+
+def generate_corpus(directory, documents=1000, vocabulary_size=20000, words_per_page=300, queries_per_length=200,
+                    seed=0):
+    """
+    Write a webpages_raw-shaped corpus to directory: HTML pages in numbered folders and a bookkeeping.json mapping
+    every doc id to its URL. Words follow a Zipf distribution and pages link to each other. The benchmark queries,
+    runs of consecutive body words from random pages, are written to queries.json.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    cumulative_weights = list(itertools.accumulate(1 / rank for rank in range(1, vocabulary_size + 1)))
+
+    def words(count):
+        return rng.choices(vocabulary, cum_weights=cumulative_weights, k=count)
+
+    bookkeeping = {f"{number // DOCUMENTS_PER_FOLDER}/{number % DOCUMENTS_PER_FOLDER}":
+                   f"www.site{number % 50}.example.edu/page{number}" for number in range(documents)}
+    urls = list(bookkeeping.values())
+    queries = {name: [] for name in QUERY_LENGTHS}
+    query_pages = set(rng.sample(range(documents), min(documents, queries_per_length)))
+    for number, (doc_id, url) in enumerate(bookkeeping.items()):
+        paragraphs = [words(rng.randint(20, 80)) for _ in range(max(1, words_per_page // 50))]
+        links = "".join(f'<a href="http://{link}">{" ".join(words(3))}</a> '
+                        for link in rng.sample(urls, min(len(urls), rng.randint(1, 8))))
+        page = (f"<html><head><title>{' '.join(words(5))}</title>"
+                f"<meta name=\"description\" content=\"{' '.join(words(15))}\"></head><body>"
+                f"<h1>{' '.join(words(4))}</h1><h2>{' '.join(words(6))}</h2>"
+                + "".join(f"<p>{' '.join(paragraph[:10])} <b>{' '.join(paragraph[10:12])}</b> "
+                          f"{' '.join(paragraph[12:])}</p>" for paragraph in paragraphs)
+                + f"<p>{links}</p></body></html>")
+        path = os.path.join(directory, *doc_id.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(page)
+
+        if number in query_pages:
+            body = [word for paragraph in paragraphs for word in paragraph]
+            for name, length in QUERY_LENGTHS.items():
+                start = rng.randrange(max(1, len(body) - length))
+                queries[name].append(" ".join(body[start:start + length]))
+
+    with open(os.path.join(directory, "bookkeeping.json"), "w", encoding="utf-8") as file:
+        json.dump(bookkeeping, file)
+    with open(os.path.join(directory, "queries.json"), "w", encoding="utf-8") as file:
+        json.dump(queries, file)
+
+
+def resident_memory():
+    """
+    Current and peak resident set size of this process in bytes, or None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as file:
+            fields = dict(line.split(":", 1) for line in file if ":" in line)
+    except OSError:
+        return None, None
+    return int(fields["VmRSS"].split()[0]) * 1024, int(fields["VmHWM"].split()[0]) * 1024
+
+
+def percentiles(seconds):
+    import numpy as np
+
+    values = np.percentile(seconds, PERCENTILES) * 1000 if seconds else [None] * len(PERCENTILES)
+    report = {f"p{percentile}_ms": None if value is None else float(value)
+              for percentile, value in zip(PERCENTILES, values)}
+    report["queries"] = len(seconds)
+    return report
+
+
+def benchmark_build(bookkeeping_input, directory_path, output_prefix, workers=1, champion_size=0, memory_budget=None):
+    """
+    Build the indexes of the corpus under output_prefix, returning the build throughput and the file sizes.
+    With memory_budget the index is built from sorted runs by build_external_index.
+    """
+    from index_constructor import build_inverted_index, load_json_data
+    from external_build import build_external_index
+
+    files = {name: output_prefix + suffix for name, suffix in (
+        ("index", "_index.bin"), ("bigram_index", "_bigram_index.bin"), ("meta_data", "_meta_data.txt"),
+        ("bigram_positions", "_bigram_positions.bin"), ("word_positions", "_word_positions.bin"),
+        ("spelling", "_spelling.bin"), ("forward_index", "_forward_index.bin"),
+        ("document_store", "_document_store.bin"))}
+    documents = len(load_json_data(bookkeeping_input))
+    start_time = time.perf_counter()
+    if memory_budget:
+        del files["forward_index"]
+        build_external_index(bookkeeping_input, directory_path, files["index"], files["bigram_index"],
+                             files["meta_data"], memory_budget, workers=workers,
+                             bigram_position_file=files["bigram_positions"], word_position_file=files["word_positions"],
+                             spelling_file=files["spelling"], document_store_file=files["document_store"],
+                             champion_size=champion_size)
+    else:
+        build_inverted_index(bookkeeping_input, directory_path, files["index"], files["bigram_index"],
+                             files["meta_data"], workers=workers, bigram_position_file=files["bigram_positions"],
+                             word_position_file=files["word_positions"], spelling_file=files["spelling"],
+                             forward_index_file=files["forward_index"], document_store_file=files["document_store"],
+                             champion_size=champion_size)
+    seconds = time.perf_counter() - start_time
+    _, peak_rss = resident_memory()
+    return {"documents": documents, "workers": workers, "champion_size": champion_size,
+            "memory_budget": memory_budget, "seconds": seconds, "docs_per_second": documents / seconds,
+            "peak_rss_bytes": peak_rss, "files": files,
+            "file_bytes": {name: os.path.getsize(filename) for name, filename in files.items()}}
+
+
+def benchmark_queries(bookkeeping_input, files, queries, k=20, use_cache=False):
+    """
+    Load the indexes and answer every query through advanced_query.top_k_query, returning the import and load
+    times, the resident memory and the latency percentiles of every query class.
+    """
+    start_time = time.perf_counter()
+    from binary_index import BinaryIndex
+    from position_index import PositionIndex
+    from advanced_query import top_k_query
+    from query_cache import QueryCache
+    import_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    index = BinaryIndex(files["index"])
+    bigram_index = BinaryIndex(files["bigram_index"])
+    bigram_positions = PositionIndex(files["bigram_positions"])
+    query_cache = None
+    if use_cache:
+        query_cache = QueryCache([files["index"], files["bigram_index"], files["bigram_positions"]])
+        index = query_cache.wrap(index, "unigram")
+        bigram_index = query_cache.wrap(bigram_index, "bigram")
+    load_seconds = time.perf_counter() - start_time
+    rss_after_load, _ = resident_memory()
+
+    # The first queries load the NLTK resources and fault in the index pages
+    for query in list(itertools.chain.from_iterable(queries.values()))[:WARMUP_QUERIES]:
+        top_k_query(query, index, bigram_index, bigram_positions, bookkeeping_input, k=k, cache=query_cache)
+
+    latency = {}
+    for name, class_queries in queries.items():
+        seconds = []
+        for query in class_queries:
+            start_time = time.perf_counter()
+            top_k_query(query, index, bigram_index, bigram_positions, bookkeeping_input, k=k, cache=query_cache)
+            seconds.append(time.perf_counter() - start_time)
+        latency[name] = percentiles(seconds)
+    rss, peak_rss = resident_memory()
+    return {"import_seconds": import_seconds, "load_seconds": load_seconds, "rss_after_load_bytes": rss_after_load,
+            "rss_bytes": rss, "peak_rss_bytes": peak_rss, "k": k, "cache": use_cache, "latency": latency}
+
+
+def run_phase(arguments):
+    """
+    Run one phase in a fresh interpreter so its memory and load time are measured on their own.
+    """
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__)] + arguments, capture_output=True,
+                               text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"benchmark phase {arguments[0]} failed:\n{completed.stderr}")
+    # The build prints progress; the report is the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_benchmark(bookkeeping_input, directory_path, queries_file, output_prefix, workers=1, k=20, use_cache=False,
+                  champion_size=0, memory_budget=None):
+    build_arguments = ["build-phase", bookkeeping_input, directory_path, output_prefix, str(workers),
+                       "--champion-size", str(champion_size)]
+    build = run_phase(build_arguments + (["--memory-budget", str(memory_budget)] if memory_budget else []))
+    query_arguments = ["query-phase", bookkeeping_input, json.dumps(build["files"]), queries_file, str(k)]
+    queries = run_phase(query_arguments + (["--cache"] if use_cache else []))
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "cpu_count": os.cpu_count(), "corpus": bookkeeping_input,
+            "build": build, "queries": queries}
+
+
+def compare_reports(baseline, current, tolerance=0.1):
+    """
+    Return the metrics of current that are more than tolerance (a fraction) worse than in baseline.
+    """
+    metrics = [(("build", "docs_per_second"), False), (("queries", "load_seconds"), True),
+               (("queries", "rss_after_load_bytes"), True)]
+    metrics += [(("queries", "latency", name, f"p{percentile}_ms"), True)
+                for name in QUERY_LENGTHS for percentile in PERCENTILES]
+    regressions = []
+    for path, lower_is_better in metrics:
+        old, new = baseline, current
+        for key in path:
+            old = old.get(key) if isinstance(old, dict) else None
+            new = new.get(key) if isinstance(new, dict) else None
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (change if lower_is_better else -change) > tolerance:
+            regressions.append(f"{'.'.join(path)}: {old:.4g} -> {new:.4g} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark index build and query latency.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="write a synthetic webpages_raw-shaped corpus")
+    generate.add_argument("directory")
+    generate.add_argument("--documents", type=int, default=1000)
+    generate.add_argument("--vocabulary", type=int, default=20000)
+    generate.add_argument("--words-per-page", type=int, default=300)
+    generate.add_argument("--queries", type=int, default=200, help="queries per query length")
+    generate.add_argument("--seed", type=int, default=0)
+
+    run = commands.add_parser("run", help="build the corpus and time the queries, writing a JSON report")
+    run.add_argument("directory", help="corpus directory, e.g. webpages_raw/ or one made by generate")
+    run.add_argument("--bookkeeping", help="defaults to bookkeeping.json in the corpus directory")
+    run.add_argument("--queries", help="defaults to queries.json in the corpus directory")
+    run.add_argument("--index-prefix", default="benchmark", help="prefix of the index files that are built")
+    run.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    run.add_argument("--k", type=int, default=20)
+    run.add_argument("--cache", action="store_true", help="answer queries through the QueryCache")
+    run.add_argument("--champion-size", type=int, default=0, help="champion list size of the built indexes")
+    run.add_argument("--memory-budget", type=int, help="build from sorted runs, buffering this many bytes")
+    run.add_argument("--output", default="benchmark.json")
+
+    compare = commands.add_parser("compare", help="exit with status 1 if a report regressed against a baseline")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--tolerance", type=float, default=0.1)
+
+    build_phase = commands.add_parser("build-phase")
+    build_phase.add_argument("bookkeeping")
+    build_phase.add_argument("directory")
+    build_phase.add_argument("index_prefix")
+    build_phase.add_argument("workers", type=int)
+    build_phase.add_argument("--champion-size", type=int, default=0)
+    build_phase.add_argument("--memory-budget", type=int)
+
+    query_phase = commands.add_parser("query-phase")
+    query_phase.add_argument("bookkeeping")
+    query_phase.add_argument("files")
+    query_phase.add_argument("queries")
+    query_phase.add_argument("k", type=int)
+    query_phase.add_argument("--cache", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate_corpus(args.directory, args.documents, args.vocabulary, args.words_per_page, args.queries, args.seed)
+    elif args.command == "run":
+        # The builder appends the doc ids to the directory path as is
+        directory = os.path.join(args.directory, "")
+        report = run_benchmark(args.bookkeeping or os.path.join(directory, "bookkeeping.json"), directory,
+                               args.queries or os.path.join(directory, "queries.json"), args.index_prefix,
+                               args.workers, args.k, args.cache, args.champion_size, args.memory_budget)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(json.dumps(report, indent=2))
+    elif args.command == "compare":
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        with open(args.current, encoding="utf-8") as file:
+            current = json.load(file)
+        regressions = compare_reports(baseline, current, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+    elif args.command == "build-phase":
+        print(json.dumps(benchmark_build(args.bookkeeping, args.directory, args.index_prefix, args.workers,
+                                         args.champion_size, args.memory_budget)))
+    else:
+        with open(args.queries, encoding="utf-8") as file:
+            queries = json.load(file)
+        print(json.dumps(benchmark_queries(args.bookkeeping, json.loads(args.files), queries, args.k, args.cache)))
+
+
+if __name__ == "__main__":
+    main()
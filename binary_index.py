@@ -0,0 +1,450 @@
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from contextlib import contextmanager, ExitStack
+import numpy as np
+from posting_list import PostingList, POSTING_COLUMNS
+from compression import encode_vbyte_list, decode_vbyte, read_vbyte_ints
+
+# File layout (all integers little-endian), in file order:
+#   header        : magic, version, term count, doc count and the absolute offset of every section
+#   doc offsets   : (doc count + 1) u64 offsets into the doc blob
+#   doc blob      : utf-8 doc ids ("12/345"), doc number i is the i-th document of bookkeeping.json
+#   postings      : one block per term, postings sorted by doc number:
+#                   block header  : bitmask of the scaled float columns, then variable-byte skip count and byte
+#                                   length of every section
+#                   skip table    : (last doc number, doc gap offset) of every SKIP_INTERVAL postings, only for
+#                                   lists longer than SKIP_INTERVAL
+#                   doc gaps      : variable-byte differences between consecutive doc numbers
+#                   frequencies   : variable-byte term frequencies
+#                   float columns : tf_idf_score, html_tag_weight, pagerank_weight, normalized_vector_weight, either
+#                                   variable-byte value * 1000 when that is exact (empty when all are 0) or raw f8
+#                   The champion lists that are not whole lists follow the posting blocks in the same format
+#   term offsets  : (term count + 1) u64 offsets into the term blob, terms sorted by their utf-8 bytes
+#   term blob     : utf-8 terms
+#   lexicon       : one fixed-width entry per term (posting block offset, posting count, idf, and the largest
+#                   0.5 * tf_idf + html_tag_weight + pagerank_weight and normalized_vector_weight of its postings)
+#   champions     : one entry (term number, posting block offset, posting count) per term with more than r postings,
+#                   r being the champion size, in term order. The champion list of such a term holds its r postings
+#                   with the highest 0.5 * tf_idf + html_tag_weight + pagerank_weight, ties going to the lower doc
+#                   numbers, in doc number order; shorter lists are their own champion lists. With r = 0 the index
+#                   has no champion lists
+# The terms and the lexicon follow the postings so that an index can be written one term at a time.
+MAGIC = b"SEBI"
+VERSION = 4
+HEADER_FORMAT = struct.Struct("<4sIIIQQQQQQQII")
+OFFSET_FORMAT = struct.Struct("<Q")
+LEXICON_FORMAT = struct.Struct("<QIddd")
+CHAMPION_DTYPE = np.dtype([("term_number", "<u4"), ("offset", "<u8"), ("count", "<u4")])
+SKIP_DTYPE = np.dtype([("last_doc", "<u4"), ("offset", "<u4")])
+SKIP_INTERVAL = 128
+FLOAT_COLUMNS = POSTING_COLUMNS[1:]
+SECTION_COUNT = 2 + len(FLOAT_COLUMNS)
+SCALE = 1000
+
+
+def write_binary_index(inverted_index, filename, doc_keys, champion_size=0):
+    """
+    Write the inverted index as compressed posting blocks followed by a sorted lexicon.
+    doc_keys lists every bookkeeping id in corpus order; its positions are the doc numbers of the postings,
+    so indexes written with the same doc_keys share their doc numbers.
+    With champion_size > 0 the champion list of every term is written as well.
+    """
+    doc_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(doc_keys)}
+    with BinaryIndexWriter(filename, doc_keys, champion_size) as writer:
+        for term in sorted(inverted_index.keys(), key=lambda term: term.encode("utf-8")):
+            postings = [posting for posting in inverted_index[term] if posting is not None]
+            postings.sort(key=lambda posting: doc_numbers[posting.doc_id])
+            writer.add_term(term, postings, [doc_numbers[posting.doc_id] for posting in postings])
+
+
+@contextmanager
+def replacing_file(filename):
+    """
+    Write to filename + ".tmp" and move it over filename once it is complete. Readers keep the file they mapped
+    until they reopen it, so they never see a partly written one; a failed write leaves filename as it was.
+    """
+    temporary_file = filename + ".tmp"
+    file = open(temporary_file, "wb")
+    try:
+        with file:
+            yield file
+    except BaseException:
+        os.remove(temporary_file)
+        raise
+    os.replace(temporary_file, filename)
+
+
+class TermTable:
+    """
+    Term offsets, term blob and fixed-width lexicon entries of a file written one term at a time. They are
+    spooled to temporary files, so the writer's memory does not grow with the vocabulary, and copied behind
+    the data once it is complete.
+    """
+
+    def __init__(self):
+        self.term_count = 0
+        self.blob_length = 0
+        self.offsets = tempfile.TemporaryFile()
+        self.blob = tempfile.TemporaryFile()
+        self.lexicon = tempfile.TemporaryFile()
+        self.offsets.write(OFFSET_FORMAT.pack(0))
+
+    def add(self, term_bytes, lexicon_entry):
+        self.blob.write(term_bytes)
+        self.blob_length += len(term_bytes)
+        self.offsets.write(OFFSET_FORMAT.pack(self.blob_length))
+        self.lexicon.write(lexicon_entry)
+        self.term_count += 1
+
+    def write_to(self, file):
+        """
+        Append the term offsets, term blob and lexicon to file, returning their absolute offsets.
+        """
+        section_positions = []
+        for section in (self.offsets, self.blob, self.lexicon):
+            section_positions.append(file.tell())
+            section.seek(0)
+            shutil.copyfileobj(section, file)
+            section.close()
+        return section_positions
+
+
+class BinaryIndexWriter:
+    """
+    Writes a binary index one term at a time, the terms in utf-8 byte order, so the index never has to be in
+    memory as a whole. Posting blocks are written as they come; the champion lists, terms and lexicon are
+    spooled to temporary files and appended by close, which puts the index in place of filename.
+    """
+
+    def __init__(self, filename, doc_keys, champion_size=0):
+        self.stack = ExitStack()
+        self.file = self.stack.enter_context(replacing_file(filename))
+        self.doc_count = len(doc_keys)
+        self.champion_size = champion_size
+        self.doc_offsets_pos = HEADER_FORMAT.size
+        self.doc_blob_pos = self.doc_offsets_pos + OFFSET_FORMAT.size * (self.doc_count + 1)
+        self.file.seek(self.doc_offsets_pos)
+        write_blob(self.file, [doc_id.encode("utf-8") for doc_id in doc_keys])
+        self.postings_pos = self.file.tell()
+        self.terms = TermTable()
+        # Champion blocks, and their table entries with offsets relative to the first champion block
+        self.champion_blocks = tempfile.TemporaryFile()
+        self.champion_blocks_length = 0
+        self.champion_entries = []
+
+    def add_term(self, term, postings, doc_numbers):
+        """
+        Add the postings of the next term, sorted by their doc numbers.
+        """
+        posting_offset = self.file.tell()
+        self.file.write(encode_posting_block(postings, doc_numbers))
+        idf = postings[0].idf if postings else 0
+        scores = [posting_score(posting) for posting in postings]
+        max_score = max(scores, default=0)
+        max_normalized_weight = max((posting.normalized_vector_weight for posting in postings), default=0)
+        if self.champion_size and len(postings) > self.champion_size:
+            # The sort is stable, so equal scores keep doc number order
+            best = sorted(sorted(range(len(postings)), key=lambda i: -scores[i])[:self.champion_size])
+            block = encode_posting_block([postings[i] for i in best], [doc_numbers[i] for i in best])
+            self.champion_entries.append((self.terms.term_count, self.champion_blocks_length, len(best)))
+            self.champion_blocks.write(block)
+            self.champion_blocks_length += len(block)
+        self.terms.add(term.encode("utf-8"),
+                       LEXICON_FORMAT.pack(posting_offset, len(postings), idf, max_score, max_normalized_weight))
+
+    def close(self):
+        champion_blocks_pos = self.file.tell()
+        self.champion_blocks.seek(0)
+        shutil.copyfileobj(self.champion_blocks, self.file)
+        self.champion_blocks.close()
+        term_offsets_pos, term_blob_pos, lexicon_pos = self.terms.write_to(self.file)
+        champions_pos = self.file.tell()
+        champion_table = np.array(self.champion_entries, dtype=CHAMPION_DTYPE)
+        champion_table["offset"] += champion_blocks_pos
+        self.file.write(champion_table.tobytes())
+
+        self.file.seek(0)
+        self.file.write(HEADER_FORMAT.pack(MAGIC, VERSION, self.terms.term_count, self.doc_count, self.doc_offsets_pos,
+                                           self.doc_blob_pos, term_offsets_pos, term_blob_pos, lexicon_pos,
+                                           self.postings_pos, champions_pos, len(champion_table), self.champion_size))
+        self.stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.champion_blocks.close()
+            self.stack.__exit__(exc_type, exc_value, traceback)
+
+
+def encode_posting_block(postings, doc_numbers):
+    doc_gaps = [doc_number - previous for previous, doc_number in zip([0] + doc_numbers, doc_numbers)]
+    skips = bytearray()
+    if len(doc_numbers) > SKIP_INTERVAL:
+        gap_offset = 0
+        skip_table = np.empty((len(doc_numbers) + SKIP_INTERVAL - 1) // SKIP_INTERVAL, dtype=SKIP_DTYPE)
+        for block, start in enumerate(range(0, len(doc_numbers), SKIP_INTERVAL)):
+            block_gaps = encode_vbyte_list(doc_gaps[start:start + SKIP_INTERVAL])
+            skip_table[block] = (doc_numbers[start:start + SKIP_INTERVAL][-1], gap_offset)
+            gap_offset += len(block_gaps)
+            skips += block_gaps
+        sections = [bytes(skips)]
+        skips = skip_table.tobytes()
+    else:
+        sections = [encode_vbyte_list(doc_gaps)]
+    sections.append(encode_vbyte_list([posting.frequency for posting in postings]))
+
+    scaled_columns = 0
+    for bit, column in enumerate(FLOAT_COLUMNS):
+        scaled, section = encode_float_column([getattr(posting, column) for posting in postings])
+        scaled_columns |= scaled << bit
+        sections.append(section)
+    header = bytes([scaled_columns]) + encode_vbyte_list([len(skips) // SKIP_DTYPE.itemsize] +
+                                                         [len(section) for section in sections])
+    return b"".join([header, bytes(skips)] + [bytes(section) for section in sections])
+
+
+def encode_float_column(values):
+    """
+    Return (True, variable-byte value * SCALE) if that gives back the exact values, else (False, raw f8 bytes).
+    Every index weight is rounded to 3 decimals, so the raw form is only a fallback.
+    """
+    if not any(values):
+        return True, b""
+    scaled = [round(value * SCALE) for value in values]
+    if all(0 <= number < 2 ** 53 and number / SCALE == value for number, value in zip(scaled, values)):
+        return True, encode_vbyte_list(scaled)
+    return False, struct.pack(f"<{len(values)}d", *values)
+
+
+def posting_score(posting):
+    """
+    Query-independent part of the ranking score, matching ranked_retrieval in advanced_query.
+    """
+    return (0.5 * posting.tf_idf_score) + posting.html_tag_weight + posting.pagerank_weight
+
+
+def write_blob(file, encoded_items):
+    offsets = np.zeros(len(encoded_items) + 1, dtype="<u8")
+    np.cumsum([len(item) for item in encoded_items], out=offsets[1:])
+    file.write(offsets.tobytes())
+    file.write(b"".join(encoded_items))
+
+
+def find_sorted_term(term_bytes, term_count, term):
+    """
+    Binary search a lexicon of terms sorted by their utf-8 bytes, returning the term number or -1.
+    """
+    target = term.encode("utf-8")
+    low, high = 0, term_count - 1
+    while low <= high:
+        middle = (low + high) // 2
+        current = term_bytes(middle)
+        if current == target:
+            return middle
+        if current < target:
+            low = middle + 1
+        else:
+            high = middle - 1
+    return -1
+
+
+class BinaryIndex:
+    """
+    Read-only view of an index written by write_binary_index.
+
+    The file is memory-mapped and only the posting lists that are looked up get decoded,
+    so opening the index costs the same regardless of its size.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.term_count, self.doc_count, self.doc_offsets_pos, self.doc_blob_pos,
+         self.term_offsets_pos, self.term_blob_pos, self.lexicon_pos, self.postings_pos, champions_pos, champion_count,
+         self.champion_size) = HEADER_FORMAT.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{filename} is not a binary index (version {VERSION})")
+        self.champion_table = np.frombuffer(self.buffer, dtype=CHAMPION_DTYPE, count=champion_count,
+                                            offset=champions_pos)
+        self.doc_key_cache = {}
+
+    def close(self):
+        self.champion_table = None
+        self.buffer.close()
+        self.file.close()
+
+    def reopen(self):
+        """
+        Map the file now at filename, after a rebuild replaced it.
+        """
+        self.close()
+        self.__init__(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.term_count
+
+    def __contains__(self, term):
+        return self.find_term(term) >= 0
+
+    def __getitem__(self, term):
+        term_number = self.find_term(term)
+        if term_number < 0:
+            raise KeyError(term)
+        return self.read_postings(term_number)
+
+    def __iter__(self):
+        for term_number in range(self.term_count):
+            yield self.term_at(term_number)
+
+    def get(self, term, default=None):
+        term_number = self.find_term(term)
+        if term_number < 0:
+            return default
+        return self.read_postings(term_number)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for term_number in range(self.term_count):
+            yield self.term_at(term_number), self.read_postings(term_number)
+
+    def lexicon_entry(self, term_number):
+        return LEXICON_FORMAT.unpack_from(self.buffer, self.lexicon_pos + LEXICON_FORMAT.size * term_number)
+
+    def document_frequency(self, term):
+        term_number = self.find_term(term)
+        if term_number < 0:
+            return 0
+        return self.lexicon_entry(term_number)[1]
+
+    def idf(self, term):
+        term_number = self.find_term(term)
+        if term_number < 0:
+            return 0
+        return self.lexicon_entry(term_number)[2]
+
+    def champions(self, term):
+        """
+        Return the champion list of term, None if the term is unknown or the index has no champion lists.
+        """
+        term_number = self.find_term(term)
+        if term_number < 0 or not self.champion_size:
+            return None
+        entry = int(np.searchsorted(self.champion_table["term_number"], term_number))
+        if entry < len(self.champion_table) and self.champion_table["term_number"][entry] == term_number:
+            return self.read_posting_block(int(self.champion_table["offset"][entry]),
+                                           int(self.champion_table["count"][entry]), self.lexicon_entry(term_number)[2])
+        return self.read_postings(term_number)
+
+    def score_bounds(self, term):
+        """
+        Return the largest static score and normalized vector weight among the postings of term.
+        """
+        term_number = self.find_term(term)
+        if term_number < 0:
+            return 0, 0
+        return self.lexicon_entry(term_number)[3:]
+
+    def blob_item(self, offsets_pos, blob_pos, number):
+        start, = OFFSET_FORMAT.unpack_from(self.buffer, offsets_pos + OFFSET_FORMAT.size * number)
+        end, = OFFSET_FORMAT.unpack_from(self.buffer, offsets_pos + OFFSET_FORMAT.size * (number + 1))
+        return self.buffer[blob_pos + start:blob_pos + end]
+
+    def term_bytes(self, term_number):
+        return self.blob_item(self.term_offsets_pos, self.term_blob_pos, term_number)
+
+    def term_at(self, term_number):
+        return self.term_bytes(term_number).decode("utf-8")
+
+    def doc_key(self, doc_number):
+        doc_id = self.doc_key_cache.get(doc_number)
+        if doc_id is None:
+            doc_id = self.blob_item(self.doc_offsets_pos, self.doc_blob_pos, doc_number).decode("utf-8")
+            self.doc_key_cache[doc_number] = doc_id
+        return doc_id
+
+    def find_term(self, term):
+        return find_sorted_term(self.term_bytes, self.term_count, term)
+
+    def block_header(self, posting_offset):
+        scaled_columns = self.buffer[posting_offset]
+        (skip_count, *section_lengths), skips_pos = read_vbyte_ints(self.buffer, posting_offset + 1,
+                                                                    1 + SECTION_COUNT)
+        skips = np.frombuffer(self.buffer, dtype=SKIP_DTYPE, count=skip_count, offset=skips_pos)
+        section_offsets = np.cumsum([skips_pos + skips.nbytes] + section_lengths).tolist()
+        return scaled_columns, skips, section_offsets, section_lengths
+
+    def read_postings(self, term_number):
+        posting_offset, count, idf, _, _ = self.lexicon_entry(term_number)
+        return self.read_posting_block(posting_offset, count, idf)
+
+    def read_posting_block(self, posting_offset, count, idf):
+        scaled_columns, _, section_offsets, section_lengths = self.block_header(posting_offset)
+        sections = list(zip(section_offsets, section_lengths))
+        doc_ids = np.cumsum(decode_vbyte(self.buffer, *sections[0]))
+        frequency = decode_vbyte(self.buffer, *sections[1])
+        columns = []
+        for bit, (offset, length) in enumerate(sections[2:]):
+            if not scaled_columns >> bit & 1:
+                columns.append(np.frombuffer(self.buffer, dtype="<f8", count=count, offset=offset).copy())
+            elif length:
+                columns.append(decode_vbyte(self.buffer, offset, length) / SCALE)
+            else:
+                columns.append(np.zeros(count))
+        return PostingList(doc_ids, frequency, *columns, doc_key=self.doc_key, idf=idf)
+
+    def read_doc_numbers(self, term_number, candidates=None):
+        """
+        Decode the sorted doc numbers of a term. With sorted candidates, only the skip blocks whose doc range
+        can hold a candidate are decoded.
+        """
+        posting_offset = self.lexicon_entry(term_number)[0]
+        _, skips, section_offsets, section_lengths = self.block_header(posting_offset)
+        gaps_pos, gaps_length = section_offsets[0], section_lengths[0]
+        if candidates is None or not len(skips):
+            return np.cumsum(decode_vbyte(self.buffer, gaps_pos, gaps_length))
+
+        blocks = np.unique(np.searchsorted(skips["last_doc"], candidates))
+        blocks = blocks[blocks < len(skips)].tolist()
+        block_ends = skips["offset"][1:].tolist() + [gaps_length]
+        doc_numbers = []
+        for block in blocks:
+            start = int(skips["offset"][block])
+            base = int(skips["last_doc"][block - 1]) if block else 0
+            doc_numbers.append(np.cumsum(decode_vbyte(self.buffer, gaps_pos + start, block_ends[block] - start)) + base)
+        return np.concatenate(doc_numbers) if doc_numbers else np.empty(0, dtype=np.int64)
+
+    def intersect_doc_numbers(self, terms, candidates=None):
+        """
+        Return the sorted doc numbers of the documents containing every term. The shortest posting list is
+        decoded first and the skip tables of the others limit decoding to the blocks that may match. Given
+        sorted candidates, only those are kept and every list is decoded only where they fall.
+        """
+        term_numbers = [self.find_term(term) for term in terms]
+        if not term_numbers or min(term_numbers) < 0:
+            return np.empty(0, dtype=np.int64)
+        term_numbers.sort(key=lambda term_number: self.lexicon_entry(term_number)[1])
+        if candidates is None:
+            candidates = self.read_doc_numbers(term_numbers.pop(0))
+        for term_number in term_numbers:
+            if not len(candidates):
+                break
+            candidates = np.intersect1d(candidates, self.read_doc_numbers(term_number, candidates),
+                                        assume_unique=True)
+        return candidates
@@ -0,0 +1,81 @@
+import numpy as np
+
+# Variable-byte code: 7 bits per byte, least significant group first, high bit set on the last byte of a value
+
+
+def encode_vbyte(values):
+    """
+    Encode non-negative integers, returning the encoded bytes and the end offset of every value.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b"", np.empty(0, dtype=np.int64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    remaining = values >> np.uint64(7)
+    while remaining.any():
+        lengths += remaining > 0
+        remaining >>= np.uint64(7)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    output = np.empty(ends[-1], dtype=np.uint8)
+    for group in range(int(lengths.max())):
+        selected = lengths > group
+        group_bits = (values[selected] >> np.uint64(7 * group)) & np.uint64(0x7f)
+        last_byte = (lengths[selected] == group + 1).astype(np.uint64) << np.uint64(7)
+        output[starts[selected] + group] = group_bits | last_byte
+    return output.tobytes(), ends
+
+
+def encode_vbyte_int(value):
+    """
+    Encode a single integer; faster than encode_vbyte for one value.
+    """
+    return encode_vbyte_list((value,))
+
+
+def encode_vbyte_list(values):
+    """
+    Encode a list of integers without NumPy, which is faster for the short lists that make up most of an index.
+    """
+    output = bytearray()
+    append = output.append
+    for value in values:
+        while value >= 0x80:
+            append(value & 0x7f)
+            value >>= 7
+        append(value | 0x80)
+    return output
+
+
+def read_vbyte_ints(buffer, offset, count):
+    """
+    Decode count integers starting at buffer[offset], returning them and the offset after the last one.
+    """
+    values = []
+    for _ in range(count):
+        value = shift = 0
+        while True:
+            byte = buffer[offset]
+            offset += 1
+            value |= (byte & 0x7f) << shift
+            if byte & 0x80:
+                break
+            shift += 7
+        values.append(value)
+    return values, offset
+
+
+def decode_vbyte(buffer, offset=0, length=None):
+    """
+    Decode the variable-byte integers stored in buffer[offset:offset + length] into an int64 array.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8, count=-1 if length is None else length, offset=offset)
+    if not len(data):
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero(data & 0x80)
+    starts = np.empty(len(ends), dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = (np.arange(len(data)) - np.repeat(starts, ends - starts + 1)) * 7
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
@@ -0,0 +1,186 @@
+import json
+import mmap
+import re
+import struct
+import zlib
+from collections import namedtuple
+from contextlib import ExitStack
+from functools import lru_cache
+import numpy as np
+from binary_index import write_blob, replacing_file, OFFSET_FORMAT
+from analyzer import get_analyzer
+
+# File layout (all integers little-endian):
+#   header         : magic, version, doc count and the absolute offset of every section
+#   doc id offsets : (doc count + 1) u64 offsets into the doc id blob
+#   doc id blob    : utf-8 doc ids in doc number order, as in the binary index
+#   records        : one zlib-compressed JSON [title, url, body text] per document, in doc number order
+#   record offsets : (doc count + 1) u64 absolute offsets of the records; a document without a record has
+#                    an empty one
+MAGIC = b"SEDS"
+VERSION = 1
+HEADER_FORMAT = struct.Struct("<4sIIQQQQ")
+OFFSET_DTYPE = np.dtype("<u8")
+SNIPPET_WORDS = 30
+WORD = re.compile(r'[a-zA-Z]+')
+
+Document = namedtuple("Document", ["title", "url", "body"])
+
+
+def encode_document(title, url, body_content):
+    """
+    Compress one record; runs in the indexing workers. The body whitespace is collapsed.
+    """
+    return zlib.compress(json.dumps([title, url, ' '.join(body_content.split())]).encode("utf-8"))
+
+
+class DocumentStoreWriter:
+    """
+    Streams the encoded records to disk; they must be added in increasing doc number order. The store
+    replaces filename when the writer is closed.
+    """
+
+    def __init__(self, filename, doc_keys):
+        self.stack = ExitStack()
+        self.file = self.stack.enter_context(replacing_file(filename))
+        self.doc_count = len(doc_keys)
+        self.doc_id_offsets_pos = HEADER_FORMAT.size
+        self.doc_id_blob_pos = self.doc_id_offsets_pos + OFFSET_FORMAT.size * (self.doc_count + 1)
+        self.file.seek(self.doc_id_offsets_pos)
+        write_blob(self.file, [doc_id.encode("utf-8") for doc_id in doc_keys])
+        self.records_pos = self.file.tell()
+        self.record_offsets = np.full(self.doc_count + 1, self.records_pos, dtype=OFFSET_DTYPE)
+        self.next_doc_number = 0
+
+    def add_document(self, doc_number, record):
+        offset = self.file.tell()
+        # Documents without a record get an empty one
+        self.record_offsets[self.next_doc_number:doc_number + 1] = offset
+        self.file.write(record)
+        self.next_doc_number = doc_number + 1
+
+    def close(self):
+        end = self.file.tell()
+        self.record_offsets[self.next_doc_number:] = end
+        self.file.write(self.record_offsets.tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER_FORMAT.pack(MAGIC, VERSION, self.doc_count, self.doc_id_offsets_pos,
+                                           self.doc_id_blob_pos, self.records_pos, end))
+        self.stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.stack.__exit__(exc_type, exc_value, traceback)
+
+
+class DocumentStore:
+    """
+    Read-only, memory-mapped view of a document store; a record is one slice of the file plus a decompression.
+    Records are looked up by doc number or doc id and the most recent ones are kept decoded.
+    """
+
+    def __init__(self, filename, cache_size=1024):
+        self.filename = filename
+        self.cache_size = cache_size
+        self.file = open(filename, "rb")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.doc_count, self.doc_id_offsets_pos, self.doc_id_blob_pos, self.records_pos,
+         record_offsets_pos) = HEADER_FORMAT.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{filename} is not a document store (version {VERSION})")
+        self.record_offsets = np.frombuffer(self.buffer, dtype=OFFSET_DTYPE, count=self.doc_count + 1,
+                                            offset=record_offsets_pos)
+        self.doc_numbers = None
+        self.cached_document = lru_cache(maxsize=cache_size)(self.read_document)
+
+    def close(self):
+        self.record_offsets = None
+        self.buffer.close()
+        self.file.close()
+
+    def reopen(self):
+        """
+        Map the file now at filename, after a rebuild replaced it.
+        """
+        self.close()
+        self.__init__(self.filename, self.cache_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.doc_count
+
+    def doc_id(self, doc_number):
+        start, = OFFSET_FORMAT.unpack_from(self.buffer, self.doc_id_offsets_pos + OFFSET_FORMAT.size * doc_number)
+        end, = OFFSET_FORMAT.unpack_from(self.buffer, self.doc_id_offsets_pos + OFFSET_FORMAT.size * (doc_number + 1))
+        return self.buffer[self.doc_id_blob_pos + start:self.doc_id_blob_pos + end].decode("utf-8")
+
+    def doc_number(self, doc_id):
+        """
+        Return the doc number of a doc id, or None if it is not in the store.
+        """
+        if self.doc_numbers is None:
+            self.doc_numbers = {self.doc_id(doc_number): doc_number for doc_number in range(self.doc_count)}
+        return self.doc_numbers.get(doc_id)
+
+    def document(self, doc_id):
+        """
+        Return the Document of a doc id, or None if the store has no record of it.
+        """
+        doc_number = self.doc_number(doc_id)
+        return None if doc_number is None else self.cached_document(doc_number)
+
+    def read_record(self, doc_number):
+        """
+        Return the compressed record of a doc number, empty if it has none.
+        """
+        return self.buffer[int(self.record_offsets[doc_number]):int(self.record_offsets[doc_number + 1])]
+
+    def read_document(self, doc_number):
+        record = self.read_record(doc_number)
+        if not record:
+            return None
+        return Document(*json.loads(zlib.decompress(record)))
+
+
+def query_snippet(text, query_terms, length=SNIPPET_WORDS):
+    """
+    Return the run of length words of text that contains the most distinct query terms, then the most
+    occurrences of them, with "..." where text was cut. Words are matched after analysis, so "running"
+    matches the term "run"; without any match the snippet is the start of the text.
+    """
+    words = list(WORD.finditer(text))
+    if not words:
+        return ""
+    analyzer = get_analyzer()
+    query_terms = set(query_terms)
+    matches = [analyzer.normalize(word.group().lower()) in query_terms for word in words]
+
+    best_start, best_score = 0, (0, 0)
+    if query_terms and any(matches):
+        match_positions = [position for position, matched in enumerate(matches) if matched]
+        for start in match_positions:
+            # Windows starting at a match: count the distinct terms and the matches in them
+            window = range(start, min(start + length, len(words)))
+            terms = {analyzer.normalize(words[position].group().lower()) for position in window if matches[position]}
+            score = (len(terms), sum(matches[position] for position in window))
+            if score > best_score:
+                best_start, best_score = start, score
+        # Show a little context before the first match
+        best_start = max(0, min(best_start - length // 5, len(words) - length))
+
+    last = min(best_start + length, len(words)) - 1
+    snippet = text[words[best_start].start():words[last].end()]
+    prefix = "..." if best_start > 0 else ""
+    suffix = "..." if last < len(words) - 1 else ""
+    return prefix + snippet + suffix
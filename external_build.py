@@ -0,0 +1,273 @@
+import argparse
+import math
+import os
+import struct
+import tempfile
+from array import array
+from collections import deque
+from contextlib import ExitStack
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
+from PostingObject import PostingObject
+from binary_index import BinaryIndexWriter
+from document_store import DocumentStoreWriter
+from index_constructor import (index_documents, split_documents, load_json_data, tf_idf_weight, scaled_pagerank,
+                               MetaDataWriter, DOCUMENTS_PER_CHUNK)
+from pagerank import corpus_urls, resolve_out_links, adjacency_matrix
+from position_index import PositionIndexWriter, write_merged_positions
+from sorted_runs import merge_runs, reduce_runs, RUN_BUFFER_SIZE
+from spelling import SpellingCorrector
+
+# Run files hold the terms of one flush in utf-8 byte order:
+#   posting run  : per term, term length and posting count, the utf-8 term, then u4 doc numbers, u4 frequencies
+#                  and f8 html tag weights of its postings in doc number order
+#   position run : written by PositionIndexWriter.write_run
+POSTING_RUN_HEADER = struct.Struct("<II")
+# Estimated memory of a buffered term (dict slot, key string, arrays) and of one buffered posting
+TERM_BYTES = 300
+POSTING_BYTES = 16
+
+
+class PostingBuffer:
+    """
+    Postings of the documents indexed since the last flush, kept as compact per-term arrays.
+    """
+
+    def __init__(self):
+        # term -> (doc numbers, frequencies, html tag weights)
+        self.terms = {}
+        self.size = 0
+
+    def add(self, partial_index, doc_numbers):
+        for term, postings in partial_index.items():
+            entry = self.terms.get(term)
+            if entry is None:
+                entry = self.terms[term] = (array("I"), array("I"), array("d"))
+                self.size += TERM_BYTES
+            for posting in postings:
+                entry[0].append(doc_numbers[posting.doc_id])
+                entry[1].append(posting.frequency)
+                entry[2].append(posting.html_tag_weight)
+            self.size += POSTING_BYTES * len(postings)
+
+    def write_run(self, filename):
+        with open(filename, "wb") as file:
+            for term in sorted(self.terms, key=lambda term: term.encode("utf-8")):
+                write_posting_entry(file, (term.encode("utf-8"), *self.terms[term]))
+        self.terms = {}
+        self.size = 0
+
+
+def write_posting_entry(file, entry):
+    """
+    Write one (term bytes, doc numbers, frequencies, html tag weights) entry to a posting run.
+    """
+    term, doc_numbers, frequencies, html_tag_weights = entry
+    file.write(POSTING_RUN_HEADER.pack(len(term), len(doc_numbers)))
+    file.write(term)
+    for column in (doc_numbers, frequencies, html_tag_weights):
+        file.write(column.tobytes())
+
+
+def read_posting_run(filename):
+    """
+    Yield (term bytes, doc numbers, frequencies, html tag weights) from a posting run.
+    """
+    with open(filename, "rb", buffering=RUN_BUFFER_SIZE) as file:
+        while True:
+            header = file.read(POSTING_RUN_HEADER.size)
+            if not header:
+                break
+            term_length, count = POSTING_RUN_HEADER.unpack(header)
+            term = file.read(term_length)
+            doc_numbers = np.frombuffer(file.read(4 * count), dtype="<u4")
+            frequencies = np.frombuffer(file.read(4 * count), dtype="<u4")
+            html_tag_weights = np.frombuffer(file.read(8 * count), dtype="<f8")
+            yield term, doc_numbers, frequencies, html_tag_weights
+
+
+def merge_posting_runs(filenames):
+    """
+    Yield the merged entries of the posting runs, in run format.
+    """
+    for term, entries in merge_runs([read_posting_run(filename) for filename in filenames]):
+        yield (term, *[np.concatenate([entry[column] for entry in entries]) for column in (1, 2, 3)])
+
+
+def merge_postings(filenames):
+    """
+    Yield (term, doc numbers, frequencies, html tag weights) for every term of the posting runs.
+    """
+    for term, *columns in merge_posting_runs(filenames):
+        yield (term.decode("utf-8"), *columns)
+
+
+def vector_lengths(filenames, total_docs):
+    """
+    Length of the tf-idf vector of every document over the terms of the posting runs, by doc number.
+    """
+    squared_lengths = np.zeros(total_docs)
+    for _, doc_numbers, frequencies, _ in merge_postings(filenames):
+        idf = math.log10(total_docs / len(doc_numbers))
+        weights = np.array([tf_idf_weight(frequency, idf) for frequency in frequencies.tolist()])
+        squared_lengths[doc_numbers] += weights ** 2
+    return np.sqrt(squared_lengths)
+
+
+def write_merged_index(filenames, output_file, doc_keys, pagerank, champion_size=0):
+    """
+    Merge the posting runs into a binary index, weighting the postings as build_inverted_index does.
+    Returns the document frequency of every term.
+    """
+    total_docs = len(doc_keys)
+    lengths = vector_lengths(filenames, total_docs).tolist()
+    pagerank_weights = [pagerank.get(doc_id, 0) for doc_id in doc_keys]
+    document_frequencies = {}
+    with BinaryIndexWriter(output_file, doc_keys, champion_size) as writer:
+        for term, doc_numbers, frequencies, html_tag_weights in merge_postings(filenames):
+            idf = math.log10(total_docs / len(doc_numbers))
+            doc_numbers = doc_numbers.tolist()
+            postings = []
+            for doc_number, frequency, html_tag_weight in zip(doc_numbers, frequencies.tolist(),
+                                                              html_tag_weights.tolist()):
+                tf_idf_score = tf_idf_weight(frequency, idf)
+                length = lengths[doc_number]
+                postings.append(PostingObject(
+                    doc_id=doc_keys[doc_number], frequency=frequency, idf=round(idf, 3), tf_idf_score=tf_idf_score,
+                    html_tag_weight=html_tag_weight, pagerank_weight=pagerank_weights[doc_number],
+                    normalized_vector_weight=round(tf_idf_score / length, 3) if length != 0 else 0))
+            writer.add_term(term, postings, doc_numbers)
+            document_frequencies[term] = len(postings)
+    return document_frequencies
+
+
+def ordered_results(pool, function, chunks, window):
+    """
+    pool.imap with at most window chunks in flight, so parsed chunks do not pile up while the merge is busy.
+    """
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(function, (chunk,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def build_external_index(bookkeeping_input, directory_path, output_file, output_file_2g, meta_data_file,
+                         memory_budget, workers=1, bigram_position_file=None, word_position_file=None,
+                         spelling_file=None, pagerank_file=None, document_store_file=None, champion_size=0,
+                         run_directory=None):
+    """
+    Build the same index files as build_inverted_index in about memory_budget bytes of postings and positions.
+
+    Documents are parsed in slices as by build_inverted_index, but their postings and positions are buffered
+    only until the buffers reach memory_budget; each flush writes a term-sorted run per index and position
+    file to a temporary directory in run_directory, by default the directory of output_file. Once every
+    document is parsed, the runs of a file beyond MERGE_FAN_IN are first merged in groups into intermediate
+    runs, so that no merge opens more files than that. The runs are then merged term by term: a first pass
+    sums the squared tf-idf weights into the vector length of every document, a second computes the weights
+    from each term's document frequency and streams the postings into the binary index. Only per-document
+    arrays, the links between corpus pages and one term's postings stay in memory, so the peak memory does
+    not grow with the vocabulary.
+    No forward index is written in this mode.
+    """
+    json_data = load_json_data(bookkeeping_input)
+    valid_links = {link: doc_id for doc_id, link in json_data.items()}
+    total_docs = len(json_data)
+    doc_keys = list(json_data)
+    doc_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(doc_keys)}
+    graph_doc_ids, graph_doc_numbers, url_numbers = corpus_urls(valid_links)
+    link_sources = []
+    link_targets = []
+    chunks = split_documents(list(json_data.items()), DOCUMENTS_PER_CHUNK)
+    index_chunk = partial(index_documents, directory_path=directory_path,
+                          with_positions=(bigram_position_file is not None, word_position_file is not None),
+                          with_documents=document_store_file is not None)
+    buffers = {"unigram": PostingBuffer(), "bigram": PostingBuffer(), "bigram_positions": PositionIndexWriter(),
+               "word_positions": PositionIndexWriter()}
+    runs = {name: [] for name in buffers}
+
+    def flush():
+        for name, buffer in buffers.items():
+            if buffer.size:
+                filename = os.path.join(run_path, f"{name}-{len(runs[name]):05d}.run")
+                print(f"Writing {filename}")
+                buffer.write_run(filename)
+                runs[name].append(filename)
+
+    with ExitStack() as stack:
+        run_path = stack.enter_context(tempfile.TemporaryDirectory(
+            prefix="runs-", dir=run_directory or os.path.dirname(os.path.abspath(output_file))))
+        with ExitStack() as parse_stack:
+            meta_data_writer = parse_stack.enter_context(MetaDataWriter(meta_data_file))
+            document_store_writer = None
+            if document_store_file:
+                document_store_writer = parse_stack.enter_context(DocumentStoreWriter(document_store_file, doc_keys))
+            if workers > 1:
+                partial_results = ordered_results(parse_stack.enter_context(Pool(workers)), index_chunk, chunks,
+                                                  2 * workers)
+            else:
+                partial_results = map(index_chunk, chunks)
+
+            for (partial_index, partial_bigram_index, partial_meta_data, _, partial_out_links,
+                 partial_bigram_positions, partial_word_positions, partial_documents) in partial_results:
+                buffers["unigram"].add(partial_index, doc_numbers)
+                buffers["bigram"].add(partial_bigram_index, doc_numbers)
+                for name, partial_positions in (("bigram_positions", partial_bigram_positions),
+                                                ("word_positions", partial_word_positions)):
+                    for doc_id, encoded_positions in partial_positions:
+                        buffers[name].add_document(doc_numbers[doc_id], encoded_positions)
+                meta_data_writer.write(partial_meta_data)
+                for doc_id, record in partial_documents:
+                    document_store_writer.add_document(doc_numbers[doc_id], record)
+                sources, targets = resolve_out_links(partial_out_links, valid_links, graph_doc_numbers, url_numbers)
+                link_sources.append(np.array(sources, dtype=np.int32))
+                link_targets.append(np.array(targets, dtype=np.int32))
+                if sum(buffer.size for buffer in buffers.values()) >= memory_budget:
+                    flush()
+        flush()
+
+        adjacency = adjacency_matrix(np.concatenate(link_sources or [np.empty(0, dtype=np.int32)]),
+                                     np.concatenate(link_targets or [np.empty(0, dtype=np.int32)]),
+                                     len(graph_doc_ids))
+        pagerank = scaled_pagerank((graph_doc_ids, adjacency), pagerank_file)
+
+        for name in ("unigram", "bigram"):
+            reduce_runs(runs[name], merge_posting_runs, write_posting_entry, run_path)
+        document_frequencies = write_merged_index(runs["unigram"], output_file, doc_keys, pagerank, champion_size)
+        write_merged_index(runs["bigram"], output_file_2g, doc_keys, pagerank, champion_size)
+        for position_file, name in ((bigram_position_file, "bigram_positions"), (word_position_file, "word_positions")):
+            if position_file:
+                write_merged_positions(position_file, runs[name], run_path)
+    if spelling_file:
+        SpellingCorrector.from_frequencies(document_frequencies).save(spelling_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the index files with a bounded memory budget.")
+    parser.add_argument("--bookkeeping", default="webpages_raw/bookkeeping.json")
+    parser.add_argument("--directory", default="webpages_raw/")
+    parser.add_argument("--index", default="inverted_index.bin")
+    parser.add_argument("--bigram-index", default="inverted_bigram_index.bin")
+    parser.add_argument("--meta-data", default="meta_data_file.txt")
+    parser.add_argument("--bigram-positions", default="bigram_positions.bin")
+    parser.add_argument("--word-positions", default="word_positions.bin")
+    parser.add_argument("--spelling", default="spelling_dictionary.bin")
+    parser.add_argument("--pagerank", default="pagerank.json")
+    parser.add_argument("--document-store", default="document_store.bin")
+    parser.add_argument("--champion-size", type=int, default=0)
+    parser.add_argument("--memory-budget", type=int, default=512, help="megabytes of buffered postings and positions")
+    parser.add_argument("--run-directory", help="where the runs are written, by default next to the index")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    build_external_index(args.bookkeeping, args.directory, args.index, args.bigram_index, args.meta_data,
+                         args.memory_budget * 1024 * 1024, args.workers, args.bigram_positions or None,
+                         args.word_positions or None, args.spelling or None, args.pagerank or None,
+                         args.document_store or None, args.champion_size, args.run_directory)
+
+
+if __name__ == "__main__":
+    main()
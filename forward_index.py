@@ -0,0 +1,185 @@
+import mmap
+import struct
+from array import array
+import numpy as np
+from binary_index import encode_float_column, replacing_file, SCALE
+from compression import encode_vbyte_list, decode_vbyte, read_vbyte_ints
+
+# File layout (all integers little-endian):
+#   header         : magic, version, doc count and the absolute offset of every section
+#   block offsets  : (doc count + 1) u64 offsets of the document blocks
+#   vector lengths : per kind (unigram, bigram), doc count f8 tf-idf vector lengths
+#   blocks         : one per doc number:
+#                    block header : bitmask of the kinds whose weights are scaled, then variable-byte term count,
+#                                   term section length and weight section length of every kind
+#                    per kind     : variable-byte gaps between the sorted term numbers, which are the term numbers
+#                                   of the binary index of that kind, and the tf-idf weights, variable-byte
+#                                   weight * 1000 when that is exact or raw f8
+MAGIC = b"SEFI"
+VERSION = 1
+HEADER_FORMAT = struct.Struct("<4sIIQQQ")
+OFFSET_DTYPE = np.dtype("<u8")
+LENGTH_DTYPE = np.dtype("<f8")
+KINDS = ("unigram", "bigram")
+
+
+class ForwardIndexWriter:
+    """
+    Collects the terms and frequencies of every document while the inverted indexes are built, then their tf-idf
+    weights once the idf of every term is known. Term ids are assigned in first-seen order and renumbered to the
+    lexicon order of the binary indexes when the file is written.
+    """
+
+    def __init__(self):
+        self.term_ids = {kind: {} for kind in KINDS}
+        # doc number -> per kind (term ids, frequencies, weights), the terms in their order in the document
+        self.documents = {}
+
+    def add_document(self, doc_number, unigram_frequencies, bigram_frequencies):
+        entry = []
+        for kind, term_frequencies in zip(KINDS, (unigram_frequencies, bigram_frequencies)):
+            term_ids = self.term_ids[kind]
+            ids = array("I", (term_ids.setdefault(term, len(term_ids)) for term in term_frequencies))
+            entry.append([ids, array("I", term_frequencies.values()), None])
+        self.documents[doc_number] = entry
+
+    def terms(self, kind):
+        """
+        The terms of a kind, indexed by term id.
+        """
+        return list(self.term_ids[kind])
+
+    def entries(self, kind):
+        """
+        Yield (doc number, term ids, frequencies) of every document.
+        """
+        position = KINDS.index(kind)
+        for doc_number, entry in self.documents.items():
+            term_ids, frequencies, _ = entry[position]
+            yield doc_number, term_ids, frequencies
+
+    def set_weights(self, doc_number, kind, weights):
+        self.documents[doc_number][KINDS.index(kind)][2] = array("d", weights)
+
+    def write(self, filename, doc_count, vector_lengths):
+        """
+        Write the weighted documents; vector_lengths maps every kind to {doc number: vector length}.
+        """
+        term_numbers = {}
+        for kind in KINDS:
+            terms = self.terms(kind)
+            order = sorted(range(len(terms)), key=lambda term_id: terms[term_id].encode("utf-8"))
+            term_numbers[kind] = np.empty(len(terms), dtype=np.int64)
+            term_numbers[kind][order] = np.arange(len(terms))
+
+        block_offsets_pos = HEADER_FORMAT.size
+        lengths_pos = block_offsets_pos + OFFSET_DTYPE.itemsize * (doc_count + 1)
+        blocks_pos = lengths_pos + LENGTH_DTYPE.itemsize * doc_count * len(KINDS)
+        block_offsets = np.empty(doc_count + 1, dtype=OFFSET_DTYPE)
+        lengths = np.zeros((len(KINDS), doc_count), dtype=LENGTH_DTYPE)
+        for position, kind in enumerate(KINDS):
+            for doc_number, length in vector_lengths[kind].items():
+                lengths[position, doc_number] = length
+
+        with replacing_file(filename) as file:
+            file.seek(blocks_pos)
+            offset = blocks_pos
+            for doc_number in range(doc_count):
+                block_offsets[doc_number] = offset
+                block = self.encode_block(self.documents.get(doc_number), term_numbers)
+                file.write(block)
+                offset += len(block)
+            block_offsets[doc_count] = offset
+
+            file.seek(0)
+            file.write(HEADER_FORMAT.pack(MAGIC, VERSION, doc_count, block_offsets_pos, lengths_pos, blocks_pos))
+            file.write(block_offsets.tobytes())
+            file.write(lengths.tobytes())
+
+    @staticmethod
+    def encode_block(entry, term_numbers):
+        scaled_kinds = 0
+        counts = []
+        sections = []
+        for position, kind in enumerate(KINDS):
+            if entry is None:
+                term_ids, weights = array("I"), []
+            else:
+                term_ids, _, weights = entry[position]
+            numbers = term_numbers[kind][np.frombuffer(term_ids, dtype=np.uint32)] if len(term_ids) else []
+            order = np.argsort(numbers, kind="stable")
+            sorted_numbers = np.asarray(numbers)[order].tolist()
+            gaps = [number - previous for previous, number in zip([0] + sorted_numbers, sorted_numbers)]
+            scaled, weight_section = encode_float_column([weights[i] for i in order.tolist()])
+            scaled_kinds |= scaled << position
+            term_section = encode_vbyte_list(gaps)
+            counts += [len(gaps), len(term_section), len(weight_section)]
+            sections += [term_section, weight_section]
+        return b"".join([bytes([scaled_kinds]), bytes(encode_vbyte_list(counts))] +
+                        [bytes(section) for section in sections])
+
+
+class ForwardIndex:
+    """
+    Read-only, memory-mapped view of a forward index written by ForwardIndexWriter: the term numbers and tf-idf
+    weights of every document, looked up by doc number.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.doc_count, block_offsets_pos, lengths_pos, _ = HEADER_FORMAT.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{filename} is not a forward index (version {VERSION})")
+        self.block_offsets = np.frombuffer(self.buffer, dtype=OFFSET_DTYPE, count=self.doc_count + 1,
+                                           offset=block_offsets_pos)
+        self.vector_lengths = np.frombuffer(self.buffer, dtype=LENGTH_DTYPE, count=self.doc_count * len(KINDS),
+                                            offset=lengths_pos).reshape(len(KINDS), self.doc_count)
+
+    def close(self):
+        self.block_offsets = self.vector_lengths = None
+        self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.doc_count
+
+    def vector_length(self, doc_number, kind="unigram"):
+        return float(self.vector_lengths[KINDS.index(kind), doc_number])
+
+    def document_terms(self, doc_number, kind="unigram"):
+        """
+        Return the sorted term numbers of the document and their tf-idf weights.
+        """
+        offset = int(self.block_offsets[doc_number])
+        scaled_kinds = self.buffer[offset]
+        counts, offset = read_vbyte_ints(self.buffer, offset + 1, 3 * len(KINDS))
+        for position in range(len(KINDS)):
+            count, term_length, weight_length = counts[3 * position:3 * position + 3]
+            if KINDS[position] == kind:
+                term_numbers = np.cumsum(decode_vbyte(self.buffer, offset, term_length))
+                if not weight_length:
+                    weights = np.zeros(count)
+                elif scaled_kinds >> position & 1:
+                    weights = decode_vbyte(self.buffer, offset + term_length, weight_length) / SCALE
+                else:
+                    weights = np.frombuffer(self.buffer, dtype="<f8", count=count, offset=offset + term_length).copy()
+                return term_numbers, weights
+            offset += term_length + weight_length
+        raise ValueError(f"unknown term kind {kind}")
+
+    def normalized_weights(self, doc_number, kind="unigram"):
+        """
+        Return the sorted term numbers of the document and their cosine-normalized tf-idf weights.
+        """
+        term_numbers, weights = self.document_terms(doc_number, kind)
+        length = self.vector_length(doc_number, kind)
+        return term_numbers, weights / length if length else weights
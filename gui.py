@@ -1,32 +1,47 @@
 import tkinter as tk
 import webbrowser
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from tkinter import scrolledtext
-from index_constructor import (read_index_from_file, load_json_data, read_meta_data_index_from_file,
-                               read_bigram_positions)
-from advanced_query import advanced_query
+from binary_index import BinaryIndex
+from position_index import PositionIndex
+from advanced_query import top_k_query, preprocess_query
+from document_store import DocumentStore, query_snippet
+from segments import SegmentSet, manifest_file
+from query_cache import QueryCache
+from spelling import SpellingCorrector
+from metrics import query_trace, stage
 
 bookkeeping_input = "webpages_raw/bookkeeping.json"
 directory_path = "webpages_raw/"
 # bookkeeping_input = "test/test.json"
 # directory_path = "test/"
-output_file = "inverted_index.txt"
-output_file_bigram = "inverted_bigram_index.txt"
-meta_data_file = "meta_data_file.txt"
-bigram_positions_file = 'bigram_position.txt'
+output_file = "inverted_index.bin"
+output_file_bigram = "inverted_bigram_index.bin"
+document_store_file = "document_store.bin"
+bigram_positions_file = 'bigram_positions.bin'
+spelling_file = 'spelling_dictionary.bin'
+PAGE_SIZE = 20
+# Results fetched per query; paging past them fetches PAGES_PER_FETCH more pages
+PAGES_PER_FETCH = 5
+POLL_MILLISECONDS = 50
 
 
 class SearchEngineGUI:
-    def __init__(self, master, bookkeeping_input, output_file, output_file_bigram, meta_data_file, bigram_positions_file):
+    def __init__(self, master, bookkeeping_input, output_file, output_file_bigram, document_store_file,
+                 bigram_positions_file, spelling_file=None, segments_directory=None):
         self.master = master
         master.title("Search Engine")
         master.geometry("1000x750")
+        master.protocol("WM_DELETE_WINDOW", self.close)
 
         self.label = tk.Label(master, text="Enter your query:")
         self.label.pack()
 
         self.entry = tk.Entry(master, width=100)
         self.entry.pack()
+        self.entry.bind("<Return>", lambda event: self.search())
 
         self.search_button = tk.Button(master, text="Search", command=self.search)
         self.search_button.pack()
@@ -37,49 +52,182 @@ class SearchEngineGUI:
         self.results_text.pack(fill=tk.BOTH, expand=True)
         self.results_text.config(state=tk.DISABLED)
 
+        self.navigation_frame = tk.Frame(master)
+        self.navigation_frame.pack()
+        self.previous_button = tk.Button(self.navigation_frame, text="< Previous", command=self.previous_page,
+                                         state=tk.DISABLED)
+        self.previous_button.pack(side=tk.LEFT)
+        self.page_label = tk.Label(self.navigation_frame, text="")
+        self.page_label.pack(side=tk.LEFT)
+        self.next_button = tk.Button(self.navigation_frame, text="Next >", command=self.next_page, state=tk.DISABLED)
+        self.next_button.pack(side=tk.LEFT)
+
+        # Queries run on one worker thread, which is the only user of the indexes and the query cache
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        # Every new search increments the generation; the results of older searches are dropped, never shown
+        self.generation = 0
+        self.query = ""
+        self.result_list = []
+        self.total_hits = 0
+        self.requested_k = 0
+        self.page = 0
+
         start_time = time.time()
-        self.index = read_index_from_file(output_file)
-        self.bigram_index = read_index_from_file(output_file_bigram)
-        self.json_data = load_json_data(bookkeeping_input)
-        self.meta_index = read_meta_data_index_from_file(meta_data_file)
-        self.bigram_positions = read_bigram_positions(bigram_positions_file)
+        self.bookkeeping_input = bookkeeping_input
+        if segments_directory:
+            # Incremental index: the segments replace the index, position and document store files
+            self.query_cache = QueryCache([manifest_file(segments_directory)])
+            segment_set = self.query_cache.watch(SegmentSet(segments_directory))
+            self.index = self.query_cache.wrap(segment_set.index("unigram"), "unigram")
+            self.bigram_index = self.query_cache.wrap(segment_set.index("bigram"), "bigram")
+            self.bigram_positions = segment_set.positions()
+            self.document_store = segment_set
+        else:
+            self.query_cache = QueryCache([output_file, output_file_bigram, bigram_positions_file,
+                                           document_store_file])
+            self.index = self.query_cache.wrap(BinaryIndex(output_file), "unigram")
+            self.bigram_index = self.query_cache.wrap(BinaryIndex(output_file_bigram), "bigram")
+            self.bigram_positions = self.query_cache.watch(PositionIndex(bigram_positions_file))
+            # Titles, URLs and snippet text are read from the store only for the results on screen
+            self.document_store = self.query_cache.watch(DocumentStore(document_store_file))
+        # Without a spelling dictionary the query is searched exactly as typed
+        self.corrector = SpellingCorrector.load(spelling_file) if spelling_file else None
         end_time = time.time() 
         elapsed_time = end_time - start_time
         print(f"Time for Loading Index: {elapsed_time} seconds")
 
 
     def search(self):
+        # The analyzer lowercases the query words; the operators of the query language must keep their case
+        query = self.entry.get()
+        self.generation += 1
+        if self.pending is not None:
+            # A previous search still queued never starts; a running one is not interrupted, it finishes on the
+            # worker and its results are dropped
+            self.pending.cancel()
+            self.pending = None
+        self.query = query
+        self.show_message("Searching...")
+        self.submit(self.fetch_page, query, PAGE_SIZE * PAGES_PER_FETCH, 0, None, 0)
+
+
+    def next_page(self):
+        self.show_page(self.page + 1)
+
+
+    def previous_page(self):
+        self.show_page(self.page - 1)
+
+
+    def show_page(self, page):
+        if page < 0 or self.pending is not None:
+            return
+        if page * PAGE_SIZE < len(self.result_list):
+            self.submit(self.fetch_page, self.query, self.requested_k, page, self.result_list, self.total_hits)
+        else:
+            # Past the fetched results: ask the index for a few more pages
+            self.submit(self.fetch_page, self.query, (page + PAGES_PER_FETCH) * PAGE_SIZE, page, None, 0)
+
+
+    def submit(self, task, *args):
+        generation = self.generation
+        self.pending = self.executor.submit(task, *args, generation)
+        self.master.after(POLL_MILLISECONDS, self.poll, self.pending, generation)
+
+
+    def poll(self, future, generation):
+        if generation != self.generation or future.cancelled():
+            return
+        if not future.done():
+            self.master.after(POLL_MILLISECONDS, self.poll, future, generation)
+            return
+        self.pending = None
+        try:
+            result = future.result()
+        except Exception as error:
+            self.show_message(f"Search failed: {error}")
+            return
+        if result is not None:
+            self.result_list, self.total_hits, self.requested_k, self.page, entries = result
+            self.display_results(entries, self.total_hits)
+
+
+    def fetch_page(self, query, k, page, result_list, total_hits, generation):
+        """
+        Runs on the worker thread: answers the query with the k best results unless they are given,
+        then loads the titles, URLs and query snippets of the results on the page. A search made stale by a
+        newer one before or after its query returns None instead.
+        """
+        if generation != self.generation:
+            return None
         start_time = time.time()
-        self.results_text.config(state=tk.NORMAL)  # Set the state to NORMAL before each search
-        query = self.entry.get().lower()
-        result_list = advanced_query(query, self.index, self.bigram_index, self.bigram_positions, bookkeeping_input)
-        self.display_results(result_list)
-        self.results_text.config(state=tk.DISABLED)  # Set the state back to DISABLED after displaying the results
-        end_time = time.time() 
-        elapsed_time = end_time - start_time
-        print(f"Search time: {elapsed_time} seconds")
+        with query_trace(query) if result_list is None else nullcontext():
+            if result_list is None:
+                result_list, total_hits = top_k_query(query, self.index, self.bigram_index, self.bigram_positions,
+                                                      self.bookkeeping_input, k=k, cache=self.query_cache,
+                                                      corrector=self.corrector)
+                print(f"Search time: {time.time() - start_time} seconds")
+            if generation != self.generation:
+                return None
+            # A page past the last result shows the last page instead
+            page = max(0, min(page, (len(result_list) - 1) // PAGE_SIZE))
+            with stage("render"):
+                entries = self.page_entries(query, result_list, page)
+        return result_list, total_hits, k, page, entries
+
 
-    
-    def display_results(self, doc_id_set):
+    def page_entries(self, query, result_list, page):
+        query_terms = [term for term, _ in preprocess_query(query, self.corrector)]
+        entries = []
+        for rank, doc_id in enumerate(result_list[page * PAGE_SIZE:(page + 1) * PAGE_SIZE],
+                                      start=page * PAGE_SIZE + 1):
+            document = self.document_store.document(doc_id)
+            if document is not None:
+                snippet = query_snippet(document.body, query_terms) or "Description not available"
+                entries.append((rank, document.title, snippet, "https://" + document.url))
+        return entries
+
+
+    def display_results(self, entries, total_hits):
         self.results_text.config(state=tk.NORMAL)
         self.results_text.delete(1.0, tk.END)
-        if not doc_id_set:
+        if not entries:
             self.results_text.insert(tk.END, "No results found.")
         else:
-            self.results_text.insert(tk.END, f"Total number of URLs found: {len(doc_id_set)}\n\n")
-            for i, doc_id in enumerate(sorted(doc_id_set)[:20], start=1):
-                if doc_id in self.json_data:
-                    metadata = self.meta_index[doc_id]
-                    title = metadata[0]
-                    description = metadata[1] if len(metadata) > 1 else "Description not available"
-                    link_url = "https://" + self.json_data[doc_id]
-                    link_tag = f"link_{i}"
-                    self.results_text.insert(tk.END, f"{i}: {title}\n", link_tag)
-                    self.results_text.insert(tk.END, f"{description}\n")
-                    self.results_text.tag_config(link_tag, foreground="blue", underline=True)
-                    self.results_text.tag_bind(link_tag, "<Button-1>", lambda e, url=link_url: self.open_link(url))
+            self.results_text.insert(tk.END, f"Total number of URLs found: {total_hits}\n\n")
+            for rank, title, description, link_url in entries:
+                link_tag = f"link_{rank}"
+                self.results_text.insert(tk.END, f"{rank}: {title}\n", link_tag)
+                self.results_text.insert(tk.END, f"{description}\n")
+                self.results_text.tag_config(link_tag, foreground="blue", underline=True)
+                self.results_text.tag_bind(link_tag, "<Button-1>", lambda e, url=link_url: self.open_link(url))
+        self.results_text.config(state=tk.DISABLED)
+
+        # All k requested results came back, so there may be more after them
+        more_results = (self.page + 1) * PAGE_SIZE < len(self.result_list) or \
+            len(self.result_list) == self.requested_k
+        self.previous_button.config(state=tk.NORMAL if self.page > 0 else tk.DISABLED)
+        self.next_button.config(state=tk.NORMAL if entries and more_results else tk.DISABLED)
+        self.page_label.config(text=f"Page {self.page + 1}" if entries else "")
+
+
+    def show_message(self, message):
+        self.results_text.config(state=tk.NORMAL)
+        self.results_text.delete(1.0, tk.END)
+        self.results_text.insert(tk.END, message)
+        self.results_text.config(state=tk.DISABLED)
+        self.previous_button.config(state=tk.DISABLED)
+        self.next_button.config(state=tk.DISABLED)
+        self.page_label.config(text="")
 
 
     def open_link(self, url):
         webbrowser.open_new(url)
-        
\ No newline at end of file
+
+
+    def close(self):
+        self.generation += 1
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.master.destroy()
+        self.document_store.close()
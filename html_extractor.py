@@ -0,0 +1,214 @@
+from lxml import etree
+
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+# BeautifulSoup stores the strings inside these tags as Script, Stylesheet, ... instead of plain text,
+# so get_text() leaves them out
+STRING_CONTAINER_TAGS = {'rt', 'rp', 'style', 'script', 'template'}
+PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+
+class ExtractionTarget:
+    """
+    lxml parser target collecting the fields of parse_html_content from the parse events.
+
+    BeautifulSoup's lxml builder sees the same events, so the strings here are the strings of its tree.
+    Instead of extracting meta, title, headings, bold text and links one after the other, every string is
+    routed to the fields it belongs to while it is parsed: text under the first title is removed from
+    everything else, headings are removed from bold text and anchors, and bold text from anchors.
+    """
+
+    def __init__(self):
+        self.stack = []
+        self.pending_data = []
+        self.strings = []
+        self.body_parts = []
+        self.remaining_text = []
+        self.meta_texts = []
+        self.headings = []
+        self.bold_texts = []
+        self.anchors = []
+        self.open_headings = []
+        self.open_bold_texts = []
+        self.open_anchors = []
+        self.title_seen = False
+        self.title_nodes = []
+        self.title_children = None
+        self.body_seen = False
+        self.body_open = False
+        self.container_depth = 0
+        self.preserve_depth = 0
+        self.heading_depth = 0
+        self.bold_depth = 0
+
+    def start(self, tag, attrib):
+        self.flush_data()
+        title_child = bool(self.title_nodes)
+        if title_child:
+            children = []
+            self.title_nodes[-1].append(children)
+            self.title_nodes.append(children)
+        record = None
+
+        if tag in STRING_CONTAINER_TAGS:
+            self.container_depth += 1
+        if tag in PRESERVE_WHITESPACE_TAGS:
+            self.preserve_depth += 1
+
+        if tag == 'meta':
+            content = attrib.get('content', '').strip()
+            if content:
+                self.meta_texts.append(content)
+        elif tag == 'title' and not self.title_seen:
+            self.title_seen = True
+            self.title_children = []
+            self.title_nodes = [self.title_children]
+            record = True
+        elif tag in HEADING_TAGS:
+            if not title_child:
+                record = (len(self.headings), [])
+                self.headings.append(None)
+                self.open_headings.append(record[1])
+            self.heading_depth += 1
+        elif tag == 'b':
+            if not title_child and not self.heading_depth:
+                record = (len(self.bold_texts), [])
+                self.bold_texts.append(None)
+                self.open_bold_texts.append(record[1])
+            self.bold_depth += 1
+        elif tag == 'a' and 'href' in attrib:
+            if not title_child and not self.heading_depth and not self.bold_depth:
+                record = ([], attrib['href'])
+                self.anchors.append(record)
+                self.open_anchors.append(record[0])
+        elif tag == 'body' and not self.body_seen:
+            self.body_seen = self.body_open = True
+            record = True
+        self.stack.append((tag, title_child, record))
+
+    def end(self, tag):
+        self.flush_data()
+        tag, title_child, record = self.stack.pop()
+        if title_child:
+            self.title_nodes.pop()
+        if tag in STRING_CONTAINER_TAGS:
+            self.container_depth -= 1
+        if tag in PRESERVE_WHITESPACE_TAGS:
+            self.preserve_depth -= 1
+
+        if tag == 'title' and record:
+            self.title_nodes = []
+        elif tag in HEADING_TAGS:
+            self.heading_depth -= 1
+            if record:
+                self.open_headings.pop()
+                self.headings[record[0]] = ''.join(record[1])
+        elif tag == 'b':
+            self.bold_depth -= 1
+            if record:
+                self.open_bold_texts.pop()
+                self.bold_texts[record[0]] = ''.join(record[1])
+        elif tag == 'a' and record:
+            self.open_anchors.pop()
+        elif tag == 'body' and record:
+            self.body_open = False
+
+    def data(self, data):
+        self.pending_data.append(data)
+
+    def comment(self, text):
+        self.flush_data()
+        self.pending_data.append(text)
+        self.flush_data(main_content=False)
+
+    def doctype(self, name, pubid, system):
+        self.flush_data()
+        value = name or ''
+        if pubid is not None:
+            value += ' PUBLIC "%s"' % pubid
+            if system is not None:
+                value += ' "%s"' % system
+        elif system is not None:
+            value += ' SYSTEM "%s"' % system
+        self.pending_data.append(value)
+        self.flush_data(main_content=False)
+
+    def pi(self, target, data):
+        self.flush_data()
+        self.pending_data.append(target + ' ' + data)
+        self.flush_data(main_content=False)
+
+    def flush_data(self, main_content=True):
+        """
+        Turn the data received since the last event into one string, as BeautifulSoup does.
+        """
+        if not self.pending_data:
+            return
+        text = ''.join(self.pending_data)
+        self.pending_data = []
+        # Whitespace-only strings collapse to a single newline or space outside <pre> and <textarea>
+        if not self.preserve_depth and not text.strip(ASCII_SPACES):
+            text = '\n' if '\n' in text else ' '
+        self.add_string(text, main_content and not self.container_depth)
+
+    def add_string(self, text, main_content):
+        self.strings.append(text)
+        if main_content and self.body_open:
+            self.body_parts.append(text)
+        if self.title_nodes:
+            self.title_nodes[-1].append(text)
+            return
+        stripped = text.strip()
+        if not stripped:
+            return
+        if main_content:
+            for parts in self.open_headings:
+                parts.append(stripped)
+            if not self.heading_depth:
+                for parts in self.open_bold_texts:
+                    parts.append(stripped)
+                if not self.bold_depth:
+                    for parts in self.open_anchors:
+                        parts.append(stripped)
+        if not self.heading_depth and not self.bold_depth:
+            self.remaining_text.append(stripped)
+
+    def close(self):
+        self.flush_data()
+        titles = []
+        if self.title_seen:
+            title = single_string(self.title_children)
+            titles.append(title.strip() if title else '')
+        anchor_texts = [''.join(parts) for parts, _ in self.anchors if parts]
+        links = [href for _, href in self.anchors if href]
+        return (titles, self.headings, self.meta_texts, self.bold_texts, anchor_texts, links,
+                ' '.join(self.remaining_text), ''.join(self.body_parts).strip() if self.body_seen else '',
+                ' '.join(self.strings))
+
+
+def single_string(children):
+    """
+    Equivalent of BeautifulSoup's Tag.string: the only string below a chain of single children, or None.
+    """
+    if len(children) != 1:
+        return None
+    child = children[0]
+    if isinstance(child, str):
+        return child
+    return single_string(child)
+
+
+def extract_html_content(content):
+    """
+    Parse the page once and return (titles, headings, meta texts, bold texts, anchor texts, links,
+    remaining text, body text, all text) exactly as the BeautifulSoup walk in parse_html_content does.
+    Raises ValueError if lxml rejects the page.
+    """
+    if content[:1] == '\N{BYTE ORDER MARK}':
+        content = content[1:]
+    parser = etree.HTMLParser(target=ExtractionTarget(), recover=True)
+    try:
+        parser.feed(content)
+        return parser.close()
+    except etree.LxmlError as error:
+        raise ValueError(f"lxml could not parse the page: {error}") from error
@@ -0,0 +1,62 @@
+import argparse
+import os
+import random
+import sys
+import time
+from index_constructor import load_json_data, extract_html_content_with_soup
+from html_extractor import extract_html_content
+
+FIELD_NAMES = ("titles", "headings", "meta_texts", "bold_texts", "anchor_texts", "links", "remaining_text",
+               "body_content", "text_content")
+
+
+def check_parity(bookkeeping_input, directory_path, sample_size=500, seed=0):
+    """
+    Run the streaming extractor and the BeautifulSoup extraction on a random sample of the corpus,
+    returning the mismatching (doc_id, field) pairs and the time spent by each extractor.
+    """
+    doc_ids = sorted(load_json_data(bookkeeping_input))
+    sample = random.Random(seed).sample(doc_ids, min(sample_size, len(doc_ids)))
+    mismatches = []
+    streaming_seconds = soup_seconds = 0
+    for doc_id in sample:
+        with open(os.path.join(directory_path, doc_id), "r", encoding="utf-8") as file:
+            content = file.read()
+
+        start_time = time.perf_counter()
+        expected = extract_html_content_with_soup(content)
+        soup_seconds += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        try:
+            extracted = extract_html_content(content)
+        except ValueError:
+            # Rejected pages fall back to BeautifulSoup in parse_html_content
+            extracted = expected
+        streaming_seconds += time.perf_counter() - start_time
+
+        for name, expected_value, value in zip(FIELD_NAMES, expected, extracted):
+            if expected_value != value:
+                mismatches.append((doc_id, name))
+    return mismatches, len(sample), streaming_seconds, soup_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the streaming HTML extractor with BeautifulSoup.")
+    parser.add_argument("--bookkeeping", default="webpages_raw/bookkeeping.json")
+    parser.add_argument("--directory", default="webpages_raw/")
+    parser.add_argument("--sample-size", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mismatches, checked, streaming_seconds, soup_seconds = check_parity(args.bookkeeping, args.directory,
+                                                                        args.sample_size, args.seed)
+    for doc_id, name in mismatches:
+        print(f"MISMATCH {doc_id}: {name}")
+    print(f"Checked {checked} pages, {len(mismatches)} mismatching fields")
+    print(f"Streaming: {streaming_seconds:.3f}s, BeautifulSoup: {soup_seconds:.3f}s")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,24 @@
 import json
-import nltk
-import re
 import math
-import networkx as nx
-from bs4 import BeautifulSoup
-from nltk.corpus import stopwords, words
-from nltk.stem import WordNetLemmatizer
+import os
+from contextlib import ExitStack
+from functools import partial
+from multiprocessing import Pool
 from PostingObject import PostingObject
-
-nltk.download('punkt')
-nltk.download('stopwords')
-nltk.download('wordnet')
-nltk.download('words')
+from binary_index import write_binary_index
+from position_index import PositionIndexWriter, encode_document_positions
+from spelling import SpellingCorrector
+from analyzer import get_analyzer
+from pagerank import link_graph, graph_pagerank, load_pagerank, save_pagerank
+from forward_index import ForwardIndexWriter
+from document_store import DocumentStoreWriter, encode_document
+
+# Number of documents parsed per slice; position and metadata output is flushed after each slice
+DOCUMENTS_PER_CHUNK = 100
+# Estimated bytes of encoded positions a position writer collects before spilling them to a run
+POSITION_MEMORY_BUDGET = 64 * 1024 * 1024
+# Extract page fields in one lxml pass instead of walking a BeautifulSoup tree; both give the same fields
+STREAMING_HTML_EXTRACTION = True
 
 
 def preprocess_text(content):
@@ -19,19 +26,7 @@ def preprocess_text(content):
     Tokenize the content using NLTK, remove stopwords, perform lemmatization,
     and filter out terms not present in NLTK's word corpus.
     """
-    tokens = re.split(r'[^a-zA-Z]', content.lower())
-    stop_words = set(stopwords.words('english'))
-    lemmatizer = WordNetLemmatizer()
-    lemmatized_tokens = []
-    english_words = set(words.words())
-    # Lemmatize known words, otherwise add them as they are
-    for token in tokens:
-        if token not in stop_words and len(token) > 1:
-            if token in english_words:
-                lemmatized_tokens.append(lemmatizer.lemmatize(token))
-            else:
-                lemmatized_tokens.append(token)
-    return lemmatized_tokens
+    return get_analyzer().analyze(content)
 
 
 def load_json_data(bookkeeping_input):
@@ -43,24 +38,21 @@ def load_json_data(bookkeeping_input):
 
 
 def parse_html_content(content):
-    # Initialize lists to store extracted data
-    meta_texts = []
-    titles = []
-    headings = []
-    bold_texts = []
-    remaining_text = []
-    anchor_texts = []
-    links = []
-
-    # Parse the HTML content
-    soup = BeautifulSoup(content, 'lxml')
-
-    # Extract text content from the soup object
-    text_content = soup.find_all(text=True)
-    text_content = ' '.join(text_content)
-
-    # Get text for description
-    body_content = soup.body.get_text().strip() if soup.body else ""
+    """
+    Extract the weighted fields of a page plus the positions of its words and bigrams.
+    """
+    extracted = None
+    if STREAMING_HTML_EXTRACTION:
+        from html_extractor import extract_html_content
+        try:
+            extracted = extract_html_content(content)
+        except ValueError:
+            # lxml rejected the page, let BeautifulSoup try its other parsing strategies
+            pass
+    if extracted is None:
+        extracted = extract_html_content_with_soup(content)
+    (titles, headings, meta_texts, bold_texts, anchor_texts, links, remaining_text_str, body_content,
+     text_content) = extracted
 
     # Split the text content into words based on whitespace
     words = preprocess_text(text_content)
@@ -80,6 +72,36 @@ def parse_html_content(content):
             bigram_positions[bigram] = []
         bigram_positions[bigram].append(position)
 
+    return (titles, headings, meta_texts, bold_texts, anchor_texts, links, remaining_text_str, body_content,
+            word_positions,bigram_positions)
+
+
+def extract_html_content_with_soup(content):
+    """
+    Reference extraction over a BeautifulSoup tree, used for pages the streaming extractor rejects.
+    """
+    # Imported here so the query path, which never parses HTML, does not pay for bs4
+    from bs4 import BeautifulSoup
+
+    # Initialize lists to store extracted data
+    meta_texts = []
+    titles = []
+    headings = []
+    bold_texts = []
+    remaining_text = []
+    anchor_texts = []
+    links = []
+
+    # Parse the HTML content
+    soup = BeautifulSoup(content, 'lxml')
+
+    # Extract text content from the soup object
+    text_content = soup.find_all(text=True)
+    text_content = ' '.join(text_content)
+
+    # Get text for description
+    body_content = soup.body.get_text().strip() if soup.body else ""
+
     # Extract meta tags
     meta_tags = soup.find_all('meta')
     for tag in meta_tags:
@@ -126,7 +148,7 @@ def parse_html_content(content):
     # Join the remaining text elements into a single string
     remaining_text_str = ' '.join(remaining_text)
     return (titles, headings, meta_texts, bold_texts, anchor_texts, links, remaining_text_str, body_content,
-            word_positions,bigram_positions)
+            text_content)
 
 
 def build_meta_data_file(meta_data_index, file_id, title_text, description_text):
@@ -144,31 +166,165 @@ def write_meta_data_index_to_file(meta_data_index, filename):
         json.dump(meta_data_index, file)
 
 
+class MetaDataWriter:
+    """
+    Stream metadata entries to a JSON object file as they are produced, in the same format as
+    write_meta_data_index_to_file.
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'w')
+        self.first_entry = True
+        self.file.write('{')
+
+    def write(self, meta_data_index):
+        for file_id, entry in meta_data_index.items():
+            if not self.first_entry:
+                self.file.write(', ')
+            self.file.write(f"{json.dumps(file_id)}: {json.dumps(entry)}")
+            self.first_entry = False
+
+    def close(self):
+        self.file.write('}')
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 def read_meta_data_index_from_file(filename):
     with open(filename, 'r') as file:
         meta_data_index = json.load(file)
     return meta_data_index
 
 
-def build_inverted_index(bookkeeping_input, directory_path, output_file, output_file_2g, meta_data_file):
+def build_inverted_index(bookkeeping_input, directory_path, output_file, output_file_2g, meta_data_file, workers=1,
+                         bigram_position_file=None, word_position_file=None, spelling_file=None, pagerank_file=None,
+                         forward_index_file=None, document_store_file=None, champion_size=0):
     """
     Build the inverted index using a dictionary from the JSON data and write it to a file.
+
+    Every document is parsed once and numbered by its position in bookkeeping_input; both indexes and the
+    position files use these doc numbers. The metadata is streamed to disk slice by slice while the indexes
+    are being built. The bigram and word positions, when their files are given, are spilled to term-sorted
+    runs next to their files whenever POSITION_MEMORY_BUDGET bytes of them have been collected, and the runs
+    are merged into the files after the last slice. With workers > 1 the slices are parsed in separate
+    processes; they are merged in corpus order so the output matches the serial build.
+
+    The term frequencies of every document go into a forward index in the same pass; it gives the tf-idf
+    vector lengths for the cosine-normalized weights of both indexes and is written to forward_index_file.
+    The title, URL and body text of every document are compressed by the workers and streamed to
+    document_store_file, from which the result pages load their titles and snippets.
+    With champion_size > 0 both indexes also hold the champion list of every term, its champion_size best
+    postings, from which top k queries are answered first.
     """
+    valid_links = {}
+    pagerank = {}
     inverted_index = {}
     inverted_bigram_index = {}
+    forward_index = ForwardIndexWriter()
     out_links = {}
-    valid_links = {}
-    meta_data_index = {}
-    pagerank = {}
-    # word_with_doc_id = {}
-    bigram_with_doc_id = {}
-    # doc_id_with_length = {}
-    doc_id_with_length_bigram = {}
     json_data = load_json_data(bookkeeping_input)
     for doc_id, link in json_data.items():
         valid_links[link] = doc_id
     total_docs = len(json_data)
-    for doc_id, link in json_data.items():
+    doc_keys = list(json_data)
+    doc_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(doc_keys)}
+    chunks = split_documents(list(json_data.items()), DOCUMENTS_PER_CHUNK)
+    index_chunk = partial(index_documents, directory_path=directory_path,
+                          with_positions=(bigram_position_file is not None, word_position_file is not None),
+                          with_documents=document_store_file is not None)
+
+    with ExitStack() as stack:
+        meta_data_writer = stack.enter_context(MetaDataWriter(meta_data_file))
+        bigram_position_writer = word_position_writer = None
+        if bigram_position_file:
+            bigram_position_writer = stack.enter_context(spilling_position_writer(bigram_position_file))
+        if word_position_file:
+            word_position_writer = stack.enter_context(spilling_position_writer(word_position_file))
+        document_store_writer = None
+        if document_store_file:
+            document_store_writer = stack.enter_context(DocumentStoreWriter(document_store_file, doc_keys))
+        if workers > 1:
+            partial_results = stack.enter_context(Pool(workers)).imap(index_chunk, chunks)
+        else:
+            partial_results = map(index_chunk, chunks)
+
+        for (partial_index, partial_bigram_index, partial_meta_data, partial_term_frequencies, partial_out_links,
+             partial_bigram_positions, partial_word_positions, partial_documents) in partial_results:
+            merge_partial_maps((inverted_index, inverted_bigram_index, out_links),
+                               (partial_index, partial_bigram_index, partial_out_links))
+            meta_data_writer.write(partial_meta_data)
+            for doc_id, term_frequencies, bigram_frequencies in partial_term_frequencies:
+                forward_index.add_document(doc_numbers[doc_id], term_frequencies, bigram_frequencies)
+            for position_writer, partial_positions in ((bigram_position_writer, partial_bigram_positions),
+                                                       (word_position_writer, partial_word_positions)):
+                for doc_id, encoded_positions in partial_positions:
+                    position_writer.add_document(doc_numbers[doc_id], encoded_positions)
+            for doc_id, record in partial_documents:
+                document_store_writer.add_document(doc_numbers[doc_id], record)
+
+        if bigram_position_writer:
+            bigram_position_writer.write(bigram_position_file)
+        if word_position_writer:
+            word_position_writer.write(word_position_file)
+
+    calculate_tf_idf(inverted_index, total_docs)
+    calculate_tf_idf(inverted_bigram_index, total_docs)
+
+    vector_lengths = {"unigram": calculate_vector_length(forward_index, "unigram", inverted_index, total_docs),
+                      "bigram": calculate_vector_length(forward_index, "bigram", inverted_bigram_index, total_docs)}
+    for index, kind in ((inverted_index, "unigram"), (inverted_bigram_index, "bigram")):
+        add_normalized_vector(index, {doc_keys[doc_number]: length
+                                      for doc_number, length in vector_lengths[kind].items()})
+    if forward_index_file:
+        forward_index.write(forward_index_file, total_docs, vector_lengths)
+
+    pagerank = calculate_pagerank(out_links, valid_links, pagerank_file)
+    add_pagerank_values(inverted_index, pagerank)
+    add_pagerank_values(inverted_bigram_index, pagerank)
+
+    write_binary_index(inverted_index, output_file, doc_keys, champion_size)
+    write_binary_index(inverted_bigram_index, output_file_2g, doc_keys, champion_size)
+    if spelling_file:
+        write_spelling_dictionary(inverted_index, spelling_file)
+
+
+def spilling_position_writer(position_file):
+    """
+    A PositionIndexWriter that spills its runs to the directory of position_file.
+    """
+    return PositionIndexWriter(POSITION_MEMORY_BUDGET, os.path.dirname(os.path.abspath(position_file)))
+
+
+def write_spelling_dictionary(inverted_index, spelling_file):
+    """
+    Store the symmetric-delete spelling dictionary of the unigram vocabulary and its document frequencies.
+    """
+    term_frequencies = {term: len(postings) for term, postings in inverted_index.items()}
+    SpellingCorrector.from_frequencies(term_frequencies).save(spelling_file)
+
+
+def index_documents(documents, directory_path, with_positions=(False, False), with_documents=False):
+    """
+    Parse and tokenize a list of (doc_id, link) pairs, returning the partial unigram index, bigram index,
+    metadata, (doc_id, term frequencies, bigram frequencies) of every document and out-links for those
+    documents, plus their bigram and word positions already encoded for the position files and their
+    compressed document store records.
+    """
+    inverted_index = {}
+    inverted_bigram_index = {}
+    out_links = {}
+    meta_data_index = {}
+    doc_term_frequencies = []
+    encoded_bigram_positions = []
+    encoded_word_positions = []
+    encoded_documents = []
+    with_bigram_positions, with_word_positions = with_positions
+    for doc_id, link in documents:
         file_path = directory_path + doc_id
         print(file_path)
         with open(file_path, "r", encoding="utf-8") as file:
@@ -180,48 +336,52 @@ def build_inverted_index(bookkeeping_input, directory_path, output_file, output_
             for out_link in links:
                 out_links.setdefault(link, []).append(out_link)
 
-            title_text, description_text = build_initial_index(title, headings, meta_texts, bold_texts, anchor_texts,
-                                                               remaining_text_str, body_content, inverted_index,
-                                                               inverted_bigram_index, doc_id)
+            title_text, description_text, term_frequencies, bigram_frequencies = build_initial_index(
+                title, headings, meta_texts, bold_texts, anchor_texts, remaining_text_str, body_content,
+                inverted_index, inverted_bigram_index, doc_id)
             build_meta_data_file(meta_data_index, doc_id, title_text, description_text)
-            # create_doc_id_with_word(word_with_doc_id, doc_id, word_positions)
-            create_doc_id_with_word(bigram_with_doc_id, doc_id, bigram_positions)
-
-    calculate_tf_idf(inverted_index, total_docs)
-    calculate_tf_idf(inverted_bigram_index, total_docs)
-
-    # calculate_vector_length(doc_id_with_length, final_index, word_with_doc_id)
-    calculate_vector_length(doc_id_with_length_bigram, inverted_bigram_index, bigram_with_doc_id)
-
-    # add_normalized_vector(final_index, doc_id_with_length)
-    add_normalized_vector(inverted_bigram_index, doc_id_with_length_bigram)
-
-    pagerank = calculate_pagerank(out_links, valid_links)
-    add_pagerank_values(inverted_index, pagerank)
-    add_pagerank_values(inverted_bigram_index, pagerank)
-
-    write_index_to_file(inverted_index, output_file)
-    write_index_to_file(inverted_bigram_index, output_file_2g)
-    write_meta_data_index_to_file(meta_data_index, meta_data_file)
+            doc_term_frequencies.append((doc_id, term_frequencies, bigram_frequencies))
+            if with_bigram_positions:
+                encoded_bigram_positions.append((doc_id, encode_document_positions(bigram_positions)))
+            if with_word_positions:
+                encoded_word_positions.append((doc_id, encode_document_positions(word_positions)))
+            if with_documents:
+                encoded_documents.append((doc_id, encode_document(title_text, link, body_content)))
+    return (inverted_index, inverted_bigram_index, meta_data_index, doc_term_frequencies, out_links,
+            encoded_bigram_positions, encoded_word_positions, encoded_documents)
+
+
+def split_documents(documents, chunk_size):
+    """
+    Split the documents into contiguous slices of at most chunk_size documents.
+    """
+    return [documents[start:start + chunk_size] for start in range(0, len(documents), chunk_size)]
 
 
-def create_doc_id_with_word(word_with_doc_id, file_id, word_positions):
-    word_with_doc_id[file_id] = []
-    for word, _ in word_positions.items():
-        word_with_doc_id[file_id].append(word)
+def merge_partial_maps(merged_maps, partial_maps):
+    """
+    Append the maps produced by index_documents for one slice to the maps of the preceding slices.
+    """
+    inverted_index, inverted_bigram_index, out_links = merged_maps
+    partial_index, partial_bigram_index, partial_out_links = partial_maps
+    for index, partial_index_map in ((inverted_index, partial_index), (inverted_bigram_index, partial_bigram_index),
+                                     (out_links, partial_out_links)):
+        for key, values in partial_index_map.items():
+            index.setdefault(key, []).extend(values)
 
 
 def build_initial_index(title, headings, meta_texts, bold_texts, anchor_texts, remaining_text_str, body_content,
                         initial_index, initial_bigram_index, file_id):
     """
     Build an initial version of the index.
+    Returns the title and description text and the term and bigram frequencies of the document.
     """
-    # Preprocess text and convert to tuples to make it hashable
-    title_token = tuple(preprocess_text(' '.join(title)))
-    heading_token = tuple(preprocess_text(' '.join(headings)))
-    meta_token = tuple(preprocess_text(' '.join(meta_texts)))
-    bold_anchor_token = tuple(preprocess_text(' '.join(bold_texts + anchor_texts)))
-    regular_token = tuple(preprocess_text(' '.join([remaining_text_str])))
+    # Preprocess all fields in one batch and convert to tuples to make them hashable
+    all_text = ' '.join(title + headings + meta_texts + bold_texts + [remaining_text_str])
+    (title_token, heading_token, meta_token, bold_anchor_token, regular_token, tokens,
+     valid_description) = (tuple(field_tokens) for field_tokens in get_analyzer().analyze_many(
+        [' '.join(title), ' '.join(headings), ' '.join(meta_texts), ' '.join(bold_texts + anchor_texts),
+         remaining_text_str, all_text, body_content]))
 
     html_tag_value_dict = {
         title_token: 3,
@@ -231,39 +391,54 @@ def build_initial_index(title, headings, meta_texts, bold_texts, anchor_texts, r
         regular_token: 0
     }
 
+    document_terms = {}
     for token_list in [title_token, heading_token, meta_token, bold_anchor_token, regular_token]:
         for token in token_list:
             html_tag_value = html_tag_value_dict.get(token, 0)
-            add_or_update_posting_list(token, initial_index, file_id, html_tag_value)
-
-    all_text = ' '.join(title + headings + meta_texts + bold_texts + [remaining_text_str])
-    tokens = preprocess_text(all_text)
+            accumulate_term(document_terms, token, html_tag_value)
+    flush_document_terms(document_terms, initial_index, file_id)
 
+    document_bigrams = {}
     for first, second in zip(tokens, tokens[1:]):
         html_tag_value = html_tag_value_dict.get(first, 0)
         token = f"{first} {second}"
-        add_or_update_posting_list(token, initial_bigram_index, file_id, html_tag_value)
+        accumulate_term(document_bigrams, token, html_tag_value)
+    flush_document_terms(document_bigrams, initial_bigram_index, file_id)
     
     title_text = ' '.join(title)
-    valid_description = preprocess_text(body_content)
     description_text = ' '.join(valid_description[:20])
+    term_frequencies = {token: frequency for token, (frequency, _) in document_terms.items()}
+    bigram_frequencies = {token: frequency for token, (frequency, _) in document_bigrams.items()}
+
+    return title_text, description_text, term_frequencies, bigram_frequencies
 
-    return title_text, description_text
 
+def accumulate_term(document_terms, token, html_tag_value):
+    """
+    Count one occurrence of token in the document being indexed.
+    """
+    term_entry = document_terms.get(token)
+    if term_entry is None:
+        document_terms[token] = [1, html_tag_value]
+    else:
+        term_entry[0] += 1
+        term_entry[1] += html_tag_value
 
-def add_or_update_posting_list(token, initial_index, file_id, html_tag_value):
-    found = False
-    if token in initial_index:
-        for posting in initial_index[token]:
-            if posting.doc_id == file_id:
-                posting.frequency += 1
-                posting.html_tag_weight += html_tag_value
-                found = True
-    if not found:
-        posting = PostingObject(doc_id=file_id, html_tag_weight=html_tag_value)
+
+def flush_document_terms(document_terms, initial_index, file_id):
+    """
+    Append one posting per accumulated term of a finished document to the index.
+    """
+    for token, (frequency, html_tag_weight) in document_terms.items():
+        posting = PostingObject(doc_id=file_id, frequency=frequency, html_tag_weight=html_tag_weight)
         initial_index.setdefault(token, []).append(posting)
 
 
+def tf_idf_weight(frequency, idf):
+    tf = (1 + math.log10(frequency)) if frequency != 0 else 0
+    return round(tf * idf, 3)
+
+
 def calculate_tf_idf(initial_index, total_docs):
     """
     Calculate TF-IDF for each term in the index and update the tf_idf_score attribute of each posting_object.
@@ -273,10 +448,7 @@ def calculate_tf_idf(initial_index, total_docs):
         df = len(postings_list)
         idf = math.log10(n / df) if df != 0 else 0
         for posting_obj in postings_list:
-            tf = posting_obj.frequency
-            tf = (1 + math.log10(tf)) if tf != 0 else 0
-            tf_idf = tf * idf
-            tf_idf_score = round(tf_idf, 3)
+            tf_idf_score = tf_idf_weight(posting_obj.frequency, idf)
             idf_score = round(idf, 3)
             posting_obj.idf = idf_score
             posting_obj.tf_idf_score = tf_idf_score
@@ -293,33 +465,44 @@ def add_normalized_vector(index, doc_id_with_length):
                     posting.normalized_vector_weight = 0
 
 
-def calculate_vector_length(doc_id_with_length, index, word_with_doc_id):
-    for d_id, word_list in word_with_doc_id.items():
+def calculate_vector_length(forward_index, kind, index, total_docs):
+    """
+    Weight the terms of every document in the forward index by tf-idf and return each document's vector length,
+    keyed by doc number.
+    """
+    idf_by_term = {term: math.log10(total_docs / len(postings_list)) for term, postings_list in index.items()}
+    idf_by_id = [idf_by_term[term] for term in forward_index.terms(kind)]
+    doc_number_with_length = {}
+    for doc_number, term_ids, frequencies in forward_index.entries(kind):
+        weights = [tf_idf_weight(frequency, idf_by_id[term_id]) for term_id, frequency in zip(term_ids, frequencies)]
+        forward_index.set_weights(doc_number, kind, weights)
         length = 0
-        if word_list:
-            for word in word_list:
-                if word in index:
-                    posting_list = index[word]
-                    for posting in posting_list:
-                        if posting.doc_id == d_id:
-                            length += posting.tf_idf_score ** 2
-        doc_id_with_length[d_id] = length ** 0.5
-
-
-def calculate_pagerank(out_links, valid_links):
-    graph = nx.DiGraph()
-    graph.add_nodes_from(out_links.keys())
-
-    # Iterate over each link and its targets in out_links
-    for link, targets in out_links.items():
-        edges = [(link, target) for target in targets]
-        graph.add_edges_from(edges)
-    initial_pagerank = nx.pagerank(graph)
+        for weight in weights:
+            length += weight ** 2
+        doc_number_with_length[doc_number] = length ** 0.5
+    return doc_number_with_length
+
+
+def calculate_pagerank(out_links, valid_links, pagerank_file=None):
+    """
+    PageRank of every document over the links between corpus pages, scaled by 10^6. With pagerank_file the
+    scores of the previous build seed the iteration, so a rebuild converges in a few iterations, and the new
+    scores are saved there.
+    """
+    return scaled_pagerank(link_graph(out_links, valid_links), pagerank_file)
+
+
+def scaled_pagerank(graph, pagerank_file=None):
+    """
+    calculate_pagerank over a (doc ids, adjacency matrix) link graph that is already resolved.
+    """
+    previous_scores = load_pagerank(pagerank_file) if pagerank_file and os.path.exists(pagerank_file) else None
+    scores = graph_pagerank(*graph, previous_scores)
+    if pagerank_file:
+        save_pagerank(scores, pagerank_file)
     pagerank = {}
-    for link, value in initial_pagerank.items():
-        if link in valid_links:
-            pagerank[valid_links[link]] = round(value * 1000000, 3)
-    
+    for doc_id, value in scores.items():
+        pagerank[doc_id] = round(value * 1000000, 3)
     return pagerank
 
 
@@ -370,19 +553,53 @@ def read_index_from_file(filename):
     return inverted_index
 
 
+def convert_text_index_to_binary(text_filename, binary_filename, bookkeeping_input):
+    """
+    Migrate an index written by write_index_to_file to the binary format read by BinaryIndex.
+    """
+    write_binary_index(read_index_from_file(text_filename), binary_filename, list(load_json_data(bookkeeping_input)))
+
+
+def convert_text_positions_to_binary(text_filename, binary_filename, bookkeeping_input):
+    """
+    Migrate a position file of "(term, doc_id): [positions]" lines to the format read by PositionIndex.
+    """
+    doc_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(load_json_data(bookkeeping_input))}
+    positions_by_doc = {}
+    for (term, doc_id), positions in read_bigram_positions(text_filename).items():
+        positions_by_doc.setdefault(doc_numbers[doc_id], {})[term] = sorted(set(positions))
+    position_writer = PositionIndexWriter()
+    for doc_number in sorted(positions_by_doc):
+        position_writer.add_document(doc_number, encode_document_positions(positions_by_doc[doc_number]))
+    position_writer.write(binary_filename)
+
+
+def convert_meta_data_to_document_store(meta_data_file, document_store_file, bookkeeping_input):
+    """
+    Migrate a metadata file to the document store read by the result pages. The metadata only keeps the
+    description of every page, so the description is the text the query snippets are taken from.
+    """
+    json_data = load_json_data(bookkeeping_input)
+    meta_data_index = read_meta_data_index_from_file(meta_data_file)
+    with DocumentStoreWriter(document_store_file, list(json_data)) as document_store_writer:
+        for doc_number, (doc_id, link) in enumerate(json_data.items()):
+            metadata = meta_data_index.get(doc_id)
+            if metadata:
+                description = metadata[1] if len(metadata) > 1 else ""
+                document_store_writer.add_document(doc_number, encode_document(metadata[0], link, description))
+
+
 def write_bigram_positions(bookkeeping_input, directory_path, bigram_position_file):
     json_data = load_json_data(bookkeeping_input)
-    with open(bigram_position_file, 'w') as file:
-        for doc_id, _ in json_data.items():
+    with spilling_position_writer(bigram_position_file) as position_writer:
+        for doc_number, doc_id in enumerate(json_data):
             file_path = directory_path + doc_id
             with open(file_path, "r", encoding="utf-8") as content_file:
                 content = content_file.read()
                 parsed_content = parse_html_content(content)
                 bigram_positions = parsed_content [9]
-                for bigram, positions in bigram_positions.items():
-                    sorted_positions = sorted(set(positions))
-                    positions = list(sorted_positions)
-                    file.write(f"({bigram}, {doc_id}): {positions}\n")
+                position_writer.add_document(doc_number, encode_document_positions(bigram_positions))
+        position_writer.write(bigram_position_file)
 
 
 def read_bigram_positions(file_path):
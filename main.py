@@ -1,33 +1,106 @@
+import os
 import time
 import tkinter as tk
-from index_constructor import build_inverted_index, write_bigram_positions
+from index_constructor import (build_inverted_index, convert_text_index_to_binary, convert_text_positions_to_binary,
+                               convert_meta_data_to_document_store)
+from external_build import build_external_index
+from binary_index import BinaryIndex
+from spelling import SpellingCorrector
+from analyzer import download_nltk_data
+from metrics import enable_instrumentation, SlowQueryLog
 from gui import SearchEngineGUI
+from segments import update_segments, start_background_merge
 
 bookkeeping_input = "webpages_raw/bookkeeping.json"
 directory_path = "webpages_raw/"
 # bookkeeping_input = "test/test.json"
 # directory_path = "test/"
-output_file = "inverted_index.txt"
-output_file_bigram = "inverted_bigram_index.txt"
+output_file = "inverted_index.bin"
+output_file_bigram = "inverted_bigram_index.bin"
 meta_data_file = "meta_data_file.txt"
-bigram_positions_file = 'bigram_position.txt'
+bigram_positions_file = 'bigram_positions.bin'
+word_positions_file = 'word_positions.bin'
+spelling_file = 'spelling_dictionary.bin'
+# Scores of the last build; the next build starts its PageRank iteration from them
+pagerank_file = 'pagerank.json'
+forward_index_file = 'forward_index.bin'
+# Titles, URLs and body text of the result pages and their snippets
+document_store_file = 'document_store.bin'
+# Best postings kept per term for early termination; smaller lists answer queries faster but three or more word
+# queries may miss results that only rank through their other postings. 0 builds no champion lists
+champion_list_size = 200
+# Index only new, changed and removed pages into segments_directory instead of rebuilding the index files
+incremental_index = False
+segments_directory = 'segments/'
+# Set to False to search for the query words exactly as typed
+spell_correction = True
+text_output_file = "inverted_index.txt"
+text_output_file_bigram = "inverted_bigram_index.txt"
+text_bigram_positions_file = 'bigram_position.txt'
+text_word_positions_file = 'word_position.txt'
+index_workers = os.cpu_count() or 1
+# Bytes of postings and positions buffered before they are flushed to sorted runs and merged, for corpora whose
+# index does not fit in memory; no forward index is built in this mode. None builds the index in memory
+index_memory_budget = None
+# Time every query stage; the metrics are written to metrics_file on exit and slow queries to slow_query_file
+query_metrics = False
+metrics_file = 'query_metrics.json'
+slow_query_file = 'slow_queries.log'
+slow_query_seconds = 0.5
 
 
 def build_index():
     print("Building inverted index...")
     start_time = time.time()
-    build_inverted_index(bookkeeping_input, directory_path, output_file, output_file_bigram, meta_data_file)
-    write_bigram_positions(bookkeeping_input, directory_path, bigram_positions_file)
+    if incremental_index:
+        update_segments(bookkeeping_input, directory_path, segments_directory, workers=index_workers,
+                        pagerank_file=pagerank_file, spelling_file=spelling_file)
+        # Segments are merged while the GUI runs
+        start_background_merge(segments_directory)
+    elif index_memory_budget:
+        build_external_index(bookkeeping_input, directory_path, output_file, output_file_bigram, meta_data_file,
+                             index_memory_budget, workers=index_workers, bigram_position_file=bigram_positions_file,
+                             word_position_file=word_positions_file, spelling_file=spelling_file,
+                             pagerank_file=pagerank_file, document_store_file=document_store_file,
+                             champion_size=champion_list_size)
+    else:
+        build_inverted_index(bookkeeping_input, directory_path, output_file, output_file_bigram, meta_data_file,
+                             workers=index_workers, bigram_position_file=bigram_positions_file,
+                             word_position_file=word_positions_file, spelling_file=spelling_file,
+                             pagerank_file=pagerank_file, forward_index_file=forward_index_file,
+                             document_store_file=document_store_file, champion_size=champion_list_size)
     end_time = time.time()
     elapsed_time_minutes = round((end_time - start_time) / 60, 4)
     print(f"Elapsed time for building the inverted index: {elapsed_time_minutes} minutes")
 
 
+def migrate_index():
+    print("Converting text index to binary format...")
+    convert_text_index_to_binary(text_output_file, output_file, bookkeeping_input)
+    convert_text_index_to_binary(text_output_file_bigram, output_file_bigram, bookkeeping_input)
+    convert_text_positions_to_binary(text_bigram_positions_file, bigram_positions_file, bookkeeping_input)
+    # The baseline never wrote word positions, and no query reads them
+    if os.path.exists(text_word_positions_file):
+        convert_text_positions_to_binary(text_word_positions_file, word_positions_file, bookkeeping_input)
+    convert_meta_data_to_document_store(meta_data_file, document_store_file, bookkeeping_input)
+    with BinaryIndex(output_file) as index:
+        SpellingCorrector.from_index(index).save(spelling_file)
+
+
 def main():
+    instrumentation = enable_instrumentation(slow_query_log=SlowQueryLog(slow_query_file, slow_query_seconds)) \
+        if query_metrics else None
     root = tk.Tk()
+    # Run once on a host with network access to fill the local nltk_data directory
+    # download_nltk_data()
     # build_index()
-    gui = SearchEngineGUI(root, bookkeeping_input, output_file, output_file_bigram, meta_data_file, bigram_positions_file)
+    # migrate_index()
+    gui = SearchEngineGUI(root, bookkeeping_input, output_file, output_file_bigram, document_store_file,
+                          bigram_positions_file, spelling_file if spell_correction else None,
+                          segments_directory if incremental_index else None)
     root.mainloop()
+    if instrumentation is not None:
+        instrumentation.registry.dump(metrics_file)
 
 
 if __name__ == "__main__":
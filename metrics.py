@@ -0,0 +1,241 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+# Upper bounds in seconds of the latency histogram buckets; a last bucket takes everything slower
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = "search_"
+
+# Shared by every stage() call while instrumentation is disabled, so a disabled hook costs one lookup
+NO_STAGE = nullcontext()
+active_trace = ContextVar("active_trace", default=None)
+instrumentation = None
+
+
+class Histogram:
+    """
+    Count of observations per bucket, plus their count and sum.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.bucket_counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.bucket_counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self):
+        return {"bounds": list(self.bounds), "bucket_counts": list(self.bucket_counts), "count": self.count,
+                "sum": self.total}
+
+
+class MetricsRegistry:
+    """
+    Named counters and histograms, each optionally split by labels. Safe to update from several threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self.lock:
+            return {"pid": os.getpid(), "time": time.time(),
+                    "counters": [{"name": name, "labels": dict(labels), "value": value}
+                                 for (name, labels), value in sorted(self.counters.items())],
+                    "histograms": [dict(histogram.snapshot(), name=name, labels=dict(labels))
+                                   for (name, labels), histogram in sorted(self.histograms.items())]}
+
+    def dump(self, filename):
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+    def prometheus_text(self):
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{METRIC_PREFIX}{name}{format_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+                for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds + ("+Inf",), histogram.bucket_counts):
+                        cumulative += count
+                        lines.append(f"{METRIC_PREFIX}{name}_bucket{format_labels(labels + (('le', bound),))} "
+                                     f"{cumulative}")
+                    lines.append(f"{METRIC_PREFIX}{name}_sum{format_labels(labels)} {histogram.total}")
+                    lines.append(f"{METRIC_PREFIX}{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class QueryTrace:
+    """
+    Time spent in every stage of one query and the sizes of the posting lists it read.
+    A stage entered several times, e.g. one posting lookup per bigram, accumulates its time.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.start_time = time.perf_counter()
+        self.seconds = None
+        self.stages = {}
+        self.posting_sizes = {}
+
+    def stage(self, name):
+        return StageTimer(self, name)
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start_time
+
+    def to_dict(self):
+        return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "query": self.query, "seconds": self.seconds,
+                "stages": self.stages, "posting_sizes": self.posting_sizes}
+
+
+class StageTimer:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stages = self.trace.stages
+        stages[self.name] = stages.get(self.name, 0) + time.perf_counter() - self.start_time
+
+
+class SlowQueryLog:
+    """
+    Appends a JSON line with the stage times and posting-list sizes of every query slower than threshold seconds.
+    """
+
+    def __init__(self, filename, threshold=0.5):
+        self.filename = filename
+        self.threshold = threshold
+        self.lock = threading.Lock()
+
+    def record(self, trace):
+        if trace.seconds < self.threshold:
+            return
+        line = json.dumps(trace.to_dict())
+        with self.lock, open(self.filename, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+class Instrumentation:
+    """
+    Receives every finished query trace and feeds the metrics registry and the slow-query log.
+    """
+
+    def __init__(self, registry=None, slow_query_log=None):
+        self.registry = registry if registry is not None else MetricsRegistry()
+        self.slow_query_log = slow_query_log
+
+    def record(self, trace):
+        self.registry.increment("queries_total")
+        self.registry.observe("query_seconds", trace.seconds)
+        for name, seconds in trace.stages.items():
+            self.registry.observe("query_stage_seconds", seconds, stage=name)
+        for size in trace.posting_sizes.values():
+            self.registry.increment("postings_read_total", size)
+        if self.slow_query_log is not None:
+            self.slow_query_log.record(trace)
+
+
+def enable_instrumentation(registry=None, slow_query_log=None):
+    global instrumentation
+    instrumentation = Instrumentation(registry, slow_query_log)
+    return instrumentation
+
+
+def disable_instrumentation():
+    global instrumentation
+    instrumentation = None
+
+
+def get_instrumentation():
+    return instrumentation
+
+
+class QueryTraceScope:
+    """
+    Traces the queries answered inside it. Nested scopes, e.g. top_k_query called from a traced GUI search,
+    add their stages to the outer trace, which is recorded once when the outer scope ends.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.trace = None
+        self.token = None
+
+    def __enter__(self):
+        if instrumentation is None or active_trace.get() is not None:
+            return active_trace.get()
+        self.trace = QueryTrace(self.query)
+        self.token = active_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.token is None:
+            return
+        active_trace.reset(self.token)
+        self.trace.finish()
+        if instrumentation is not None:
+            instrumentation.record(self.trace)
+
+
+def query_trace(query):
+    return QueryTraceScope(query)
+
+
+def stage(name):
+    """
+    Time a stage of the current query; a shared no-op context when no query is being traced.
+    """
+    trace = active_trace.get()
+    if trace is None:
+        return NO_STAGE
+    return trace.stage(name)
+
+
+def record_posting_size(term, posting_list):
+    trace = active_trace.get()
+    if trace is not None:
+        trace.posting_sizes[term] = len(posting_list)
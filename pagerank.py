@@ -0,0 +1,154 @@
+import json
+from urllib.parse import urljoin, urlsplit
+import numpy as np
+
+DAMPING = 0.85
+# Converged when the scores, which sum to 1, move by less than TOLERANCE in total. networkx.pagerank allows
+# 1e-6 per document, which leaves errors far above the 10^-9 resolution of the scaled, rounded pagerank weights
+TOLERANCE = 1.0e-10
+MAX_ITERATIONS = 200
+ABSOLUTE_PREFIXES = ("http://", "https://")
+DEFAULT_PORTS = (":80", ":443")
+
+
+def canonical_url(url):
+    """
+    Reduce an absolute URL to the form links are matched in: no scheme, user, fragment, default port, "www." or
+    trailing slash, and a lower-case host.
+    """
+    parts = urlsplit(url.strip())
+    host = parts.netloc.rpartition("@")[2].lower()
+    for default_port in DEFAULT_PORTS:
+        if host.endswith(default_port):
+            host = host[:-len(default_port)]
+    if host.startswith("www."):
+        host = host[4:]
+    return host + parts.path.rstrip("/") + ("?" + parts.query if parts.query else "")
+
+
+def resolve_link(page_url, href):
+    """
+    Canonical form of the target of href on the page at page_url (a bookkeeping.json URL, without scheme),
+    or None if it does not point to a web page.
+    """
+    href = href.strip()
+    try:
+        # Most links are absolute and need no joining
+        if not href.lower().startswith(ABSOLUTE_PREFIXES):
+            href = urljoin("http://" + page_url, href)
+            if not href.startswith(ABSOLUTE_PREFIXES):
+                return None
+        return canonical_url(href)
+    except ValueError:
+        return None
+
+
+def link_graph(out_links, valid_links):
+    """
+    Resolve the out-links of every page against the corpus URLs. Returns the doc ids and the CSR adjacency
+    matrix between their numbers; links to pages outside the corpus are dropped and repeated links count once.
+    """
+    doc_ids, doc_numbers, url_numbers = corpus_urls(valid_links)
+    sources, targets = resolve_out_links(out_links, valid_links, doc_numbers, url_numbers)
+    return doc_ids, adjacency_matrix(sources, targets, len(doc_ids))
+
+
+def corpus_urls(valid_links):
+    """
+    The doc ids of the corpus in link graph order, the number of every doc id and the number of every canonical
+    corpus URL.
+    """
+    doc_ids = list(dict.fromkeys(valid_links.values()))
+    doc_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(doc_ids)}
+    url_numbers = {canonical_url("http://" + link): doc_numbers[doc_id] for link, doc_id in valid_links.items()}
+    return doc_ids, doc_numbers, url_numbers
+
+
+def resolve_out_links(out_links, valid_links, doc_numbers, url_numbers):
+    """
+    Return the source and target numbers of the links of out_links between corpus pages.
+    """
+    sources = []
+    targets = []
+    for link, hrefs in out_links.items():
+        if link not in valid_links:
+            continue
+        source = doc_numbers[valid_links[link]]
+        linked = {url_numbers.get(resolve_link(link, href)) for href in set(hrefs)}
+        linked.discard(None)
+        sources.extend([source] * len(linked))
+        targets.extend(linked)
+    return sources, targets
+
+
+def adjacency_matrix(sources, targets, node_count):
+    """
+    CSR adjacency matrix of the links; a link resolved more than once counts once.
+    """
+    from scipy.sparse import csr_matrix
+
+    links = np.unique(np.asarray(sources, dtype=np.int64) * node_count + np.asarray(targets, dtype=np.int64))
+    return csr_matrix((np.ones(len(links)), (links // node_count, links % node_count)),
+                      shape=(node_count, node_count))
+
+
+def power_iteration(adjacency, damping=DAMPING, tolerance=TOLERANCE, max_iterations=MAX_ITERATIONS, initial=None):
+    """
+    PageRank of the nodes of a CSR adjacency matrix with uniform teleportation; dangling nodes spread their
+    score over every node. initial, e.g. the scores of the previous build, is the starting vector.
+    Returns the scores, which sum to 1, and the number of iterations.
+    """
+    from scipy.sparse import diags
+
+    node_count = adjacency.shape[0]
+    if node_count == 0:
+        return np.empty(0), 0
+    out_degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    dangling = out_degree == 0
+    inverse_degree = np.divide(1.0, out_degree, out=np.zeros(node_count), where=~dangling)
+    # transition[j, i]: share of i's score passed to j
+    transition = (diags(inverse_degree) @ adjacency).T.tocsr()
+
+    if initial is None:
+        scores = np.full(node_count, 1.0 / node_count)
+    else:
+        scores = np.asarray(initial, dtype=np.float64)
+        scores = scores / scores.sum() if scores.sum() > 0 else np.full(node_count, 1.0 / node_count)
+    for iteration in range(1, max_iterations + 1):
+        previous_scores = scores
+        scores = damping * (transition @ previous_scores + previous_scores[dangling].sum() / node_count) \
+            + (1 - damping) / node_count
+        if np.abs(scores - previous_scores).sum() < tolerance:
+            return scores, iteration
+    print(f"PageRank did not converge in {max_iterations} iterations")
+    return scores, max_iterations
+
+
+def compute_pagerank(out_links, valid_links, previous_scores=None):
+    """
+    PageRank of every corpus document, keyed by doc id. previous_scores, keyed by doc id, warm-starts the
+    iteration; documents without a previous score start from the uniform score.
+    """
+    return graph_pagerank(*link_graph(out_links, valid_links), previous_scores)
+
+
+def graph_pagerank(doc_ids, adjacency, previous_scores=None):
+    """
+    PageRank of the documents of a link graph, keyed by doc id; previous_scores as for compute_pagerank.
+    """
+    initial = None
+    if previous_scores:
+        initial = np.array([previous_scores.get(doc_id, 1.0 / len(doc_ids)) for doc_id in doc_ids])
+    scores, iterations = power_iteration(adjacency, initial=initial)
+    print(f"PageRank: {adjacency.nnz} links between {len(doc_ids)} documents, {iterations} iterations")
+    return dict(zip(doc_ids, scores.tolist()))
+
+
+def save_pagerank(scores, filename):
+    with open(filename, "w", encoding="utf-8") as file:
+        json.dump(scores, file)
+
+
+def load_pagerank(filename):
+    with open(filename, "r", encoding="utf-8") as file:
+        return json.load(file)
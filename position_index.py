@@ -0,0 +1,289 @@
+import mmap
+import os
+import struct
+import tempfile
+from functools import lru_cache
+import numpy as np
+from binary_index import TermTable, find_sorted_term, replacing_file, OFFSET_FORMAT
+from compression import encode_vbyte, encode_vbyte_int, decode_vbyte, read_vbyte_ints
+from sorted_runs import merge_runs, reduce_runs, RUN_BUFFER_SIZE
+
+# File layout (all integers little-endian), in file order:
+#   header        : magic, version, term count and the absolute offset of every section
+#   data          : per term, one entry per document in doc number order: variable-byte doc number gap,
+#                   position count and gaps between the sorted positions
+#   term offsets  : (term count + 1) u64 offsets into the term blob, terms sorted by their utf-8 bytes
+#   term blob     : utf-8 terms
+#   lexicon       : one fixed-width entry per term (data offset, data length, document count)
+MAGIC = b"SEPI"
+VERSION = 1
+HEADER_FORMAT = struct.Struct("<4sIIQQQQ")
+LEXICON_FORMAT = struct.Struct("<QII")
+# Position runs hold the entries collected before a spill in utf-8 term order: per term, term length, document
+# count, last doc number and data length, the utf-8 term, then its data as above, the first doc gap counted from 0
+POSITION_RUN_HEADER = struct.Struct("<IIII")
+# Estimated memory of a collected term (dict slot, key string, entry list)
+TERM_BYTES = 300
+
+
+def encode_document_positions(positions_map):
+    """
+    Encode the sorted positions of every term of one document. Returns the terms, the encoded bytes and
+    the end offset of every term's entry in them.
+    """
+    terms = list(positions_map)
+    if not terms:
+        return terms, b"", []
+    values = []
+    value_ends = []
+    for term in terms:
+        positions = positions_map[term]
+        values.append(len(positions))
+        previous = 0
+        for position in positions:
+            values.append(position - previous)
+            previous = position
+        value_ends.append(len(values) - 1)
+    encoded, ends = encode_vbyte(values)
+    return terms, encoded, ends[value_ends].tolist()
+
+
+class PositionIndexWriter:
+    """
+    Collects the encoded positions of the documents, which must be added in increasing doc number order.
+
+    With a memory_budget, the collected entries are spilled to a term-sorted run in run_directory whenever their
+    estimated size reaches it, and write merges the runs into the position file.
+    """
+
+    def __init__(self, memory_budget=None, run_directory=None):
+        # term -> [last doc number, document count, encoded entries]
+        self.entries = {}
+        self.size = 0
+        self.memory_budget = memory_budget
+        self.run_directory = run_directory
+        self.runs = []
+
+    def add_document(self, doc_number, encoded_positions):
+        terms, encoded, ends = encoded_positions
+        start = 0
+        for term, end in zip(terms, ends):
+            self.add_entry(term, doc_number, encoded[start:end])
+            start = end
+        if self.memory_budget is not None and self.size >= self.memory_budget:
+            self.spill()
+
+    def add_entry(self, term, doc_number, encoded):
+        """
+        Append the encoded position count and gaps of term in one document.
+        """
+        entry = self.entries.get(term)
+        if entry is None:
+            entry = self.entries[term] = [0, 0, bytearray()]
+            self.size += TERM_BYTES
+        gap = encode_vbyte_int(doc_number - entry[0])
+        entry[2] += gap
+        entry[2] += encoded
+        entry[0] = doc_number
+        entry[1] += 1
+        self.size += len(gap) + len(encoded)
+
+    def sorted_terms(self):
+        return sorted(self.entries, key=lambda term: term.encode("utf-8"))
+
+    def write_run(self, filename):
+        """
+        Write the collected entries to a position run and start collecting afresh.
+        """
+        with open(filename, "wb") as file:
+            for term in self.sorted_terms():
+                last_doc_number, doc_count, data = self.entries[term]
+                write_position_entry(file, (term.encode("utf-8"), doc_count, last_doc_number, data))
+        self.entries = {}
+        self.size = 0
+
+    def spill(self):
+        descriptor, filename = tempfile.mkstemp(prefix="positions-", suffix=".run", dir=self.run_directory)
+        os.close(descriptor)
+        self.runs.append(filename)
+        self.write_run(filename)
+
+    def write(self, filename):
+        if not self.runs:
+            write_position_file(filename, ((term, self.entries[term][1], self.entries[term][2])
+                                           for term in self.sorted_terms()))
+            return
+        if self.entries:
+            self.spill()
+        try:
+            write_merged_positions(filename, self.runs, self.run_directory)
+        finally:
+            self.remove_runs()
+
+    def remove_runs(self):
+        for filename in self.runs:
+            os.remove(filename)
+        self.runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.remove_runs()
+
+
+def write_position_entry(file, entry):
+    """
+    Write one (term bytes, document count, last doc number, data) entry to a position run.
+    """
+    term, doc_count, last_doc_number, data = entry
+    file.write(POSITION_RUN_HEADER.pack(len(term), doc_count, last_doc_number, len(data)))
+    file.write(term)
+    file.write(data)
+
+
+def read_position_run(filename):
+    """
+    Yield (term bytes, document count, last doc number, data) from a position run.
+    """
+    with open(filename, "rb", buffering=RUN_BUFFER_SIZE) as file:
+        while True:
+            header = file.read(POSITION_RUN_HEADER.size)
+            if not header:
+                break
+            term_length, doc_count, last_doc_number, data_length = POSITION_RUN_HEADER.unpack(header)
+            term = file.read(term_length)
+            yield term, doc_count, last_doc_number, file.read(data_length)
+
+
+def merge_position_runs(filenames):
+    """
+    Yield the merged entries of the position runs, in run format. The first doc gap of every run but the first
+    is counted from 0 and is re-encoded from the last doc number of the preceding run.
+    """
+    for term, entries in merge_runs([read_position_run(filename) for filename in filenames]):
+        data = bytearray(entries[0][3])
+        for (_, _, previous_doc_number, _), (_, _, _, run_data) in zip(entries, entries[1:]):
+            (doc_number,), gap_end = read_vbyte_ints(run_data, 0, 1)
+            data += encode_vbyte_int(doc_number - previous_doc_number)
+            data += run_data[gap_end:]
+        yield term, sum(entry[1] for entry in entries), entries[-1][2], data
+
+
+def write_merged_positions(filename, runs, run_directory):
+    """
+    Merge the position runs into a position file, first reducing them to at most MERGE_FAN_IN runs in
+    run_directory.
+    """
+    reduce_runs(runs, merge_position_runs, write_position_entry, run_directory)
+    write_position_file(filename, ((term.decode("utf-8"), doc_count, data)
+                                   for term, doc_count, _, data in merge_position_runs(runs)))
+
+
+def write_position_file(filename, term_entries):
+    """
+    Write a position file from (term, document count, data) triples in utf-8 term order. The data is
+    streamed and the terms follow it, so the entries can come from a merge.
+    """
+    terms = TermTable()
+    with replacing_file(filename) as file:
+        data_pos = HEADER_FORMAT.size
+        file.seek(data_pos)
+        for term, doc_count, data in term_entries:
+            terms.add(term.encode("utf-8"), LEXICON_FORMAT.pack(file.tell(), len(data), doc_count))
+            file.write(data)
+        term_offsets_pos, term_blob_pos, lexicon_pos = terms.write_to(file)
+        file.seek(0)
+        file.write(HEADER_FORMAT.pack(MAGIC, VERSION, terms.term_count, term_offsets_pos, term_blob_pos, lexicon_pos,
+                                      data_pos))
+
+
+class PositionIndex:
+    """
+    Read-only view of a position file written by PositionIndexWriter, looked up by term and doc number.
+
+    The file is memory-mapped; the entries of a term are decoded on first use and kept in an LRU cache.
+    """
+
+    def __init__(self, filename, cache_size=4096):
+        self.filename = filename
+        self.cache_size = cache_size
+        self.file = open(filename, "rb")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.term_count, self.term_offsets_pos, self.term_blob_pos, self.lexicon_pos,
+         self.data_pos) = HEADER_FORMAT.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{filename} is not a position index (version {VERSION})")
+        self.term_directory = lru_cache(maxsize=cache_size)(self.read_term_directory)
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+    def reopen(self):
+        """
+        Map the file now at filename, after a rebuild replaced it.
+        """
+        self.close()
+        self.__init__(self.filename, self.cache_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.term_count
+
+    def __contains__(self, term):
+        return self.find_term(term) >= 0
+
+    def term_bytes(self, term_number):
+        start, = OFFSET_FORMAT.unpack_from(self.buffer, self.term_offsets_pos + OFFSET_FORMAT.size * term_number)
+        end, = OFFSET_FORMAT.unpack_from(self.buffer, self.term_offsets_pos + OFFSET_FORMAT.size * (term_number + 1))
+        return self.buffer[self.term_blob_pos + start:self.term_blob_pos + end]
+
+    def term_at(self, term_number):
+        return self.term_bytes(term_number).decode("utf-8")
+
+    def find_term(self, term):
+        return find_sorted_term(self.term_bytes, self.term_count, term)
+
+    def read_term_directory(self, term):
+        """
+        Decode the entries of a term into (doc numbers, index of every entry's position count, decoded values),
+        or None if the term has no positions.
+        """
+        term_number = self.find_term(term)
+        if term_number < 0:
+            return None
+        data_offset, data_length, doc_count = LEXICON_FORMAT.unpack_from(
+            self.buffer, self.lexicon_pos + LEXICON_FORMAT.size * term_number)
+        values = decode_vbyte(self.buffer, data_offset, data_length)
+        value_list = values.tolist()
+        doc_numbers = np.empty(doc_count, dtype=np.int64)
+        count_indexes = np.empty(doc_count, dtype=np.int64)
+        doc_number = 0
+        i = 0
+        for entry in range(doc_count):
+            doc_number += value_list[i]
+            doc_numbers[entry] = doc_number
+            count_indexes[entry] = i + 1
+            i += value_list[i + 1] + 2
+        return doc_numbers, count_indexes, values
+
+    def positions(self, term, doc_number):
+        """
+        Return the sorted positions of term in the document, or None if it does not occur there.
+        """
+        directory = self.term_directory(term)
+        if directory is None:
+            return None
+        doc_numbers, count_indexes, values = directory
+        entry = np.searchsorted(doc_numbers, doc_number)
+        if entry == len(doc_numbers) or doc_numbers[entry] != doc_number:
+            return None
+        count_index = count_indexes[entry]
+        return np.cumsum(values[count_index + 1:count_index + 1 + values[count_index]]).tolist()
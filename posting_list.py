@@ -0,0 +1,68 @@
+import numpy as np
+from PostingObject import PostingObject
+
+POSTING_COLUMNS = ("frequency", "tf_idf_score", "html_tag_weight", "pagerank_weight", "normalized_vector_weight")
+
+
+class PostingList:
+    """
+    A posting list stored as parallel typed arrays instead of one PostingObject per posting.
+
+    doc_ids holds integer doc numbers; doc_key maps a doc number back to its bookkeeping id ("12/345").
+    final_weight is scratch space for the query-time score and is never stored in the index.
+    """
+
+    def __init__(self, doc_ids, frequency, tf_idf_score, html_tag_weight, pagerank_weight, normalized_vector_weight,
+                 doc_key, idf=0, final_weight=None):
+        self.doc_ids = doc_ids
+        self.frequency = frequency
+        self.tf_idf_score = tf_idf_score
+        self.html_tag_weight = html_tag_weight
+        self.pagerank_weight = pagerank_weight
+        self.normalized_vector_weight = normalized_vector_weight
+        self.doc_key = doc_key
+        self.idf = idf
+        self.final_weight = np.zeros(len(doc_ids)) if final_weight is None else final_weight
+
+    @classmethod
+    def concatenate(cls, posting_lists):
+        """
+        Join posting lists that share the same doc numbering, keeping their order.
+        """
+        return cls(np.concatenate([posting_list.doc_ids for posting_list in posting_lists]),
+                   *(np.concatenate([getattr(posting_list, column) for posting_list in posting_lists])
+                     for column in POSTING_COLUMNS),
+                   doc_key=posting_lists[0].doc_key, idf=posting_lists[0].idf,
+                   final_weight=np.concatenate([posting_list.final_weight for posting_list in posting_lists]))
+
+    def take(self, positions):
+        """
+        Return a new posting list holding the postings at the given positions, in that order.
+        """
+        return PostingList(self.doc_ids[positions], *(getattr(self, column)[positions] for column in POSTING_COLUMNS),
+                           doc_key=self.doc_key, idf=self.idf, final_weight=self.final_weight[positions])
+
+    def doc_keys(self):
+        return [self.doc_key(doc_number) for doc_number in self.doc_ids.tolist()]
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __getitem__(self, position):
+        return PostingObject(
+            doc_id=self.doc_key(int(self.doc_ids[position])),
+            frequency=int(self.frequency[position]),
+            idf=self.idf,
+            tf_idf_score=float(self.tf_idf_score[position]),
+            html_tag_weight=float(self.html_tag_weight[position]),
+            pagerank_weight=float(self.pagerank_weight[position]),
+            normalized_vector_weight=float(self.normalized_vector_weight[position]),
+            final_weight=float(self.final_weight[position])
+        )
+
+    def __iter__(self):
+        """
+        Compatibility accessor yielding a PostingObject per posting.
+        """
+        for position in range(len(self)):
+            yield self[position]
@@ -0,0 +1,92 @@
+import numpy as np
+
+NEAR_BONUS = 1
+FAR_BONUS = 0.1
+
+
+def count_near_pairs(positions1, positions2, proximity_range):
+    """
+    Count the pairs (pos1, pos2) with abs(pos1 - pos2) <= proximity_range.
+    Both position lists must be sorted; the window over positions2 only moves forward, so this is linear.
+    """
+    near_pairs = 0
+    low = high = 0
+    for pos1 in positions1:
+        while low < len(positions2) and positions2[low] < pos1 - proximity_range:
+            low += 1
+        while high < len(positions2) and positions2[high] <= pos1 + proximity_range:
+            high += 1
+        near_pairs += max(0, high - low)
+    return near_pairs
+
+
+def pair_bonus(positions1, positions2, proximity_range):
+    """
+    Bonus for one document: NEAR_BONUS per position pair within proximity_range, FAR_BONUS per other pair.
+    """
+    near_pairs = count_near_pairs(positions1, positions2, proximity_range)
+    far_pairs = len(positions1) * len(positions2) - near_pairs
+    return near_pairs * NEAR_BONUS + far_pairs * FAR_BONUS
+
+
+def intersect_sorted(positions1, positions2, shift=0):
+    """
+    Return the positions p of positions1 for which p + shift is in positions2, merging both sorted lists.
+    """
+    matches = []
+    i = j = 0
+    while i < len(positions1) and j < len(positions2):
+        target = positions1[i] + shift
+        if positions2[j] == target:
+            matches.append(positions1[i])
+            i += 1
+            j += 1
+        elif positions2[j] < target:
+            j += 1
+        else:
+            i += 1
+    return matches
+
+
+def phrase_positions(position_lists):
+    """
+    Given the sorted positions of consecutive phrase bigrams in one document, return the positions
+    where the whole phrase starts (bigram i found at start + i for every i).
+    """
+    if not position_lists:
+        return []
+    starts = list(position_lists[0])
+    for shift, positions in enumerate(position_lists[1:], start=1):
+        if not starts:
+            break
+        starts = intersect_sorted(starts, positions, shift)
+    return starts
+
+
+def phrase_documents(bigrams, bigram_index, bigram_positions, intersect=True):
+    """
+    Return the sorted doc numbers of the documents that are in every bigram list and contain the consecutive
+    bigrams as one phrase. The positions are checked in the intersection of the bigram lists or, without
+    intersect, in every document of the rarest bigram; the other lists are then read only in the blocks
+    holding a match. The bigram lists and the position file do not always agree, so a document with the
+    phrase in its positions but missing from a bigram list matches with neither strategy.
+    """
+    if not bigrams:
+        return np.empty(0, dtype=np.int64)
+    if intersect or len(bigrams) == 1:
+        candidates = bigram_index.intersect_doc_numbers(bigrams)
+    else:
+        candidates = bigram_index.intersect_doc_numbers([min(bigrams, key=bigram_index.document_frequency)])
+    if len(bigrams) == 1:
+        return candidates
+
+    matches = []
+    for doc_number in candidates.tolist():
+        position_lists = [bigram_positions.positions(bigram, doc_number) for bigram in bigrams]
+        if all(positions is not None for positions in position_lists) and phrase_positions(position_lists):
+            matches.append(doc_number)
+    matches = np.array(matches, dtype=np.int64)
+    if not intersect and len(matches):
+        matches = bigram_index.intersect_doc_numbers(bigrams, matches)
+    return matches
+
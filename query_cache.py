@@ -0,0 +1,182 @@
+import os
+import sys
+from collections import OrderedDict
+
+
+def estimate_size(value):
+    """
+    Rough number of bytes held by a cached value: array buffers for posting lists,
+    string sizes for result lists.
+    """
+    if hasattr(value, "doc_ids"):
+        return sum(getattr(value, column).nbytes for column in ("doc_ids", "frequency", "tf_idf_score",
+                                                                "html_tag_weight", "pagerank_weight",
+                                                                "normalized_vector_weight", "final_weight"))
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Mapping bounded by entry count and, optionally, by estimated bytes; the least recently used
+    entries are evicted first.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+        size = estimate_size(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self.entries[key] = (value, size)
+        self.total_bytes += size
+        while len(self.entries) > self.max_entries or \
+                (self.max_bytes is not None and self.total_bytes > self.max_bytes):
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, self)
+        if value is self:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.total_bytes, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+
+def index_generation(filenames):
+    """
+    Identify the current build of the index files by their modification time and size.
+    """
+    generation = []
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+            generation.append((filename, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            generation.append((filename, None, None))
+    return tuple(generation)
+
+
+class QueryCache:
+    """
+    Two-level cache for the query path: ranked results keyed by the processed query, and
+    posting lists keyed by index and term. When the index files change, both levels are dropped and the
+    indexes given to wrap or watch are reopened, so queries read the new files.
+    """
+
+    def __init__(self, index_files, max_entries=1000, max_bytes=None, max_posting_entries=10000,
+                 max_posting_bytes=256 * 1024 * 1024):
+        self.index_files = index_files
+        self.generation = index_generation(index_files)
+        self.results = LRUCache(max_entries, max_bytes)
+        self.postings = LRUCache(max_posting_entries, max_posting_bytes)
+        self.watched = []
+
+    def check_generation(self):
+        """
+        Clear both levels and reopen the watched indexes if the index files were rebuilt since the last check;
+        return True if so.
+        """
+        generation = index_generation(self.index_files)
+        if generation == self.generation:
+            return False
+        self.generation = generation
+        self.results.clear()
+        self.postings.clear()
+        for index in self.watched:
+            index.reopen()
+        return True
+
+    def get_or_compute(self, key, compute):
+        self.check_generation()
+        return self.results.get_or_compute(key, compute)
+
+    def wrap(self, index, name):
+        return CachedIndex(self.watch(index), name, self.postings)
+
+    def watch(self, index):
+        """
+        Reopen index, in the order it was given, when the index files change. Returns it.
+        """
+        self.watched.append(index)
+        return index
+
+    def stats(self):
+        return {"results": self.results.stats(), "postings": self.postings.stats()}
+
+
+def query_key(kind, processed_query, *options):
+    """
+    Cache key of a processed query. Positions are taken relative to the first term,
+    since ranking only depends on the gaps between terms.
+    """
+    first_position = processed_query[0][1] if processed_query else 0
+    return (kind, tuple((term, position - first_position) for term, position in processed_query)) + options
+
+
+class CachedIndex:
+    """
+    Index wrapper that keeps recently used posting lists in a shared LRUCache.
+    Every other attribute is delegated to the wrapped index.
+    """
+
+    def __init__(self, index, name, cache):
+        self.index = index
+        self.name = name
+        self.cache = cache
+
+    def __contains__(self, term):
+        return (self.name, term) in self.cache or term in self.index
+
+    def __getitem__(self, term):
+        return self.cache.get_or_compute((self.name, term), lambda: self.index[term])
+
+    def champions(self, term):
+        return self.cache.get_or_compute((self.name, "champions", term), lambda: self.index.champions(term))
+
+    def get(self, term, default=None):
+        if term not in self:
+            return default
+        return self[term]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
@@ -0,0 +1,489 @@
+import argparse
+import re
+import sys
+from collections import namedtuple
+import numpy as np
+from advanced_query import preprocess_query, lookup_postings, estimate_total_hits
+from binary_index import SKIP_INTERVAL
+from posting_list import PostingList
+from proximity import phrase_documents
+from metrics import stage
+
+# Query language:
+#   query   : or
+#   or      : and ("OR" and)*
+#   and     : not (["AND"] not)*, adjacent operands are joined by AND
+#   not     : "NOT" not | primary
+#   primary : "(" or ")" | '"' words '"' | word
+# The operators are only recognized in upper case; a word is analyzed like indexed text, so a stopword drops out
+# of the query and a word the analyzer splits into several terms becomes a phrase.
+OPERATORS = ("AND", "OR", "NOT")
+# Cost of looking up the positions of one bigram in one document, in decoded postings; about 45 on the benchmark
+# corpus. Both phrase strategies decode the position lists of the bigrams they check, so that is left out
+POSITION_CHECK_COST = 40
+TOKEN = re.compile(r'"[^"]*"?|[()]|[^\s()"]+')
+
+Term = namedtuple("Term", ["term"])
+Phrase = namedtuple("Phrase", ["terms"])
+And = namedtuple("And", ["operands"])
+Or = namedtuple("Or", ["operands"])
+Not = namedtuple("Not", ["operand"])
+
+
+def is_boolean_query(query):
+    """
+    Return True if the query uses the query language rather than being a plain list of words. This must see
+    the query as typed: lowercased, its operators are plain words.
+    """
+    return any(token in OPERATORS or token[0] in '"(' for token in TOKEN.findall(query))
+
+
+def parse_query(query, corrector=None):
+    """
+    Parse a query into a tree of Term, Phrase, And, Or and Not nodes, None if no term is left.
+    Unbalanced parentheses and quotes are closed at the end of the query.
+    """
+    tokens = []
+    depth = 0
+    for token in TOKEN.findall(query):
+        if token == ")":
+            if not depth:
+                continue
+            depth -= 1
+        elif token == "(":
+            depth += 1
+        tokens.append(token)
+    node, _ = parse_or(tokens, 0, corrector)
+    return node
+
+
+def parse_or(tokens, position, corrector):
+    operands = []
+    while position < len(tokens) and tokens[position] != ")":
+        if tokens[position] == "OR":
+            position += 1
+            continue
+        node, position = parse_and(tokens, position, corrector)
+        operands.append(node)
+    return combine(Or, operands), position
+
+
+def parse_and(tokens, position, corrector):
+    operands = []
+    while position < len(tokens) and tokens[position] not in ("OR", ")"):
+        if tokens[position] == "AND":
+            position += 1
+            continue
+        node, position = parse_not(tokens, position, corrector)
+        operands.append(node)
+    return combine(And, operands), position
+
+
+def parse_not(tokens, position, corrector):
+    if tokens[position] == "NOT":
+        if position + 1 == len(tokens) or tokens[position + 1] in ("AND", "OR", ")"):
+            return None, position + 1
+        node, position = parse_not(tokens, position + 1, corrector)
+        return (Not(node) if node is not None else None), position
+    if tokens[position] == "(":
+        node, position = parse_or(tokens, position + 1, corrector)
+        return node, position + 1
+    return parse_words(tokens[position].strip('"'), corrector), position + 1
+
+
+def parse_words(text, corrector):
+    terms = tuple(term for term, _ in preprocess_query(text, corrector))
+    if not terms:
+        return None
+    return Term(terms[0]) if len(terms) == 1 else Phrase(terms)
+
+
+def combine(node_type, operands):
+    operands = [operand for operand in operands if operand is not None]
+    if len(operands) < 2:
+        return operands[0] if operands else None
+    return node_type(tuple(operands))
+
+
+def phrase_bigrams(terms):
+    return [first + " " + second for first, second in zip(terms, terms[1:])]
+
+
+class Plan:
+    """
+    One step of a query plan: what it evaluates, the estimated number of matching documents and, once it has
+    run, the actual number. Steps that were never run because an earlier operand came out empty keep
+    actual None.
+    """
+
+    def __init__(self, description, estimate, children=()):
+        self.description = description
+        self.estimate = estimate
+        self.children = list(children)
+        self.actual = None
+
+    def execute(self):
+        """
+        Return the sorted doc numbers of the matching documents.
+        """
+        doc_numbers = self.evaluate()
+        self.actual = len(doc_numbers)
+        return doc_numbers
+
+    def evaluate(self):
+        return np.empty(0, dtype=np.int64)
+
+    def explain(self, depth=0):
+        actual = "not run" if self.actual is None else self.actual
+        lines = [f"{'  ' * depth}{self.description}  (estimated {round(self.estimate)}, actual {actual})"]
+        for child in self.children:
+            lines.extend(child.explain(depth + 1))
+        return lines
+
+
+class EmptyPlan(Plan):
+    def __init__(self, reason):
+        super().__init__(f"EMPTY {reason}", 0)
+
+
+class IntersectPlan(Plan):
+    """
+    Terms of one index intersected by the index itself, shortest posting list first with its skip tables.
+    notes say why the plan was chosen.
+    """
+
+    def __init__(self, index, terms, kind, notes=()):
+        document_frequencies = [index.document_frequency(term) for term in terms]
+        estimate = intersection_estimate(document_frequencies, index.doc_count)
+        listed = ", ".join(f"{term!r} df {df}" for term, df in sorted(zip(terms, document_frequencies),
+                                                                        key=lambda item: item[1]))
+        super().__init__("; ".join([f"{kind.upper()} {listed}"] + list(notes)), estimate)
+        self.index = index
+        self.terms = terms
+        self.kind = kind
+        self.notes = list(notes)
+
+    def evaluate(self):
+        return self.index.intersect_doc_numbers(self.terms)
+
+
+class PhrasePlan(Plan):
+    """
+    A phrase of three or more words, checked against the bigram positions in the documents of either the
+    intersection of its bigram lists or, when that costs more, the rarest bigram list alone.
+    """
+
+    def __init__(self, bigram_index, bigram_positions, terms, intersect, reason):
+        bigrams = phrase_bigrams(terms)
+        estimate = min(bigram_index.document_frequency(bigram) for bigram in bigrams)
+        strategy = f"intersecting its {len(bigrams)} bigram lists" if intersect else \
+            f"scanning the rarest of its {len(bigrams)} bigram lists"
+        super().__init__(f"PHRASE {' '.join(terms)!r} by positions, {strategy}; {reason}", estimate)
+        self.bigram_index = bigram_index
+        self.bigram_positions = bigram_positions
+        self.bigrams = bigrams
+        self.intersect = intersect
+
+    def evaluate(self):
+        return phrase_documents(self.bigrams, self.bigram_index, self.bigram_positions, self.intersect)
+
+
+class AndPlan(Plan):
+    """
+    Intersection of the positive operands, most selective first and stopping as soon as it is empty, minus
+    the union of the negated operands.
+    """
+
+    def __init__(self, operands, negated, doc_count):
+        estimate = doc_count * np.prod([operand.estimate / doc_count for operand in operands]) * \
+            np.prod([1 - operand.estimate / doc_count for operand in negated])
+        self.operands = operands
+        self.negated = [NotPlan(operand) for operand in negated]
+        super().__init__("AND", estimate, self.operands + self.negated)
+
+    def evaluate(self):
+        doc_numbers = self.operands[0].execute()
+        for operand in self.operands[1:]:
+            if not len(doc_numbers):
+                return doc_numbers
+            doc_numbers = np.intersect1d(doc_numbers, operand.execute(), assume_unique=True)
+        for operand in self.negated:
+            if not len(doc_numbers):
+                return doc_numbers
+            doc_numbers = np.setdiff1d(doc_numbers, operand.execute(), assume_unique=True)
+        return doc_numbers
+
+
+class OrPlan(Plan):
+    def __init__(self, operands, doc_count):
+        super().__init__("OR", estimate_total_hits([operand.estimate for operand in operands], doc_count), operands)
+
+    def evaluate(self):
+        doc_numbers = np.empty(0, dtype=np.int64)
+        for operand in self.children:
+            doc_numbers = np.union1d(doc_numbers, operand.execute())
+        return doc_numbers
+
+
+class NotPlan(Plan):
+    """
+    The documents an AndPlan removes from its result.
+    """
+
+    def __init__(self, operand):
+        super().__init__("NOT", operand.estimate, [operand])
+
+    def evaluate(self):
+        return self.children[0].execute()
+
+
+def plan_query(node, index, bigram_index, bigram_positions):
+    """
+    Turn a parsed query into a Plan, using the document frequencies of the indexes to order intersections
+    and to drop operands that can match nothing before any posting list is read.
+    """
+    if isinstance(node, Term):
+        if not index.document_frequency(node.term):
+            return EmptyPlan(f"{node.term!r} is not in the index")
+        return IntersectPlan(index, [node.term], "terms")
+    if isinstance(node, Phrase):
+        missing = [bigram for bigram in phrase_bigrams(node.terms) if not bigram_index.document_frequency(bigram)]
+        if missing:
+            return EmptyPlan(f"{missing[0]!r} is not in the bigram index")
+        return plan_phrase(node.terms, bigram_index, bigram_positions)
+    if isinstance(node, Not):
+        return EmptyPlan("NOT needs a positive operand")
+    if isinstance(node, Or):
+        operands = [plan_query(operand, index, bigram_index, bigram_positions) for operand in node.operands
+                    if not isinstance(operand, Not)]
+        operands = [operand for operand in operands if not isinstance(operand, EmptyPlan)]
+        if not operands:
+            return EmptyPlan("no OR operand can match")
+        return operands[0] if len(operands) == 1 else OrPlan(operands, index.doc_count)
+    return plan_and(node, index, bigram_index, bigram_positions)
+
+
+def plan_phrase(terms, bigram_index, bigram_positions):
+    """
+    Choose the cheaper way to evaluate a phrase whose bigrams are all indexed, in decoded postings plus
+    POSITION_CHECK_COST per position lookup:
+      bigram list  : a two-word phrase is its bigram list; checking positions would only add lookups
+      intersection : the rarest list, the blocks of the other lists its documents fall in, skip tables limiting
+                     those to SKIP_INTERVAL postings per document, and the positions of every bigram in the
+                     estimated documents of all lists
+      scan         : the rarest list, the positions of every bigram in each of its documents, and the blocks of
+                     every list the estimated matches fall in; cheaper when the other lists are long and barely
+                     narrow it down
+Both find the same documents, those in every bigram list with the phrase in their positions.
+    """
+    bigrams = phrase_bigrams(terms)
+    document_frequencies = sorted(bigram_index.document_frequency(bigram) for bigram in bigrams)
+    rarest = document_frequencies[0]
+    if len(bigrams) == 1:
+        return IntersectPlan(bigram_index, bigrams, "bigrams",
+                             [f"the bigram list is the phrase: cost {rarest}, "
+                              f"{rarest + rarest * POSITION_CHECK_COST} checking positions"])
+    candidates = intersection_estimate(document_frequencies, bigram_index.doc_count)
+    intersect_cost = rarest + sum(min(df, SKIP_INTERVAL * rarest) for df in document_frequencies[1:]) + \
+        candidates * len(bigrams) * POSITION_CHECK_COST
+    scan_cost = rarest + rarest * len(bigrams) * POSITION_CHECK_COST + \
+        sum(min(df, SKIP_INTERVAL * candidates) for df in document_frequencies)
+    if intersect_cost <= scan_cost:
+        reason = f"cost {round(intersect_cost)}, {round(scan_cost)} scanning the rarest list"
+    else:
+        reason = f"cost {round(scan_cost)}, {round(intersect_cost)} intersecting the lists"
+    return PhrasePlan(bigram_index, bigram_positions, terms, intersect_cost <= scan_cost, reason)
+
+
+def intersection_estimate(document_frequencies, doc_count):
+    """
+    Number of documents holding every term of these document frequencies, assuming terms occur independently.
+    """
+    return doc_count * np.prod([df / doc_count for df in document_frequencies])
+
+
+def plan_and(node, index, bigram_index, bigram_positions):
+    operands = [plan_query(operand, index, bigram_index, bigram_positions) for operand in node.operands
+                if not isinstance(operand, Not)]
+    for operand in operands:
+        if isinstance(operand, EmptyPlan):
+            return operand
+    if not operands:
+        return EmptyPlan("NOT needs a positive operand")
+    # The terms of each index, the bigrams of two-word phrases included, are intersected by the index in one step
+    merged = {}
+    for operand in operands:
+        if isinstance(operand, IntersectPlan):
+            terms_index, terms, notes = merged.setdefault(operand.kind, (operand.index, [], []))
+            terms.extend(operand.terms)
+            notes.extend(operand.notes)
+    operands = [operand for operand in operands if not isinstance(operand, IntersectPlan)]
+    operands += [IntersectPlan(terms_index, terms, kind, notes) for kind, (terms_index, terms, notes)
+                 in merged.items()]
+    operands.sort(key=lambda operand: operand.estimate)
+
+    negated = [plan_query(operand.operand, index, bigram_index, bigram_positions) for operand in node.operands
+               if isinstance(operand, Not)]
+    negated = [operand for operand in negated if not isinstance(operand, EmptyPlan)]
+    if len(operands) == 1 and not negated:
+        return operands[0]
+    # The largest negation first: it empties the result soonest
+    negated.sort(key=lambda operand: -operand.estimate)
+    return AndPlan(operands, negated, index.doc_count)
+
+
+def positive_terms(node):
+    """
+    Yield (kind, term) of the unigrams and bigrams a matching document can hold, the negated ones excluded.
+    """
+    if isinstance(node, Term):
+        yield "unigram", node.term
+    elif isinstance(node, Phrase):
+        for bigram in phrase_bigrams(node.terms):
+            yield "bigram", bigram
+    elif isinstance(node, (And, Or)):
+        for operand in node.operands:
+            yield from positive_terms(operand)
+
+
+def rank_documents(doc_numbers, node, index, bigram_index):
+    """
+    Order the matching documents by the sum of 0.5 * tf_idf + html_tag_weight + pagerank_weight over the
+    query terms they hold, ties in doc number order.
+    """
+    if not len(doc_numbers):
+        return []
+    indexes = {"unigram": index, "bigram": bigram_index}
+    matched = []
+    for kind, term in dict.fromkeys(positive_terms(node)):
+        # A term of an OR operand that matched nothing may be missing
+        if term not in indexes[kind]:
+            continue
+        posting_list = lookup_postings(term, indexes[kind])
+        matched.append(posting_list.take(np.flatnonzero(np.isin(posting_list.doc_ids, doc_numbers))))
+    with stage("sorting"):
+        postings = PostingList.concatenate(matched)
+        scores = (0.5 * postings.tf_idf_score) + postings.html_tag_weight + postings.pagerank_weight
+        _, first_positions, inverse = np.unique(postings.doc_ids, return_index=True, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores)
+        order = np.argsort(-totals, kind="stable")
+    ranked_list = postings.take(first_positions[order])
+    ranked_list.final_weight = totals[order]
+    return ranked_list
+
+
+def boolean_query(query, index, bigram_index, bigram_positions, corrector=None):
+    """
+    Answer a query of the query language: the ranked doc ids of every matching document and the executed plan,
+    None for a query without terms.
+    """
+    node = parse_query(query, corrector)
+    if node is None:
+        return [], None
+    with stage("boolean_plan"):
+        plan = plan_query(node, index, bigram_index, bigram_positions)
+    with stage("boolean_execute"):
+        doc_numbers = plan.execute()
+    ranked_list = rank_documents(doc_numbers, node, index, bigram_index)
+    return (ranked_list.doc_keys() if len(ranked_list) else []), plan
+
+
+def word_query(terms, index, bigram_index, bigram_positions, node_types=(And, Or)):
+    """
+    Rank the documents holding every one of the terms or, when no document does, any of them: the answer to a
+    plain query whose bigrams are all missing from the bigram index. node_types limits the attempts, so a shard
+    can be asked for one of them at a time.
+    """
+    terms = [Term(term) for term in dict.fromkeys(terms)]
+    for node_type in node_types:
+        node = combine(node_type, terms)
+        if node is None:
+            break
+        with stage("boolean_plan"):
+            plan = plan_query(node, index, bigram_index, bigram_positions)
+        with stage("boolean_execute"):
+            doc_numbers = plan.execute()
+        if len(doc_numbers):
+            return rank_documents(doc_numbers, node, index, bigram_index)
+    return []
+
+
+def phrases(node):
+    """
+    Yield the Phrase nodes of three or more words in a parsed query, the negated ones included.
+    """
+    if isinstance(node, Phrase):
+        if len(node.terms) > 2:
+            yield node
+    elif isinstance(node, Not):
+        yield from phrases(node.operand)
+    elif isinstance(node, (And, Or)):
+        for operand in node.operands:
+            yield from phrases(operand)
+
+
+def compare_phrase_strategies(query, bigram_index, bigram_positions, corrector=None):
+    """
+    Evaluate every long phrase of the query both by intersecting its bigram lists and by scanning the rarest
+    one, returning (phrase, intersection matches, scan matches) for each phrase the two disagree on.
+    """
+    node = parse_query(query, corrector)
+    disagreements = []
+    for phrase in phrases(node):
+        bigrams = phrase_bigrams(phrase.terms)
+        if not all(bigram_index.document_frequency(bigram) for bigram in bigrams):
+            continue
+        intersected = phrase_documents(bigrams, bigram_index, bigram_positions, intersect=True)
+        scanned = phrase_documents(bigrams, bigram_index, bigram_positions, intersect=False)
+        if not np.array_equal(intersected, scanned):
+            disagreements.append((" ".join(phrase.terms), len(intersected), len(scanned)))
+    return disagreements
+
+
+def explain(query, index, bigram_index, bigram_positions, corrector=None):
+    """
+    Run the query and describe its plan: one line per step with the estimated and actual number of documents.
+    """
+    result_list, plan = boolean_query(query, index, bigram_index, bigram_positions, corrector)
+    if plan is None:
+        return f"{query!r}: no terms"
+    return "\n".join([f"{query!r}: {len(result_list)} results"] + plan.explain(1))
+
+
+def main():
+    from binary_index import BinaryIndex
+    from position_index import PositionIndex
+    from spelling import SpellingCorrector
+
+    parser = argparse.ArgumentParser(description="Explain the plan of queries read from the command line or stdin.")
+    parser.add_argument("queries", nargs="*")
+    parser.add_argument("--index", default="inverted_index.bin")
+    parser.add_argument("--bigram-index", default="inverted_bigram_index.bin")
+    parser.add_argument("--bigram-positions", default="bigram_positions.bin")
+    parser.add_argument("--spelling", default="spelling_dictionary.bin",
+                        help="empty to search the query words as typed")
+    parser.add_argument("--check-phrases", action="store_true",
+                        help="instead of explaining, check that both phrase strategies find the same documents")
+    args = parser.parse_args()
+
+    corrector = SpellingCorrector.load(args.spelling) if args.spelling else None
+    with BinaryIndex(args.index) as index, BinaryIndex(args.bigram_index) as bigram_index, \
+            PositionIndex(args.bigram_positions) as bigram_positions:
+        queries = args.queries or (line.strip() for line in sys.stdin)
+        if not args.check_phrases:
+            for query in queries:
+                print(explain(query, index, bigram_index, bigram_positions, corrector))
+            return
+        checked = mismatches = 0
+        for query in queries:
+            checked += 1
+            for phrase, intersected, scanned in compare_phrase_strategies(query, bigram_index, bigram_positions,
+                                                                          corrector):
+                mismatches += 1
+                print(f"MISMATCH {phrase!r}: {intersected} intersecting the lists, {scanned} scanning the rarest")
+        print(f"Checked {checked} queries, {mismatches} mismatching phrases")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
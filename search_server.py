@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import time
+from functools import partial
+from urllib.parse import urlsplit, parse_qs
+from binary_index import BinaryIndex
+from position_index import PositionIndex
+from advanced_query import top_k_query, preprocess_query
+from document_store import DocumentStore, query_snippet
+from segments import SegmentSet, manifest_file
+from query_cache import QueryCache
+from spelling import SpellingCorrector
+from analyzer import get_analyzer
+from metrics import enable_instrumentation, get_instrumentation, query_trace, stage, SlowQueryLog
+
+bookkeeping_input = "webpages_raw/bookkeeping.json"
+output_file = "inverted_index.bin"
+output_file_bigram = "inverted_bigram_index.bin"
+document_store_file = "document_store.bin"
+bigram_positions_file = 'bigram_positions.bin'
+spelling_file = 'spelling_dictionary.bin'
+
+DEFAULT_K = 20
+MAX_K = 1000
+STATUS_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                  500: "Internal Server Error"}
+
+
+class SearchService:
+    """
+    Everything a query needs, loaded once.
+
+    The service is created before the worker processes are forked, so the workers share the
+    memory-mapped index and document store files and, copy-on-write, the doc id lookup of the store.
+    """
+
+    def __init__(self, bookkeeping_input, output_file, output_file_bigram, document_store_file, bigram_positions_file,
+                 spelling_file=None, segments_directory=None):
+        self.bookkeeping_input = bookkeeping_input
+        if segments_directory:
+            # Incremental index: the segments replace the index, position and document store files
+            self.query_cache = QueryCache([manifest_file(segments_directory)])
+            segment_set = self.query_cache.watch(SegmentSet(segments_directory))
+            self.index = self.query_cache.wrap(segment_set.index("unigram"), "unigram")
+            self.bigram_index = self.query_cache.wrap(segment_set.index("bigram"), "bigram")
+            self.bigram_positions = segment_set.positions()
+            self.document_store = segment_set
+        else:
+            self.query_cache = QueryCache([output_file, output_file_bigram, bigram_positions_file,
+                                           document_store_file])
+            self.index = self.query_cache.wrap(BinaryIndex(output_file), "unigram")
+            self.bigram_index = self.query_cache.wrap(BinaryIndex(output_file_bigram), "bigram")
+            self.bigram_positions = self.query_cache.watch(PositionIndex(bigram_positions_file))
+            self.document_store = self.query_cache.watch(DocumentStore(document_store_file))
+            # Build the doc id -> doc number map of the store before the workers are forked
+            self.document_store.doc_number("")
+        self.corrector = SpellingCorrector.load(spelling_file) if spelling_file else None
+        # Load the NLTK word lists and lemmatizer now rather than once per worker
+        get_analyzer().analyze_query("search engine")
+
+    def search(self, query, k=DEFAULT_K):
+        start_time = time.perf_counter()
+        with query_trace(query):
+            doc_ids, total_hits = top_k_query(query, self.index, self.bigram_index, self.bigram_positions,
+                                              self.bookkeeping_input, k=k, cache=self.query_cache,
+                                              corrector=self.corrector)
+            with stage("render"):
+                query_terms = [term for term, _ in preprocess_query(query, self.corrector)]
+                results = [self.describe(doc_id, query_terms) for doc_id in doc_ids]
+        return {"query": query, "k": k, "total_hits": total_hits, "results": results,
+                "seconds": time.perf_counter() - start_time}
+
+    def describe(self, doc_id, query_terms=()):
+        # The description field keeps its name for existing clients; it now holds the query snippet
+        document = self.document_store.document(doc_id)
+        if document is None:
+            return {"doc_id": doc_id, "title": "", "description": "Description not available", "url": "https://"}
+        return {"doc_id": doc_id,
+                "title": document.title,
+                "description": query_snippet(document.body, query_terms) or "Description not available",
+                "url": "https://" + document.url}
+
+
+def route(service, method, target):
+    """
+    Answer one request, returning the HTTP status and the body: a JSON document, or the text of /metrics.
+    """
+    if method != "GET":
+        return 405, {"error": "only GET is supported"}
+    url = urlsplit(target)
+    if url.path == "/health":
+        return 200, {"status": "ok", "pid": os.getpid()}
+    if url.path == "/metrics":
+        # Every worker keeps its own registry; the metrics are those of the worker that answers
+        instrumentation = get_instrumentation()
+        if instrumentation is None:
+            return 404, {"error": "metrics are disabled, start the server with --metrics"}
+        return 200, instrumentation.registry.prometheus_text()
+    if url.path != "/search":
+        return 404, {"error": f"unknown path {url.path}"}
+
+    parameters = parse_qs(url.query)
+    query = parameters.get("q", [""])[0].strip()
+    if not query:
+        return 400, {"error": "missing query parameter q"}
+    try:
+        k = int(parameters.get("k", [DEFAULT_K])[0])
+    except ValueError:
+        return 400, {"error": "k must be an integer"}
+    if not 1 <= k <= MAX_K:
+        return 400, {"error": f"k must be between 1 and {MAX_K}"}
+    try:
+        return 200, service.search(query, k)
+    except Exception as error:
+        return 500, {"error": str(error)}
+
+
+def format_response(status, body, keep_alive):
+    if isinstance(body, str):
+        payload, content_type = body.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+    else:
+        payload, content_type = json.dumps(body).encode("utf-8"), "application/json; charset=utf-8"
+    head = (f"HTTP/1.1 {status} {STATUS_REASONS[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + payload
+
+
+async def handle_connection(service, reader, writer):
+    """
+    Serve the requests of one client connection, keeping it open between HTTP/1.1 requests.
+    Queries run on the event loop; parallelism comes from the worker processes.
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if "content-length" in headers:
+                await reader.readexactly(int(headers["content-length"]))
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) != 3:
+                status, body, version = 400, {"error": "malformed request line"}, "HTTP/1.0"
+            else:
+                method, target, version = parts
+                status, body = route(service, method, target)
+            keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            writer.write(format_response(status, body, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+def run_worker(service, server_socket):
+    async def serve_forever():
+        server = await asyncio.start_server(partial(handle_connection, service), sock=server_socket)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+def serve(service, host="127.0.0.1", port=8080, workers=1):
+    """
+    Serve the search API on host:port. With workers > 1 the listening socket and the loaded service are
+    inherited by forked worker processes that all accept connections; without fork (Windows) one process serves.
+    """
+    server_socket = socket.create_server((host, port), backlog=1024)
+    if workers <= 1 or not hasattr(os, "fork"):
+        run_worker(service, server_socket)
+        return
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(service, server_socket)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    finally:
+        server_socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve /search?q=...&k=... as JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--bookkeeping", default=bookkeeping_input)
+    parser.add_argument("--index", default=output_file)
+    parser.add_argument("--bigram-index", default=output_file_bigram)
+    parser.add_argument("--document-store", default=document_store_file)
+    parser.add_argument("--bigram-positions", default=bigram_positions_file)
+    parser.add_argument("--spelling", default=spelling_file, help="empty to search the query words as typed")
+    parser.add_argument("--segments", help="serve the segments of this directory instead of the index files")
+    parser.add_argument("--metrics", action="store_true", help="time every query stage and serve /metrics")
+    parser.add_argument("--slow-query-log", help="append queries slower than --slow-query-seconds to this file")
+    parser.add_argument("--slow-query-seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.metrics or args.slow_query_log:
+        enable_instrumentation(slow_query_log=SlowQueryLog(args.slow_query_log, args.slow_query_seconds)
+                               if args.slow_query_log else None)
+
+    start_time = time.time()
+    service = SearchService(args.bookkeeping, args.index, args.bigram_index, args.document_store, args.bigram_positions,
+                            args.spelling or None, args.segments)
+    print(f"Time for Loading Index: {time.time() - start_time} seconds")
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} worker(s)")
+    serve(service, args.host, args.port, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,727 @@
+import argparse
+import json
+import math
+import os
+import shutil
+import threading
+from contextlib import ExitStack
+from functools import lru_cache, partial
+from multiprocessing import Pool
+import numpy as np
+from binary_index import BinaryIndex, write_binary_index
+from position_index import PositionIndex, PositionIndexWriter
+from document_store import DocumentStore, DocumentStoreWriter
+from posting_list import PostingList
+from spelling import SpellingCorrector
+from compression import encode_vbyte_list
+from index_constructor import (load_json_data, index_documents, split_documents, merge_partial_maps,
+                               calculate_pagerank, DOCUMENTS_PER_CHUNK)
+
+# Directory layout:
+#   manifest.json    : the live segments in doc number order with the local doc numbers deleted from each, the
+#                      statistics generation, and the segment and fingerprint (link, file size and mtime) of every
+#                      indexed document
+#   segment_<n>/     : immutable once written; the unigram and bigram indexes hold only the frequencies and html tag
+#                      weights of the postings, next to the bigram positions, the document store and the out-links
+#   statistics_<g>/  : per segment, the global document frequency of every lexicon term and the tf-idf vector
+#                      length and PageRank weight of every document, from which queries compute the other weights
+MANIFEST_FILE = "manifest.json"
+SEGMENT_PREFIX = "segment_"
+STATISTICS_PREFIX = "statistics_"
+KINDS = ("unigram", "bigram")
+INDEX_FILES = {"unigram": "index.bin", "bigram": "bigram_index.bin"}
+POSITIONS_FILE = "bigram_positions.bin"
+DOCUMENT_STORE_FILE = "document_store.bin"
+LINKS_FILE = "links.json"
+STATISTICS = ("unigram_df", "bigram_df", "unigram_length", "bigram_length", "pagerank")
+# Segments with the same order of magnitude of live documents in this base form a tier; MERGE_FACTOR segments of
+# one tier are merged into one segment of the next
+MERGE_FACTOR = 4
+# A segment with a larger share of deleted documents is rewritten without them
+MAX_DELETED_SHARE = 0.3
+
+# Held while the manifest is read, changed and saved; one process at a time may update a segment directory
+manifest_lock = threading.Lock()
+# Segments being written by a merge, which must not be cleaned up as unused
+pending_segments = set()
+
+
+def manifest_file(directory):
+    return os.path.join(directory, MANIFEST_FILE)
+
+
+def load_manifest(directory):
+    if not os.path.exists(manifest_file(directory)):
+        return {"generation": 0, "next_segment": 0, "segments": [], "documents": {}}
+    with open(manifest_file(directory), "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_manifest(directory, manifest):
+    # Readers open whichever manifest is in place, so it is replaced in one step
+    temporary_file = manifest_file(directory) + ".tmp"
+    with open(temporary_file, "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+    os.replace(temporary_file, manifest_file(directory))
+
+
+def new_segment_name(manifest):
+    name = f"{SEGMENT_PREFIX}{manifest['next_segment']:06d}"
+    manifest["next_segment"] += 1
+    return name
+
+
+def statistics_file(directory, generation, segment_name, statistic):
+    return os.path.join(directory, f"{STATISTICS_PREFIX}{generation}", f"{segment_name}.{statistic}.npy")
+
+
+def document_fingerprint(directory_path, doc_id, link):
+    stat = os.stat(directory_path + doc_id)
+    return [link, stat.st_size, stat.st_mtime_ns]
+
+
+def live_mask(entry):
+    mask = np.ones(entry["doc_count"], dtype=bool)
+    mask[entry["deleted"]] = False
+    return mask
+
+
+def tf_idf_weights(frequency, idf):
+    """
+    tf_idf_weight of index_constructor for an array of frequencies.
+    """
+    return np.round((1 + np.log10(frequency)) * idf, 3)
+
+
+class Segment:
+    """
+    The files of one segment, opened read-only.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(os.path.normpath(path))
+        with ExitStack() as stack:
+            self.indexes = {kind: stack.enter_context(BinaryIndex(os.path.join(path, INDEX_FILES[kind])))
+                            for kind in KINDS}
+            self.positions = stack.enter_context(PositionIndex(os.path.join(path, POSITIONS_FILE)))
+            self.documents = stack.enter_context(DocumentStore(os.path.join(path, DOCUMENT_STORE_FILE)))
+            # Open: a missing file closes the ones before it
+            stack.pop_all()
+        self.doc_count = len(self.documents)
+
+    def links(self):
+        """
+        (doc id, link, out-links) of every document in doc number order.
+        """
+        with open(os.path.join(self.path, LINKS_FILE), "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def close(self):
+        for index in self.indexes.values():
+            index.close()
+        self.positions.close()
+        self.documents.close()
+
+
+def write_segment(documents, directory_path, segment_path, workers=1):
+    """
+    Parse the (doc_id, link) documents into a new segment; doc numbers follow the order of the list.
+    """
+    os.makedirs(segment_path)
+    doc_keys = [doc_id for doc_id, _ in documents]
+    doc_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(doc_keys)}
+    inverted_index = {}
+    inverted_bigram_index = {}
+    out_links = {}
+    position_writer = PositionIndexWriter()
+    chunks = split_documents(documents, DOCUMENTS_PER_CHUNK)
+    index_chunk = partial(index_documents, directory_path=directory_path, with_positions=(True, False),
+                          with_documents=True)
+
+    with ExitStack() as stack:
+        document_store_writer = stack.enter_context(
+            DocumentStoreWriter(os.path.join(segment_path, DOCUMENT_STORE_FILE), doc_keys))
+        if workers > 1:
+            partial_results = stack.enter_context(Pool(workers)).imap(index_chunk, chunks)
+        else:
+            partial_results = map(index_chunk, chunks)
+
+        for (partial_index, partial_bigram_index, _, _, partial_out_links, partial_bigram_positions, _,
+             partial_documents) in partial_results:
+            merge_partial_maps((inverted_index, inverted_bigram_index, out_links),
+                               (partial_index, partial_bigram_index, partial_out_links))
+            for doc_id, encoded_positions in partial_bigram_positions:
+                position_writer.add_document(doc_numbers[doc_id], encoded_positions)
+            for doc_id, record in partial_documents:
+                document_store_writer.add_document(doc_numbers[doc_id], record)
+
+    position_writer.write(os.path.join(segment_path, POSITIONS_FILE))
+    for kind, index in zip(KINDS, (inverted_index, inverted_bigram_index)):
+        write_binary_index(index, os.path.join(segment_path, INDEX_FILES[kind]), doc_keys)
+    with open(os.path.join(segment_path, LINKS_FILE), "w", encoding="utf-8") as file:
+        json.dump([[doc_id, link, out_links.get(link, [])] for doc_id, link in documents], file)
+
+
+def write_merged_segment(segments, masks, segment_path):
+    """
+    Copy the live documents of the segments, in order, into a new segment without parsing them again.
+    Returns the doc ids of the new segment.
+    """
+    os.makedirs(segment_path)
+    doc_keys = [segment.documents.doc_id(doc_number) for segment, mask in zip(segments, masks)
+                for doc_number in np.flatnonzero(mask).tolist()]
+
+    for kind in KINDS:
+        merged_index = {}
+        for segment, mask in zip(segments, masks):
+            index = segment.indexes[kind]
+            for term_number in range(index.term_count):
+                postings = index.read_postings(term_number)
+                live_positions = np.flatnonzero(mask[postings.doc_ids])
+                if len(live_positions):
+                    merged_index.setdefault(index.term_at(term_number), []).extend(postings.take(live_positions))
+        write_binary_index(merged_index, os.path.join(segment_path, INDEX_FILES[kind]), doc_keys)
+
+    position_writer = PositionIndexWriter()
+    offset = 0
+    for segment, mask in zip(segments, masks):
+        new_doc_numbers = (np.cumsum(mask) - 1 + offset).tolist()
+        positions = segment.positions
+        for term_number in range(positions.term_count):
+            term = positions.term_at(term_number)
+            doc_numbers, count_indexes, values = positions.read_term_directory(term)
+            for doc_number, count_index in zip(doc_numbers.tolist(), count_indexes.tolist()):
+                if mask[doc_number]:
+                    encoded = encode_vbyte_list(values[count_index:count_index + 1 + values[count_index]].tolist())
+                    position_writer.add_entry(term, new_doc_numbers[doc_number], encoded)
+        offset += int(mask.sum())
+    position_writer.write(os.path.join(segment_path, POSITIONS_FILE))
+
+    links = []
+    with DocumentStoreWriter(os.path.join(segment_path, DOCUMENT_STORE_FILE), doc_keys) as document_store_writer:
+        for segment, mask in zip(segments, masks):
+            segment_links = segment.links()
+            for doc_number in np.flatnonzero(mask).tolist():
+                document_store_writer.add_document(len(links), segment.documents.read_record(doc_number))
+                links.append(segment_links[doc_number])
+    with open(os.path.join(segment_path, LINKS_FILE), "w", encoding="utf-8") as file:
+        json.dump(links, file)
+    return doc_keys
+
+
+def refresh_statistics(directory, manifest, segments, pagerank_file=None, spelling_file=None):
+    """
+    Recompute the document frequencies, vector lengths and PageRank over the live documents of every segment
+    into a new statistics generation, reading the segment files only. Sets the generation of the manifest.
+    """
+    generation = manifest["generation"] + 1
+    os.makedirs(os.path.join(directory, f"{STATISTICS_PREFIX}{generation}"))
+    masks = [live_mask(entry) for entry in manifest["segments"]]
+    total_docs = int(sum(mask.sum() for mask in masks))
+
+    document_frequencies = {kind: {} for kind in KINDS}
+    for segment, entry, mask in zip(segments, manifest["segments"], masks):
+        for kind in KINDS:
+            index = segment.indexes[kind]
+            frequencies = document_frequencies[kind]
+            for term_number in range(index.term_count):
+                if entry["deleted"]:
+                    count = int(mask[index.read_doc_numbers(term_number)].sum())
+                else:
+                    count = index.lexicon_entry(term_number)[1]
+                if count:
+                    term = index.term_at(term_number)
+                    frequencies[term] = frequencies.get(term, 0) + count
+
+    out_links = {}
+    valid_links = {}
+    for segment, mask in zip(segments, masks):
+        for doc_number, (doc_id, link, links) in enumerate(segment.links()):
+            if mask[doc_number]:
+                valid_links[link] = doc_id
+                out_links[link] = links
+    pagerank = calculate_pagerank(out_links, valid_links, pagerank_file)
+
+    for segment, mask in zip(segments, masks):
+        statistics = {}
+        for kind in KINDS:
+            index = segment.indexes[kind]
+            frequencies = document_frequencies[kind]
+            df = np.array([frequencies.get(index.term_at(term_number), 0) for term_number in range(index.term_count)],
+                          dtype=np.int64)
+            squared_lengths = np.zeros(segment.doc_count)
+            for term_number in np.flatnonzero(df).tolist():
+                postings = index.read_postings(term_number)
+                live_positions = np.flatnonzero(mask[postings.doc_ids])
+                weights = tf_idf_weights(postings.frequency[live_positions], math.log10(total_docs / df[term_number]))
+                np.add.at(squared_lengths, postings.doc_ids[live_positions], weights ** 2)
+            statistics[f"{kind}_df"] = df
+            statistics[f"{kind}_length"] = np.sqrt(squared_lengths)
+        statistics["pagerank"] = np.array([pagerank.get(segment.documents.doc_id(doc_number), 0) if live else 0
+                                           for doc_number, live in enumerate(mask.tolist())], dtype=np.float64)
+        for statistic, values in statistics.items():
+            np.save(statistics_file(directory, generation, segment.name, statistic), values)
+
+    if spelling_file:
+        SpellingCorrector.from_frequencies(document_frequencies["unigram"]).save(spelling_file)
+    manifest["generation"] = generation
+
+
+def remove_unused_files(directory, manifest):
+    """
+    Delete the segments and statistics the manifest no longer refers to. Readers that still have them open
+    keep their memory maps.
+    """
+    segment_names = {entry["name"] for entry in manifest["segments"]}
+    current_statistics = f"{STATISTICS_PREFIX}{manifest['generation']}"
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith(SEGMENT_PREFIX) and name not in segment_names and name not in pending_segments:
+            shutil.rmtree(path)
+        elif name.startswith(STATISTICS_PREFIX) and name != current_statistics:
+            shutil.rmtree(path)
+        elif name == current_statistics:
+            for statistics_name in os.listdir(path):
+                if statistics_name.split(".")[0] not in segment_names:
+                    os.remove(os.path.join(path, statistics_name))
+
+
+def update_segments(bookkeeping_input, directory_path, segments_directory, workers=1, pagerank_file=None,
+                    spelling_file=None):
+    """
+    Bring the segments in line with bookkeeping_input: new and changed documents are parsed into one new segment,
+    the old versions of changed documents and the documents no longer listed are marked deleted, and the global
+    statistics are refreshed from the segment files. Unchanged documents are not parsed again.
+    Returns the number of documents indexed and removed.
+    """
+    with manifest_lock:
+        os.makedirs(segments_directory, exist_ok=True)
+        manifest = load_manifest(segments_directory)
+        documents = manifest["documents"]
+        json_data = load_json_data(bookkeeping_input)
+
+        new_documents = []
+        fingerprints = {}
+        for doc_id, link in json_data.items():
+            fingerprint = document_fingerprint(directory_path, doc_id, link)
+            if doc_id not in documents or documents[doc_id]["fingerprint"] != fingerprint:
+                new_documents.append((doc_id, link))
+                fingerprints[doc_id] = fingerprint
+        removed_doc_ids = [doc_id for doc_id in documents if doc_id not in json_data]
+
+        # Tombstone the documents that were removed or are about to be indexed again
+        entries = {entry["name"]: entry for entry in manifest["segments"]}
+        for doc_id in removed_doc_ids + [doc_id for doc_id in fingerprints if doc_id in documents]:
+            location = documents.pop(doc_id)
+            entries[location["segment"]]["deleted"].append(location["doc_number"])
+
+        if new_documents:
+            add_segment(manifest, segments_directory, new_documents, fingerprints, directory_path, workers)
+        print(f"Segments: {len(new_documents)} documents indexed, {len(removed_doc_ids)} removed")
+
+        if new_documents or removed_doc_ids or not manifest["generation"]:
+            publish_statistics(segments_directory, manifest, pagerank_file, spelling_file)
+        return len(new_documents), len(removed_doc_ids)
+
+
+def add_segment(manifest, segments_directory, documents, fingerprints, directory_path, workers=1):
+    """
+    Parse the (doc_id, link) documents into a new segment and add it to the manifest.
+    """
+    name = new_segment_name(manifest)
+    write_segment(documents, directory_path, os.path.join(segments_directory, name), workers)
+    manifest["segments"].append({"name": name, "doc_count": len(documents), "deleted": []})
+    for doc_number, (doc_id, _) in enumerate(documents):
+        manifest["documents"][doc_id] = {"segment": name, "doc_number": doc_number,
+                                         "fingerprint": fingerprints[doc_id]}
+    return name
+
+
+def publish_statistics(segments_directory, manifest, pagerank_file=None, spelling_file=None):
+    """
+    Refresh the statistics of the segments in the manifest, then save it and delete what it no longer uses.
+    """
+    segments = [Segment(os.path.join(segments_directory, entry["name"])) for entry in manifest["segments"]]
+    try:
+        refresh_statistics(segments_directory, manifest, segments, pagerank_file, spelling_file)
+    finally:
+        for segment in segments:
+            segment.close()
+    save_manifest(segments_directory, manifest)
+    remove_unused_files(segments_directory, manifest)
+
+
+def find_merge(manifest):
+    """
+    Merge policy: the names of the next segments to merge, or None. A segment with too many deleted documents
+    is rewritten on its own; otherwise the first MERGE_FACTOR segments of the smallest full tier are merged.
+    """
+    tiers = {}
+    for entry in manifest["segments"]:
+        if len(entry["deleted"]) > MAX_DELETED_SHARE * entry["doc_count"]:
+            return [entry["name"]]
+        live_count = entry["doc_count"] - len(entry["deleted"])
+        tiers.setdefault(int(math.log(max(live_count, 1), MERGE_FACTOR)), []).append(entry["name"])
+    for tier in sorted(tiers):
+        if len(tiers[tier]) >= MERGE_FACTOR:
+            return tiers[tier][:MERGE_FACTOR]
+    return None
+
+
+def merge_segments(segments_directory):
+    """
+    Merge segments until the merge policy finds nothing to merge; returns the number of merges. Queries and
+    updates go on during a merge: the new segment replaces its sources in one manifest change, and documents
+    deleted in the sources meanwhile are deleted in it.
+    """
+    merges = 0
+    while True:
+        with manifest_lock:
+            manifest = load_manifest(segments_directory)
+            names = find_merge(manifest)
+            if names is None:
+                return merges
+            name = new_segment_name(manifest)
+            pending_segments.add(name)
+            save_manifest(segments_directory, manifest)
+        try:
+            merge_segment(segments_directory, [entry for entry in manifest["segments"] if entry["name"] in names],
+                          name)
+        finally:
+            pending_segments.discard(name)
+        merges += 1
+
+
+def merge_segment(segments_directory, source_entries, name):
+    segments = [Segment(os.path.join(segments_directory, entry["name"])) for entry in source_entries]
+    try:
+        masks = [live_mask(entry) for entry in source_entries]
+        doc_keys = write_merged_segment(segments, masks, os.path.join(segments_directory, name))
+        # Doc number of every source document in the new segment, -1 if it was not copied
+        offsets = np.cumsum([0] + [int(mask.sum()) for mask in masks])
+        new_doc_numbers = [np.where(mask, np.cumsum(mask) - 1 + offset, -1) for mask, offset in zip(masks, offsets)]
+        with manifest_lock:
+            manifest = load_manifest(segments_directory)
+            publish_merge(segments_directory, manifest, segments, source_entries, new_doc_numbers, name,
+                          len(doc_keys))
+    finally:
+        for segment in segments:
+            segment.close()
+    print(f"Merged {', '.join(entry['name'] for entry in source_entries)} into {name}: {len(doc_keys)} documents")
+
+
+def publish_merge(segments_directory, manifest, segments, source_entries, new_doc_numbers, name, doc_count):
+    """
+    Replace the source segments with the merged one in the manifest, writing its statistics for the current
+    generation from those of the sources.
+    """
+    source_names = [entry["name"] for entry in source_entries]
+    current_entries = {entry["name"]: entry for entry in manifest["segments"]}
+    deleted = sorted(int(remap[doc_number]) for source_name, remap in zip(source_names, new_doc_numbers)
+                     for doc_number in current_entries[source_name]["deleted"] if remap[doc_number] >= 0)
+
+    if doc_count:
+        generation = manifest["generation"]
+        merged_segment = Segment(os.path.join(segments_directory, name))
+        try:
+            sources = [{statistic: np.load(statistics_file(segments_directory, generation, source_name, statistic))
+                        for statistic in STATISTICS} for source_name in source_names]
+            for kind in KINDS:
+                # A term has the same global document frequency in every segment
+                index = merged_segment.indexes[kind]
+                df = np.zeros(index.term_count, dtype=np.int64)
+                for term_number in range(index.term_count):
+                    term = index.term_at(term_number)
+                    for segment, statistics in zip(segments, sources):
+                        source_term_number = segment.indexes[kind].find_term(term)
+                        if source_term_number >= 0:
+                            df[term_number] = statistics[f"{kind}_df"][source_term_number]
+                            break
+                np.save(statistics_file(segments_directory, generation, name, f"{kind}_df"), df)
+            for statistic in ("unigram_length", "bigram_length", "pagerank"):
+                values = np.zeros(doc_count)
+                for statistics, remap in zip(sources, new_doc_numbers):
+                    values[remap[remap >= 0]] = statistics[statistic][remap >= 0]
+                np.save(statistics_file(segments_directory, generation, name, statistic), values)
+        finally:
+            merged_segment.close()
+    else:
+        # Every document of the sources was deleted
+        shutil.rmtree(os.path.join(segments_directory, name))
+
+    merged_entries = []
+    for entry in manifest["segments"]:
+        if entry["name"] == source_names[0] and doc_count:
+            merged_entries.append({"name": name, "doc_count": doc_count, "deleted": deleted})
+        elif entry["name"] not in source_names:
+            merged_entries.append(entry)
+    manifest["segments"] = merged_entries
+    remaps = dict(zip(source_names, new_doc_numbers))
+    for location in manifest["documents"].values():
+        if location["segment"] in remaps:
+            location["doc_number"] = int(remaps[location["segment"]][location["doc_number"]])
+            location["segment"] = name
+    save_manifest(segments_directory, manifest)
+    remove_unused_files(segments_directory, manifest)
+
+
+def start_background_merge(segments_directory):
+    """
+    Run merge_segments on a daemon thread and return the thread.
+    """
+    thread = threading.Thread(target=merge_segments, args=(segments_directory,), daemon=True)
+    thread.start()
+    return thread
+
+
+class SegmentSet:
+    """
+    Read-only snapshot of the segments listed in the manifest when it was opened; later updates and merges are
+    seen after reopening. Doc numbers run through the segments in manifest order, so the posting lists of the
+    segments concatenate into one sorted list, and deleted documents are dropped from every result.
+
+    With segment_names only those segments are opened, as one shard of the directory; the weights still come
+    from the statistics of the whole directory.
+    """
+
+    def __init__(self, segments_directory, cache_size=1024, segment_names=None):
+        self.directory = segments_directory
+        self.segment_names = segment_names
+        self.manifest = None
+        while True:
+            try:
+                # An update or merge deletes the files its new manifest no longer lists; in this process the lock
+                # keeps them until they are open, and open memory maps survive the deletion
+                with manifest_lock:
+                    self.open_segments()
+                break
+            except FileNotFoundError:
+                # Deleted by an update or merge in another process: open the manifest that replaced this one
+                self.close()
+                if load_manifest(segments_directory) == self.manifest:
+                    raise
+        self.doc_count = sum(entry["doc_count"] - len(entry["deleted"]) for entry in self.manifest["segments"])
+        self.bases = np.cumsum([0] + [segment.doc_count for segment in self.segments])
+        segment_numbers = {segment.name: number for number, segment in enumerate(self.segments)}
+        self.locations = {doc_id: (segment_numbers[location["segment"]], location["doc_number"])
+                          for doc_id, location in self.manifest["documents"].items()
+                          if location["segment"] in segment_numbers}
+        self.cache_size = cache_size
+
+    def open_segments(self):
+        self.segments = []
+        self.statistics = []
+        self.masks = []
+        self.manifest = load_manifest(self.directory)
+        generation = self.manifest["generation"]
+        for entry in self.manifest["segments"]:
+            if self.segment_names is not None and entry["name"] not in self.segment_names:
+                continue
+            self.segments.append(Segment(os.path.join(self.directory, entry["name"])))
+            self.statistics.append({statistic: np.load(statistics_file(self.directory, generation, entry["name"],
+                                                                       statistic), mmap_mode="r")
+                                    for statistic in STATISTICS})
+            self.masks.append(live_mask(entry))
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+    def reopen(self):
+        """
+        Open the segments of the current manifest in place of the snapshot.
+        """
+        self.close()
+        self.__init__(self.directory, self.cache_size, self.segment_names)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def index(self, kind):
+        return SegmentedIndex(self, kind, self.cache_size)
+
+    def positions(self):
+        return SegmentedPositionIndex(self)
+
+    def locate(self, doc_number):
+        """
+        Return the segment number and local doc number of a doc number.
+        """
+        segment_number = int(np.searchsorted(self.bases, doc_number, side="right")) - 1
+        return segment_number, doc_number - int(self.bases[segment_number])
+
+    def doc_key(self, doc_number):
+        segment_number, local_doc_number = self.locate(doc_number)
+        return self.segments[segment_number].documents.doc_id(local_doc_number)
+
+    def document(self, doc_id):
+        """
+        Return the Document of a doc id from the segment holding its live version, or None.
+        """
+        location = self.locations.get(doc_id)
+        if location is None:
+            return None
+        segment_number, doc_number = location
+        return self.segments[segment_number].documents.cached_document(doc_number)
+
+
+class SegmentedIndex:
+    """
+    Unigram or bigram index over a SegmentSet, looked up like a BinaryIndex. The tf-idf, normalized vector and
+    PageRank weights of the postings are computed from the global statistics as the lists are read.
+
+    A shard does not have every term of the directory; global_document_frequencies, set by the shard
+    coordinator for the terms of the current query, makes the terms it lacks present with no postings.
+    """
+    # Segment weights change with the global statistics, so segments have no champion lists
+    champion_size = 0
+
+    def __init__(self, segment_set, kind, cache_size=1024):
+        self.segment_set = segment_set
+        self.kind = kind
+        self.doc_count = segment_set.doc_count
+        self.global_document_frequencies = {}
+        self.read_postings = lru_cache(maxsize=cache_size)(self.read_postings)
+
+    def reopen(self):
+        """
+        Follow a reopened SegmentSet: its lists replace the cached ones.
+        """
+        self.doc_count = self.segment_set.doc_count
+        self.read_postings.cache_clear()
+
+    def __contains__(self, term):
+        return self.lookup(term) is not None
+
+    def __getitem__(self, term):
+        postings = self.lookup(term)
+        if postings is None:
+            raise KeyError(term)
+        return postings
+
+    def get(self, term, default=None):
+        postings = self.lookup(term)
+        return default if postings is None else postings
+
+    def lookup(self, term):
+        postings = self.read_postings(term)
+        df = self.global_document_frequencies.get(term)
+        if postings is None and df:
+            empty = np.empty(0)
+            return PostingList(np.empty(0, dtype=np.int64), empty, empty, empty, empty, empty,
+                               doc_key=self.segment_set.doc_key, idf=round(math.log10(self.doc_count / df), 3))
+        return postings
+
+    def document_frequency(self, term):
+        for segment, statistics in zip(self.segment_set.segments, self.segment_set.statistics):
+            term_number = segment.indexes[self.kind].find_term(term)
+            if term_number >= 0:
+                return int(statistics[f"{self.kind}_df"][term_number])
+        return self.global_document_frequencies.get(term, 0)
+
+    def idf(self, term):
+        df = self.document_frequency(term)
+        return round(math.log10(self.doc_count / df), 3) if df else 0
+
+    def score_bounds(self, term):
+        """
+        Return the largest static score and normalized vector weight among the postings of term.
+        """
+        postings = self.lookup(term)
+        if postings is None or not len(postings):
+            return 0, 0
+        static_scores = (0.5 * postings.tf_idf_score) + postings.html_tag_weight + postings.pagerank_weight
+        return float(static_scores.max()), float(postings.normalized_vector_weight.max())
+
+    def read_postings(self, term):
+        """
+        Return the live postings of term in every segment as one list, or None if no live document has it.
+        """
+        posting_lists = []
+        idf = None
+        segment_set = self.segment_set
+        for segment, statistics, mask, base in zip(segment_set.segments, segment_set.statistics, segment_set.masks,
+                                                   segment_set.bases.tolist()):
+            index = segment.indexes[self.kind]
+            term_number = index.find_term(term)
+            if term_number < 0:
+                continue
+            df = int(statistics[f"{self.kind}_df"][term_number])
+            if not df:
+                return None
+            idf = math.log10(self.doc_count / df)
+            postings = index.read_postings(term_number)
+            live_positions = np.flatnonzero(mask[postings.doc_ids])
+            doc_numbers = postings.doc_ids[live_positions]
+            frequency = postings.frequency[live_positions]
+            tf_idf_score = tf_idf_weights(frequency, idf)
+            lengths = statistics[f"{self.kind}_length"][doc_numbers]
+            normalized_vector_weight = np.round(np.divide(tf_idf_score, lengths, out=np.zeros(len(tf_idf_score)),
+                                                          where=lengths != 0), 3)
+            posting_lists.append(PostingList(doc_numbers + base, frequency, tf_idf_score,
+                                             postings.html_tag_weight[live_positions],
+                                             statistics["pagerank"][doc_numbers], normalized_vector_weight,
+                                             doc_key=segment_set.doc_key, idf=round(idf, 3)))
+        if idf is None:
+            return None
+        return PostingList.concatenate(posting_lists)
+
+    def intersect_doc_numbers(self, terms, candidates=None):
+        """
+        Return the sorted doc numbers of the live documents containing every term, only those among the sorted
+        candidates if given.
+        """
+        doc_numbers = []
+        segment_set = self.segment_set
+        for segment, mask, base in zip(segment_set.segments, segment_set.masks, segment_set.bases.tolist()):
+            local_candidates = None
+            if candidates is not None:
+                start, end = np.searchsorted(candidates, [base, base + segment.doc_count])
+                local_candidates = candidates[start:end] - base
+            local_doc_numbers = segment.indexes[self.kind].intersect_doc_numbers(terms, local_candidates)
+            doc_numbers.append(local_doc_numbers[mask[local_doc_numbers]] + base)
+        return np.concatenate(doc_numbers) if doc_numbers else np.empty(0, dtype=np.int64)
+
+
+class SegmentedPositionIndex:
+    """
+    Bigram positions over a SegmentSet, looked up like a PositionIndex.
+    """
+
+    def __init__(self, segment_set):
+        self.segment_set = segment_set
+
+    def positions(self, term, doc_number):
+        segment_number, local_doc_number = self.segment_set.locate(doc_number)
+        return self.segment_set.segments[segment_number].positions.positions(term, local_doc_number)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index new and changed pages into segments and merge them.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    update_parser = subparsers.add_parser("update", help="index the changes to the bookkeeping file")
+    update_parser.add_argument("--bookkeeping", default="webpages_raw/bookkeeping.json")
+    update_parser.add_argument("--directory", default="webpages_raw/")
+    update_parser.add_argument("--segments", default="segments/")
+    update_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    update_parser.add_argument("--pagerank", default="pagerank.json")
+    update_parser.add_argument("--spelling", default="spelling_dictionary.bin")
+    update_parser.add_argument("--no-merge", action="store_true", help="leave merging to a later merge command")
+    merge_parser = subparsers.add_parser("merge", help="merge segments as the merge policy chooses")
+    merge_parser.add_argument("--segments", default="segments/")
+    args = parser.parse_args()
+
+    if args.command == "update":
+        update_segments(args.bookkeeping, args.directory, args.segments, args.workers, args.pagerank or None,
+                        args.spelling or None)
+        if args.no_merge:
+            return
+    print(f"{merge_segments(args.segments)} merge(s)")
+
+
+if __name__ == "__main__":
+    main()
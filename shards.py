@@ -0,0 +1,249 @@
+import argparse
+import os
+import sys
+import time
+from multiprocessing import Pipe, Process
+import numpy as np
+from advanced_query import (preprocess_query, top_k_ranked_retrieval, query_bigram_pairs, top_k_bigram_lists,
+                            estimate_total_hits)
+from analyzer import get_analyzer
+from index_constructor import load_json_data
+from query_language import word_query, And, Or
+from segments import (SegmentSet, load_manifest, save_manifest, add_segment, publish_statistics, document_fingerprint,
+                      manifest_lock)
+from spelling import SpellingCorrector
+
+# A sharded index is a segment directory with one segment per shard. Documents are dealt to the shards in turn,
+# so every shard numbers its documents in bookkeeping order, and the statistics of the directory give every
+# shard the same idf, vector lengths and PageRank.
+WORD_OPERATORS = {"AND": And, "OR": Or}
+
+
+def build_shards(bookkeeping_input, directory_path, shards_directory, shard_count, workers=1, pagerank_file=None,
+                 spelling_file=None):
+    """
+    Partition the documents of bookkeeping_input into shard_count shards, each with its own index files, and
+    compute the global statistics over all of them.
+    """
+    with manifest_lock:
+        if os.path.exists(shards_directory) and os.listdir(shards_directory):
+            raise ValueError(f"{shards_directory} is not empty")
+        os.makedirs(shards_directory, exist_ok=True)
+        manifest = load_manifest(shards_directory)
+        documents = list(load_json_data(bookkeeping_input).items())
+        for shard in range(shard_count):
+            shard_documents = documents[shard::shard_count]
+            fingerprints = {doc_id: document_fingerprint(directory_path, doc_id, link)
+                            for doc_id, link in shard_documents}
+            name = add_segment(manifest, shards_directory, shard_documents, fingerprints, directory_path, workers)
+            print(f"Shard {shard}: {name}, {len(shard_documents)} documents")
+            save_manifest(shards_directory, manifest)
+        publish_statistics(shards_directory, manifest, pagerank_file, spelling_file)
+
+
+def query_terms(processed_query):
+    """
+    The unigram and bigram index terms a processed query looks up.
+    """
+    terms = [term for term, _ in processed_query]
+    if len(terms) == 1:
+        return {"unigram": terms, "bigram": []}
+    return {"unigram": [], "bigram": [first + " " + second for first, second in zip(terms, terms[1:])]}
+
+
+def shard_search(processed_query, k, index, bigram_index):
+    """
+    The k best results of the shard as (score, number of the first query bigram list holding the document,
+    doc id) and the shard's number of matching documents, which the coordinator estimates for queries of
+    three or more words.
+    """
+    total_hits = 0
+    if len(processed_query) == 1:
+        ranked_list, total_hits = top_k_ranked_retrieval(processed_query[0][0], index, k)
+        list_numbers = np.zeros(len(ranked_list), dtype=np.int64)
+    elif len(processed_query) == 2:
+        word = processed_query[0][0] + " " + processed_query[1][0]
+        ranked_list, total_hits = top_k_ranked_retrieval(word, bigram_index, k)
+        list_numbers = np.zeros(len(ranked_list), dtype=np.int64)
+    else:
+        # A single index breaks score ties by bigram list, then by doc number within the list
+        ranked_list, list_numbers, _ = top_k_bigram_lists(query_bigram_pairs(processed_query), bigram_index, k)
+    if not len(ranked_list):
+        return [], total_hits
+    results = list(zip(ranked_list.final_weight.tolist(), list_numbers.tolist(), ranked_list.doc_keys()))
+    return results, total_hits
+
+
+def shard_word_search(terms, operator, k, index, bigram_index, bigram_positions):
+    """
+    The k best results of the shard for a query without indexed bigrams, as for shard_search, and the shard's
+    number of documents holding all (operator "AND") or any ("OR") of the terms.
+    """
+    ranked_list = word_query(terms, index, bigram_index, bigram_positions, (WORD_OPERATORS[operator],))
+    if not len(ranked_list):
+        return [], 0
+    results = list(zip(ranked_list.final_weight.tolist(), [0] * len(ranked_list), ranked_list.doc_keys()))
+    return results[:k], len(ranked_list)
+
+
+def run_shard(shards_directory, segment_name, connection):
+    """
+    Shard worker: answers the coordinator's requests until it receives None.
+    """
+    with SegmentSet(shards_directory, segment_names=[segment_name]) as segment_set:
+        indexes = {kind: segment_set.index(kind) for kind in ("unigram", "bigram")}
+        bigram_positions = segment_set.positions()
+        get_analyzer()
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            command, arguments = request
+            try:
+                if command == "document_frequencies":
+                    response = {kind: {term: indexes[kind].document_frequency(term) for term in terms}
+                                for kind, terms in arguments.items()}
+                elif command == "words":
+                    response = shard_word_search(*arguments, indexes["unigram"], indexes["bigram"], bigram_positions)
+                else:
+                    processed_query, document_frequencies, k = arguments
+                    for kind, index in indexes.items():
+                        index.global_document_frequencies = document_frequencies[kind]
+                    response = shard_search(processed_query, k, indexes["unigram"], indexes["bigram"])
+            except Exception as error:
+                response = error
+            connection.send(response)
+    connection.close()
+
+
+class ShardCoordinator:
+    """
+    Runs one worker process per shard and answers queries by scatter-gather: the shards first report the
+    document frequencies of the query terms, so a shard without a term still uses its global idf, then every
+    shard ranks its own documents and the per-shard top k lists are merged. Ties are broken as in one index,
+    by bigram list and bookkeeping order, so the ranking does not depend on the number of shards.
+    """
+
+    def __init__(self, shards_directory, bookkeeping_input, spelling_file=None):
+        manifest = load_manifest(shards_directory)
+        self.doc_count = sum(entry["doc_count"] - len(entry["deleted"]) for entry in manifest["segments"])
+        self.positions = {doc_id: position for position, doc_id in enumerate(load_json_data(bookkeeping_input))}
+        self.corrector = SpellingCorrector.load(spelling_file) if spelling_file else None
+        self.connections = []
+        self.processes = []
+        for entry in manifest["segments"]:
+            connection, worker_connection = Pipe()
+            process = Process(target=run_shard, args=(shards_directory, entry["name"], worker_connection),
+                              daemon=True)
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def scatter(self, command, arguments):
+        for connection in self.connections:
+            connection.send((command, arguments))
+        responses = [connection.recv() for connection in self.connections]
+        for response in responses:
+            if isinstance(response, Exception):
+                raise response
+        return responses
+
+    def search(self, query, k=20):
+        """
+        Same results as top_k_query on a single index: the doc ids and the number, or for three or more words
+        the estimate, of matching documents.
+        """
+        processed_query = preprocess_query(query, self.corrector)
+        if not processed_query:
+            print("No Results Found! Try again.")
+            return [], 0
+        terms = query_terms(processed_query)
+        document_frequencies = {kind: {} for kind in terms}
+        for response in self.scatter("document_frequencies", terms):
+            for kind, frequencies in response.items():
+                for term, df in frequencies.items():
+                    document_frequencies[kind][term] = max(df, document_frequencies[kind].get(term, 0))
+        if len(processed_query) > 2 and not any(document_frequencies["bigram"].values()):
+            return self.word_search([term for term, _ in processed_query], k)
+
+        results = []
+        total_hits = 0
+        for shard_results, shard_hits in self.scatter("search", (processed_query, document_frequencies, k)):
+            results.extend(shard_results)
+            total_hits += shard_hits
+        if len(processed_query) > 2:
+            # The estimate only depends on the lengths of the whole bigram lists
+            total_hits = estimate_total_hits([document_frequencies["bigram"][bigram] for bigram in terms["bigram"]
+                                              if document_frequencies["bigram"][bigram]], self.doc_count)
+        results.sort(key=lambda result: (-result[0], result[1], self.positions[result[2]]))
+        return [doc_id for _, _, doc_id in results[:k]], total_hits
+
+    def word_search(self, terms, k):
+        """
+        Search for the words of a query none of whose bigrams is indexed: the documents holding all of them or,
+        if no shard has one, any of them.
+        """
+        for operator in WORD_OPERATORS:
+            responses = self.scatter("words", (terms, operator, k))
+            total_hits = sum(shard_hits for _, shard_hits in responses)
+            if total_hits:
+                break
+        results = [result for shard_results, _ in responses for result in shard_results]
+        results.sort(key=lambda result: (-result[0], self.positions[result[2]]))
+        return [doc_id for _, _, doc_id in results[:k]], total_hits
+
+    def advanced_query(self, query):
+        """
+        Every matching document, ranked.
+        """
+        return self.search(query, max(self.doc_count, 1))[0]
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+            connection.close()
+        for process in self.processes:
+            process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a sharded index or query it through a shard coordinator.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="partition the corpus into shards")
+    build_parser.add_argument("--bookkeeping", default="webpages_raw/bookkeeping.json")
+    build_parser.add_argument("--directory", default="webpages_raw/")
+    build_parser.add_argument("--shards-directory", default="shards/")
+    build_parser.add_argument("--shards", type=int, default=4)
+    build_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    build_parser.add_argument("--pagerank", default="pagerank.json")
+    build_parser.add_argument("--spelling", default="spelling_dictionary.bin")
+    query_parser = subparsers.add_parser("query", help="answer queries read from the command line or stdin")
+    query_parser.add_argument("queries", nargs="*")
+    query_parser.add_argument("--bookkeeping", default="webpages_raw/bookkeeping.json")
+    query_parser.add_argument("--shards-directory", default="shards/")
+    query_parser.add_argument("--spelling", default="spelling_dictionary.bin")
+    query_parser.add_argument("-k", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_shards(args.bookkeeping, args.directory, args.shards_directory, args.shards, args.workers,
+                     args.pagerank or None, args.spelling or None)
+        return
+    with ShardCoordinator(args.shards_directory, args.bookkeeping, args.spelling or None) as coordinator:
+        for query in args.queries or (line.strip() for line in sys.stdin):
+            start_time = time.time()
+            doc_ids, total_hits = coordinator.search(query, args.k)
+            print(f"{query}: {total_hits} results in {time.time() - start_time:.4f} seconds")
+            for rank, doc_id in enumerate(doc_ids, start=1):
+                print(f"{rank}: {doc_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import heapq
+import os
+import tempfile
+from itertools import groupby
+
+# Most runs merged at once, so that a merge holds at most this many files and read buffers
+MERGE_FAN_IN = 64
+# Read buffer of every run during a merge
+RUN_BUFFER_SIZE = 64 * 1024
+
+
+def merge_runs(runs):
+    """
+    Merge the term-sorted entries of several runs, yielding every term with its entries in run order.
+    The runs hold consecutive doc number ranges, so run order is doc number order.
+    """
+    merged = heapq.merge(*runs, key=lambda entry: entry[0])
+    for term, entries in groupby(merged, key=lambda entry: entry[0]):
+        yield term, list(entries)
+
+
+def reduce_runs(runs, merge_run_files, write_run_entry, directory):
+    """
+    Merge groups of MERGE_FAN_IN consecutive runs into intermediate runs in directory, pass after pass, until
+    at most MERGE_FAN_IN runs are left for the final merge. merge_run_files(filenames) yields the merged run
+    entries of its files and write_run_entry(file, entry) writes one. The list of runs is updated in place:
+    every merged group is removed and replaced by its intermediate run, which keeps run order.
+    """
+    while len(runs) > MERGE_FAN_IN:
+        print(f"Merging {len(runs)} runs in groups of {MERGE_FAN_IN}")
+        position = 0
+        while position < len(runs) - 1:
+            group = runs[position:position + MERGE_FAN_IN]
+            descriptor, filename = tempfile.mkstemp(prefix="merged-", suffix=".run", dir=directory)
+            try:
+                with os.fdopen(descriptor, "wb") as file:
+                    for entry in merge_run_files(group):
+                        write_run_entry(file, entry)
+            except BaseException:
+                os.remove(filename)
+                raise
+            runs[position:position + MERGE_FAN_IN] = [filename]
+            for run in group:
+                os.remove(run)
+            position += 1
@@ -0,0 +1,200 @@
+import mmap
+import struct
+import numpy as np
+from binary_index import write_blob, find_sorted_term, replacing_file, OFFSET_FORMAT
+
+# File layout (all integers little-endian), in file order:
+#   header         : magic, version, max edit distance, prefix length, term count, delete count and the absolute
+#                    offset of every section
+#   term offsets   : (term count + 1) u64 offsets into the term blob, terms sorted by their utf-8 bytes
+#   term blob      : utf-8 terms
+#   frequencies    : u32 document frequency of every term
+#   delete offsets : (delete count + 1) u64 offsets into the delete blob, deletes sorted by their utf-8 bytes
+#   delete blob    : utf-8 deletes
+#   term ranges    : (delete count + 1) u32 offsets into the term numbers
+#   term numbers   : u32 numbers of the terms every delete points to, delete after delete
+# The tables are memory-mapped and searched in place, so loading the dictionary does not grow with the vocabulary.
+MAGIC = b"SESP"
+VERSION = 1
+HEADER_FORMAT = struct.Struct("<4sIIIII7Q")
+OFFSET_PAIR_FORMAT = struct.Struct("<QQ")
+COUNT_DTYPE = np.dtype("<u4")
+
+
+def edit_distance(source, target, max_distance):
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent transpositions).
+    Returns max_distance + 1 as soon as the distance is known to exceed max_distance.
+    """
+    if abs(len(source) - len(target)) > max_distance:
+        return max_distance + 1
+    previous_previous = None
+    previous = list(range(len(target) + 1))
+    for i in range(1, len(source) + 1):
+        current = [i] + [0] * len(target)
+        for j in range(1, len(target) + 1):
+            cost = 0 if source[i - 1] == target[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and source[i - 1] == target[j - 2] and source[i - 2] == target[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+def generate_deletes(word, max_distance):
+    """
+    Return every string obtained by deleting up to max_distance characters from word.
+    """
+    deletes = set()
+    frontier = {word}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for candidate in frontier:
+            for i in range(len(candidate)):
+                deleted = candidate[:i] + candidate[i + 1:]
+                if deleted not in deletes:
+                    deletes.add(deleted)
+                    next_frontier.add(deleted)
+        frontier = next_frontier
+    return deletes
+
+
+class SpellingCorrector:
+    """
+    Symmetric-delete (SymSpell) corrector over the index vocabulary.
+
+    Every term is stored with its document frequency, and the deletes of its first prefix_length
+    characters point back to it. A query word is corrected to the indexed term with the smallest
+    edit distance, preferring higher document frequency; words that are already indexed are kept.
+    A built corrector holds both in dicts; a loaded one looks them up in the memory-mapped file.
+    """
+
+    def __init__(self, term_frequencies, deletes, max_edit_distance=2, prefix_length=7):
+        self.term_frequencies = term_frequencies
+        self.deletes = deletes
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length
+
+    @classmethod
+    def from_frequencies(cls, term_frequencies, max_edit_distance=2, prefix_length=7):
+        deletes = {}
+        for term in term_frequencies:
+            prefix = term[:prefix_length]
+            for deleted in generate_deletes(prefix, max_edit_distance) | {prefix}:
+                deletes.setdefault(deleted, []).append(term)
+        return cls(dict(term_frequencies), deletes, max_edit_distance, prefix_length)
+
+    @classmethod
+    def from_index(cls, index, max_edit_distance=2, prefix_length=7):
+        return cls.from_frequencies({term: index.document_frequency(term) for term in index},
+                                    max_edit_distance, prefix_length)
+
+    def save(self, filename):
+        """
+        Write a built corrector in the memory-mapped format read by load.
+        """
+        terms = sorted(self.term_frequencies)
+        term_numbers = {term: number for number, term in enumerate(terms)}
+        deletes = sorted(self.deletes)
+        term_ranges = np.cumsum([0] + [len(self.deletes[deleted]) for deleted in deletes], dtype=COUNT_DTYPE)
+        delete_terms = np.fromiter((term_numbers[term] for deleted in deletes for term in self.deletes[deleted]),
+                                   dtype=COUNT_DTYPE, count=int(term_ranges[-1]))
+        with replacing_file(filename) as file:
+            file.seek(HEADER_FORMAT.size)
+            term_offsets_pos = file.tell()
+            write_blob(file, [term.encode("utf-8") for term in terms])
+            term_blob_pos = term_offsets_pos + OFFSET_FORMAT.size * (len(terms) + 1)
+            frequencies_pos = file.tell()
+            file.write(np.array([self.term_frequencies[term] for term in terms], dtype=COUNT_DTYPE).tobytes())
+            delete_offsets_pos = file.tell()
+            write_blob(file, [deleted.encode("utf-8") for deleted in deletes])
+            delete_blob_pos = delete_offsets_pos + OFFSET_FORMAT.size * (len(deletes) + 1)
+            term_ranges_pos = file.tell()
+            file.write(term_ranges.tobytes())
+            term_numbers_pos = file.tell()
+            file.write(delete_terms.tobytes())
+            file.seek(0)
+            file.write(HEADER_FORMAT.pack(MAGIC, VERSION, self.max_edit_distance, self.prefix_length, len(terms),
+                                          len(deletes), term_offsets_pos, term_blob_pos, frequencies_pos,
+                                          delete_offsets_pos, delete_blob_pos, term_ranges_pos, term_numbers_pos))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Open a dictionary written by save; its tables are looked up in the memory-mapped file.
+        """
+        with open(filename, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, max_edit_distance, prefix_length, term_count, delete_count, term_offsets_pos,
+         term_blob_pos, frequencies_pos, delete_offsets_pos, delete_blob_pos, term_ranges_pos,
+         term_numbers_pos) = HEADER_FORMAT.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            buffer.close()
+            raise ValueError(f"{filename} is not a spelling dictionary (version {VERSION})")
+        frequencies = np.frombuffer(buffer, dtype=COUNT_DTYPE, count=term_count, offset=frequencies_pos)
+        term_ranges = np.frombuffer(buffer, dtype=COUNT_DTYPE, count=delete_count + 1, offset=term_ranges_pos)
+        term_numbers = np.frombuffer(buffer, dtype=COUNT_DTYPE, count=int(term_ranges[-1]), offset=term_numbers_pos)
+        term_frequencies = MappedTable(buffer, term_count, term_offsets_pos, term_blob_pos,
+                                       lambda number: int(frequencies[number]))
+        deletes = MappedTable(buffer, delete_count, delete_offsets_pos, delete_blob_pos,
+                              lambda number: [term_frequencies.key(term_number) for term_number
+                                              in term_numbers[term_ranges[number]:term_ranges[number + 1]].tolist()])
+        return cls(term_frequencies, deletes, max_edit_distance, prefix_length)
+
+    def correct(self, word):
+        if word in self.term_frequencies or len(word) < 2 or not word.isalpha():
+            return word
+        prefix = word[:self.prefix_length]
+        best_term, best_key = word, None
+        checked = set()
+        for deleted in generate_deletes(prefix, self.max_edit_distance) | {prefix}:
+            for term in self.deletes.get(deleted, []):
+                if term in checked:
+                    continue
+                checked.add(term)
+                distance = edit_distance(word, term, self.max_edit_distance)
+                if distance > self.max_edit_distance:
+                    continue
+                key = (distance, -self.term_frequencies[term], term)
+                if best_key is None or key < best_key:
+                    best_term, best_key = term, key
+        return best_term
+
+
+class MappedTable:
+    """
+    Read-only mapping over keys sorted by their utf-8 bytes in a memory-mapped buffer, as written by write_blob,
+    found by binary search; value(key number) returns the value of a key.
+    """
+
+    def __init__(self, buffer, count, offsets_pos, blob_pos, value):
+        self.buffer = buffer
+        self.count = count
+        self.offsets_pos = offsets_pos
+        self.blob_pos = blob_pos
+        self.value = value
+
+    def key_bytes(self, number):
+        start, end = OFFSET_PAIR_FORMAT.unpack_from(self.buffer, self.offsets_pos + OFFSET_FORMAT.size * number)
+        return self.buffer[self.blob_pos + start:self.blob_pos + end]
+
+    def key(self, number):
+        return self.key_bytes(number).decode("utf-8")
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return find_sorted_term(self.key_bytes, self.count, key) >= 0
+
+    def __getitem__(self, key):
+        number = find_sorted_term(self.key_bytes, self.count, key)
+        if number < 0:
+            raise KeyError(key)
+        return self.value(number)
+
+    def get(self, key, default=None):
+        number = find_sorted_term(self.key_bytes, self.count, key)
+        return default if number < 0 else self.value(number)
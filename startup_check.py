@@ -0,0 +1,98 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+# Modules only the index builder needs; importing the query path must not load them
+BUILD_ONLY_MODULES = ("bs4", "scipy")
+IMPORT_BUDGET_SECONDS = 1.0
+FIRST_QUERY_BUDGET_SECONDS = 5.0
+
+# Runs in a fresh interpreter so that nothing is already imported or cached; imports what the GUI imports
+PROBE = r"""
+import json
+import sys
+import time
+
+start_time = time.perf_counter()
+from binary_index import BinaryIndex
+from position_index import PositionIndex
+from advanced_query import top_k_query, preprocess_query
+from document_store import DocumentStore, query_snippet
+from segments import SegmentSet, manifest_file
+from query_cache import QueryCache
+from spelling import SpellingCorrector
+from metrics import query_trace, stage
+report = {"import_seconds": time.perf_counter() - start_time,
+          "build_only_modules_loaded": [name for name in json.loads(sys.argv[1]) if name in sys.modules]}
+
+if len(sys.argv) > 2:
+    output_file, output_file_bigram, bigram_positions_file, query = sys.argv[2:6]
+    start_time = time.perf_counter()
+    query_cache = QueryCache([output_file, output_file_bigram, bigram_positions_file])
+    index = query_cache.wrap(BinaryIndex(output_file), "unigram")
+    bigram_index = query_cache.wrap(BinaryIndex(output_file_bigram), "bigram")
+    bigram_positions = PositionIndex(bigram_positions_file)
+    report["load_seconds"] = time.perf_counter() - start_time
+    top_k_query(query, index, bigram_index, bigram_positions, None, k=20, cache=query_cache)
+    report["first_query_seconds"] = time.perf_counter() - start_time
+print(json.dumps(report))
+"""
+
+
+def measure_startup(output_file=None, output_file_bigram=None, bigram_positions_file=None, query="computer science"):
+    """
+    Start a new interpreter, import the query path and optionally answer one query,
+    returning the measured times in seconds.
+    """
+    command = [sys.executable, "-c", PROBE, json.dumps(BUILD_ONLY_MODULES)]
+    if output_file is not None:
+        command += [output_file, output_file_bigram, bigram_positions_file, query]
+    start_time = time.perf_counter()
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"startup probe failed:\n{completed.stderr}")
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    report["process_seconds"] = time.perf_counter() - start_time
+    return report
+
+
+def check_startup_budget(report, import_budget=IMPORT_BUDGET_SECONDS, first_query_budget=FIRST_QUERY_BUDGET_SECONDS):
+    """
+    Return the list of budget violations in a report from measure_startup.
+    """
+    failures = []
+    if report["build_only_modules_loaded"]:
+        failures.append(f"query path imports build-only modules: {report['build_only_modules_loaded']}")
+    if report["import_seconds"] > import_budget:
+        failures.append(f"import took {report['import_seconds']:.3f}s, budget is {import_budget}s")
+    if "first_query_seconds" in report and report["first_query_seconds"] > first_query_budget:
+        failures.append(f"time to first query was {report['first_query_seconds']:.3f}s, "
+                        f"budget is {first_query_budget}s")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check import time and time to first query against a budget.")
+    parser.add_argument("--index", help="binary unigram index; without the index files only imports are measured")
+    parser.add_argument("--bigram-index", help="binary bigram index, required with --index")
+    parser.add_argument("--bigram-positions", help="bigram position file, required with --index")
+    parser.add_argument("--query", default="computer science")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET_SECONDS)
+    parser.add_argument("--first-query-budget", type=float, default=FIRST_QUERY_BUDGET_SECONDS)
+    args = parser.parse_args()
+    index_files = (args.index, args.bigram_index, args.bigram_positions)
+    if any(index_files) and not all(index_files):
+        parser.error("--index, --bigram-index and --bigram-positions must be given together")
+
+    report = measure_startup(args.index, args.bigram_index, args.bigram_positions, args.query)
+    print(json.dumps(report, indent=2))
+    failures = check_startup_budget(report, args.import_budget, args.first_query_budget)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()